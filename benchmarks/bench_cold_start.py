@@ -0,0 +1,141 @@
+"""
+Cold-start benchmark: how long until a fresh ``python bot.py`` process has
+its web port bound, has fetched its first update and has sent its first
+reply.
+
+A fake Bot API (with one update already waiting) and a fake AI backend run
+in this process; the bot is started as a subprocess pointed at them via
+TELEGRAM_API_URL and AI_API_URL. Timings are medians over --runs.
+
+Usage:
+    python benchmarks/bench_cold_start.py [--runs 5] [--script bot.py]
+        [--ai-latency 0.05] [--health-latency 0]
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from aiohttp import web  # noqa: E402
+
+from bench_replay import free_port  # noqa: E402
+from fake_ai_backend import make_app as make_ai_app  # noqa: E402
+from fake_telegram_api import FakeTelegramAPI  # noqa: E402
+
+
+def start_servers(telegram, ai_latency, health_latency):
+    tg_port, ai_port = free_port(), free_port()
+    ready = threading.Event()
+
+    async def serve():
+        ai_app = make_ai_app(latency=ai_latency, reply_chars=300)
+        if health_latency:
+            async def slow_health(request):  # A sleeping free-tier backend waking up
+                await asyncio.sleep(health_latency)
+                return web.json_response({"status": "ok"})
+            ai_app.router._resources = [r for r in ai_app.router._resources if r.canonical != "/health"]
+            ai_app.router.add_get("/health", slow_health)
+        for app, port in ((telegram.make_app(), tg_port), (ai_app, ai_port)):
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", port).start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    threading.Thread(target=lambda: asyncio.run(serve()), daemon=True).start()
+    ready.wait(10)
+    return tg_port, ai_port
+
+
+def port_open(port):
+    with socket.socket() as s:
+        s.settimeout(0.05)
+        return s.connect_ex(("127.0.0.1", port)) == 0
+
+
+def one_run(script, tg_port, ai_port, telegram, chat_id, timeout=30):
+    workdir = tempfile.mkdtemp(prefix="bench_cold_")
+    web_port = free_port()
+    env = dict(
+        os.environ,
+        TELEGRAM_TOKEN="123456:COLDSTART",
+        TELEGRAM_API_URL=f"http://127.0.0.1:{tg_port}",
+        AI_API_URL=f"http://127.0.0.1:{ai_port}",
+        PORT=str(web_port),
+        LOG_LEVEL="WARNING",
+        JOBS_DB_PATH=os.path.join(workdir, "jobs.db"),
+        RESPONSE_CACHE_PATH=os.path.join(workdir, "cache.db"),
+        MEMORY_STORE_PATH=os.path.join(workdir, "memory.db"),
+    )
+    telegram.push({"message": {
+        "message_id": 1, "date": int(time.time()), "text": "hello bhai",
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Cold"},
+    }})
+    time.sleep(0.2)  # Let a previous run's orphaned long poll pick it up first...
+    telegram.first_call_at.clear()
+    telegram.served_at.clear()  # ...and forget that, so only this process counts
+
+    started = time.monotonic()
+    process = subprocess.Popen([sys.executable, script], env=env, cwd=workdir,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    bound = None
+    try:
+        while time.monotonic() - started < timeout:
+            if bound is None and port_open(web_port):
+                bound = time.monotonic() - started
+            if "sendMessage" in telegram.first_call_at and bound is not None:
+                break
+            time.sleep(0.005)
+    finally:
+        process.terminate()
+        try:
+            process.wait(5)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def since_start(t):
+        return None if t is None else t - started
+    first_update = since_start(min(telegram.served_at.values())) if telegram.served_at else None
+    return {
+        "port_bound": bound,
+        "first_update": first_update,
+        "first_reply": since_start(telegram.first_call_at.get("sendMessage")),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure bot.py cold-start phases")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--script", default=os.path.join(os.path.dirname(BENCH_DIR), "bot.py"))
+    parser.add_argument("--ai-latency", type=float, default=0.05)
+    parser.add_argument("--health-latency", type=float, default=0.0,
+                        help="delay on the backend /health (simulates a sleeping backend)")
+    args = parser.parse_args()
+
+    telegram = FakeTelegramAPI(latency=0.01)
+    tg_port, ai_port = start_servers(telegram, args.ai_latency, args.health_latency)
+
+    runs = [one_run(args.script, tg_port, ai_port, telegram, chat_id=5000 + i) for i in range(args.runs)]
+    print(f"⏱️ {os.path.basename(args.script)} - median of {args.runs} cold starts (seconds from spawn)")
+    for phase in ("port_bound", "first_update", "first_reply"):
+        values = [r[phase] for r in runs if r[phase] is not None]
+        if values:
+            print(f"  {phase:<13} {statistics.median(values):7.3f}  (min {min(values):.3f}, max {max(values):.3f})")
+        else:
+            print(f"  {phase:<13}     n/a")
+
+
+if __name__ == "__main__":
+    main()
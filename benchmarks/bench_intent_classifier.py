@@ -0,0 +1,109 @@
+"""
+Intent classifier evaluation: char n-gram model vs the keyword matcher.
+
+Trains a model on the training split of the labelled corpus (see
+train_intent_model.py) and scores the held-out messages with the keyword
+recognizer, the bare model, and the model with keyword fallback that the
+bot runs (INTENT_CLASSIFIER=model). It reports accuracy, how many messages
+were sent to the expensive deep_thinking tier by mistake (and how many
+deep_thinking requests were missed), per-intent recall and the
+classification time per message.
+
+Usage:
+    python benchmarks/bench_intent_classifier.py [--corpus benchmarks/intent_corpus.tsv]
+        [--model intent_model.json] [--min-confidence 0.5] [--rounds 5]
+
+--model scores a saved model file instead of training one; unless it was
+trained with --holdout, the held-out split is then in-sample.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import AdvancedIntentRecognizer, ModelIntentRecognizer, NgramIntentModel  # noqa: E402
+from train_intent_model import DEFAULT_CORPUS, load_corpus, split_corpus, train  # noqa: E402
+
+
+class _BareModel:
+    """The model alone, no confidence threshold"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def recognize_intent(self, text):
+        return {"type": self.model.predict(text)[0]}
+
+
+def evaluate(name, recognizer, test, rounds):
+    predicted = [recognizer.recognize_intent(text)["type"] for _, text in test]
+    correct = sum(p == label for p, (label, _) in zip(predicted, test))
+    wrongly_deep = sum(p == "deep_thinking" and label != "deep_thinking" for p, (label, _) in zip(predicted, test))
+    missed_deep = sum(p != "deep_thinking" and label == "deep_thinking" for p, (label, _) in zip(predicted, test))
+    hits = Counter(label for p, (label, _) in zip(predicted, test) if p == label)
+
+    def classify_all():
+        for _, text in test:
+            recognizer.recognize_intent(text)
+
+    seconds = min(timeit.repeat(classify_all, number=1, repeat=rounds))
+    return {
+        "name": name,
+        "accuracy": correct / len(test),
+        "wrongly_deep": wrongly_deep,
+        "missed_deep": missed_deep,
+        "hits": hits,
+        "us_per_msg": seconds * 1e6 / len(test)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--model", help="evaluate this model file instead of training on the split")
+    parser.add_argument("--min-confidence", type=float, default=0.5)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    train_set, test = split_corpus(load_corpus(args.corpus))
+    if args.model:
+        model = NgramIntentModel.load(args.model)
+    else:
+        model = train(train_set)
+
+    keyword = AdvancedIntentRecognizer()
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = os.path.join(tmp, "intent_model.json")
+        model.save(model_path)
+        hybrid = ModelIntentRecognizer(model_path, keyword, min_confidence=args.min_confidence)
+        if not hybrid.reload() or hybrid.model is None:
+            sys.exit(f"❌ Could not load the model saved to {model_path}")
+    results = [
+        evaluate("keyword matcher", keyword, test, args.rounds),
+        evaluate("n-gram model", _BareModel(model), test, args.rounds),
+        evaluate(f"model + fallback (<{args.min_confidence})", hybrid, test, args.rounds),
+    ]
+
+    totals = Counter(label for label, _ in test)
+    print(f"🧭 {len(train_set)} training / {len(test)} held-out messages, {len(model.weights)} model features")
+    print(f"   held-out: {dict(sorted(totals.items()))}")
+    print()
+    print(f"{'classifier':<30} {'accuracy':>9} {'wrongly deep':>13} {'missed deep':>12} {'µs/msg':>8}")
+    for r in results:
+        print(f"{r['name']:<30} {r['accuracy']:>9.1%} {r['wrongly_deep']:>13} {r['missed_deep']:>12} {r['us_per_msg']:>8.1f}")
+    print()
+    print("recall per intent:")
+    print(f"{'intent':<15}" + "".join(f"{r['name'][:22]:>24}" for r in results))
+    for intent in sorted(totals):
+        print(f"{intent:<15}" + "".join(f"{r['hits'][intent] / totals[intent]:>24.0%}" for r in results))
+    print()
+    print(f"fallback share: {hybrid.by_source['keyword'] / max(1, sum(hybrid.by_source.values())):.1%} of messages")
+
+
+if __name__ == "__main__":
+    main()
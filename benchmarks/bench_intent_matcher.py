@@ -0,0 +1,124 @@
+"""
+Intent matcher benchmark: compiled single-scan matcher vs the old keyword loop.
+
+Builds a seeded corpus of mixed Hindi/English messages, checks that both
+implementations pick the same intent for every message, then times them on
+the shipped keyword table and on one padded with synthetic keywords (the old
+loop's cost grows with every keyword added; the compiled scan stays flat).
+
+Usage:
+    python benchmarks/bench_intent_matcher.py [--messages 5000] [--rounds 5] [--extra-keywords 80]
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import AdvancedIntentRecognizer  # noqa: E402
+
+FILLER_EN = [
+    "please", "the", "my", "for", "today", "about", "with", "friend", "weather",
+    "tomorrow", "market", "system", "login", "future", "mountain", "sunset",
+    "story", "quick", "question", "cricket", "match", "office", "bro", "thanks"
+]
+FILLER_HI = [
+    "मेरा", "क्या", "है", "आज", "के", "लिए", "भाई", "कल", "मौसम", "बताओ",
+    "अच्छा", "एक", "कहानी", "दोस्त", "ज़रा", "प्लीज़", "mein", "kya", "karo", "yaar"
+]
+
+
+def legacy_recognize_intent(intents, text):
+    """The original two-pass keyword loop, kept verbatim for comparison"""
+    text_lower = text.lower()
+    
+    for intent, data in intents.items():
+        if data["type"] == "deep_thinking":
+            for keyword in data["keywords"]:
+                if keyword.lower() in text_lower:
+                    return {"intent": intent, "type": "deep_thinking", "confidence": 0.95}
+    
+    for intent, data in intents.items():
+        if data["type"] != "deep_thinking":
+            for keyword in data["keywords"]:
+                if keyword.lower() in text_lower:
+                    return {"intent": intent, "type": data["type"], "confidence": 0.85}
+    
+    return {"intent": "general_query", "type": "chat", "confidence": 0.5}
+
+
+def build_corpus(intents, size, seed=42):
+    rng = random.Random(seed)
+    keywords = [kw for data in intents.values() for kw in data["keywords"]]
+    corpus = []
+    for _ in range(size):
+        words = [rng.choice(FILLER_EN + FILLER_HI) for _ in range(rng.randint(3, 40))]
+        # Roughly a third of real traffic carries no keyword at all
+        for _ in range(rng.choice([0, 0, 1, 1, 2, 3])):
+            words.insert(rng.randrange(len(words) + 1), rng.choice(keywords))
+        text = " ".join(words)
+        corpus.append(text.capitalize() if rng.random() < 0.3 else text)
+    return corpus
+
+
+def pad_keywords(recognizer, per_intent, seed=7):
+    rng = random.Random(seed)
+    for data in recognizer.intents.values():
+        data["keywords"] = data["keywords"] + [
+            "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 9)))
+            for _ in range(per_intent)
+        ]
+    recognizer.compile()
+
+
+def run(recognizer, corpus, rounds, label):
+    mismatches = 0
+    for text in corpus:
+        new = recognizer.recognize_intent(text)
+        old = legacy_recognize_intent(recognizer.intents, text)
+        if (new["intent"], new["type"], new["confidence"]) != (old["intent"], old["type"], old["confidence"]):
+            mismatches += 1
+    
+    def run_legacy():
+        for text in corpus:
+            legacy_recognize_intent(recognizer.intents, text)
+    
+    def run_compiled():
+        for text in corpus:
+            recognizer.recognize_intent(text)
+    
+    legacy = min(timeit.repeat(run_legacy, number=1, repeat=rounds))
+    compiled = min(timeit.repeat(run_compiled, number=1, repeat=rounds))
+    keywords = sum(len(data["keywords"]) for data in recognizer.intents.values())
+    
+    print(f"[{label}] {keywords} keywords, {len(corpus)} messages (best of {rounds})")
+    print(f"  mismatches: {mismatches}")
+    print(f"  legacy:     {legacy * 1e6 / len(corpus):8.2f} µs/msg  ({legacy:.3f} s)")
+    print(f"  compiled:   {compiled * 1e6 / len(corpus):8.2f} µs/msg  ({compiled:.3f} s)")
+    print(f"  speedup:    {legacy / compiled:8.2f}x")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--extra-keywords", type=int, default=80,
+                        help="synthetic keywords added per intent for the scaling run")
+    args = parser.parse_args()
+    
+    recognizer = AdvancedIntentRecognizer()
+    corpus = build_corpus(recognizer.intents, args.messages)
+    
+    mismatches = run(recognizer, corpus, args.rounds, "shipped table")
+    if args.extra_keywords:
+        pad_keywords(recognizer, args.extra_keywords)
+        mismatches += run(recognizer, corpus, args.rounds, f"+{args.extra_keywords}/intent")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
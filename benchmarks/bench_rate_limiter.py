@@ -0,0 +1,112 @@
+"""
+Rate limiter micro-benchmark.
+
+1. Per-call cost of AdvancedRateLimiter.is_allowed for tiers with very
+   different call limits, next to the old timestamp-list implementation
+   (whose cost grows with the number of calls kept per window).
+2. Memory held for N distinct chat IDs before and after an idle sweep.
+
+Usage:
+    python benchmarks/bench_rate_limiter.py [--calls 200000] [--users 1000000]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+from time import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import AdvancedRateLimiter  # noqa: E402
+
+TIER_LIMITS = [10, 1000, 100000]
+LEGACY_FILL = 5000
+
+
+class LegacyRateLimiter:
+    """The original list-of-timestamps limiter, kept for comparison"""
+    
+    def __init__(self, limits):
+        self.user_calls = {}
+        self.limits = limits
+    
+    def is_allowed(self, user_id, tier='standard'):
+        now = time()
+        if user_id not in self.user_calls:
+            self.user_calls[user_id] = {}
+        if tier not in self.user_calls[user_id]:
+            self.user_calls[user_id][tier] = []
+        limit = self.limits[tier]
+        self.user_calls[user_id][tier] = [
+            t for t in self.user_calls[user_id][tier]
+            if now - t < limit['period']
+        ]
+        if len(self.user_calls[user_id][tier]) < limit['calls']:
+            self.user_calls[user_id][tier].append(now)
+            return True
+        return False
+
+
+def per_call_cost(limiter_cls, calls_limit, n, fill):
+    limits = {'bench': {'calls': calls_limit, 'period': 3600}}
+    if limiter_cls is AdvancedRateLimiter:
+        limiter = AdvancedRateLimiter()
+        limiter.limits = limits
+    else:
+        limiter = limiter_cls(limits)
+    
+    # Fill the window first so the tier holds `calls_limit` calls
+    for _ in range(min(calls_limit, fill)):
+        limiter.is_allowed(1, 'bench')
+    elapsed = timeit.timeit(lambda: limiter.is_allowed(1, 'bench'), number=n)
+    return elapsed * 1e9 / n
+
+
+def make_idle(limiter):
+    """Pretend everyone went quiet long enough ago to be swept"""
+    for table in limiter.windows.values():
+        for state in table.values():
+            state.window -= 2
+
+
+def memory_for_users(users):
+    limiter = AdvancedRateLimiter(max_entries=users)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for user_id in range(users):
+        limiter.is_allowed(user_id, 'standard')
+    held = tracemalloc.get_traced_memory()[0] - base
+    
+    make_idle(limiter)
+    removed = limiter.sweep()
+    after = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return held, removed, after
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=1000000)
+    args = parser.parse_args()
+    
+    print("per-call cost (ns) by tier call limit")
+    print(f"  {'calls/window':>12}  {'sliding-window':>14}  {'legacy list':>12}")
+    for calls_limit in TIER_LIMITS:
+        new = per_call_cost(AdvancedRateLimiter, calls_limit, args.calls, fill=calls_limit)
+        # The legacy limiter is quadratic to fill, so its window is capped at
+        # LEGACY_FILL calls - its real cost at the larger limits is higher still
+        old = per_call_cost(LegacyRateLimiter, calls_limit, 2000, fill=LEGACY_FILL)
+        print(f"  {calls_limit:>12}  {new:>14.0f}  {old:>12.0f}")
+    
+    held, removed, after = memory_for_users(args.users)
+    print(f"\n{args.users} distinct chat IDs")
+    print(f"  held:        {held / 1e6:8.1f} MB ({held / args.users:.0f} B/user)")
+    print(f"  swept:       {removed}")
+    print(f"  after sweep: {after / 1e6:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,417 @@
+"""
+End-to-end replay benchmark for handle_any_message.
+
+Replays a corpus of synthetic updates (mixed intents; English, Hindi and
+Hinglish) through the bot's real dispatch path - getUpdates, rate limiter,
+intent recognition, per-chat scheduler, feature handlers, AI client and
+outbound Bot API calls - against in-process fake Telegram and fake AI
+servers with configurable latency and error distributions.
+
+Reports throughput (messages/sec), p50/p95/p99 latency per recognized
+intent (from the moment the fake Telegram API hands the update to the bot
+until its feature handler returns), and memory growth over the run.
+Image/video latency covers job submission only; delivery is asynchronous.
+
+Usage:
+    python benchmarks/bench_replay.py [--messages 2000] [--users 200] [--rate 0]
+        [--dispatch polling|async|webhook] [--mix chat=40,deep_thinking=10,...]
+        [--ai-latency 0.05] [--ai-latency-dist lognormal] [--ai-error-rate 0.02]
+        [--tg-latency 0.03] [--tg-flood-rate 0] [--corpus replay.jsonl]
+        [--save-corpus replay.jsonl] [--json results.json] [--tracemalloc] [--outbound-pacing]
+
+Bot settings are read from the environment as usual (CHAT_SCHEDULER_ENABLED,
+LANE_WORKERS_*, RESPONSE_CACHE_BACKEND, STREAMING_ENABLED, ...), so the same
+corpus can be replayed before and after a change to compare numbers.
+The outbound Telegram send rates (OUTBOUND_*_RATE) are lifted unless
+--outbound-pacing is given or they are set explicitly; the report states
+the pacing that was in effect.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict, deque
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from aiohttp import web  # noqa: E402
+
+from fake_ai_backend import make_app as make_ai_app, parse_statuses  # noqa: E402
+from fake_telegram_api import FakeTelegramAPI  # noqa: E402
+
+TEMPLATES = {
+    "chat": {
+        "en": ["hello, how is your day going?", "hi there, let's chat a bit", "can we talk about movies?"],
+        "hi": ["नमस्ते, आप कैसे हैं?", "नमस्ते दोस्त, थोड़ी बात करते हैं"],
+        "hinglish": ["hello bhai kya haal hai", "hi yaar aaj chat karte hain", "bas aise hi talk karna tha"],
+    },
+    "deep_thinking": {
+        "en": ["think deeply: why do startups fail?", "analyze the future of electric cars", "explain in detail how vaccines work"],
+        "hi": ["गहराई से सोचो AI का भविष्य क्या होगा", "विश्लेषण करो कि बारिश क्यों होती है"],
+        "hinglish": ["deep mein socho ki stock market kyu girta hai", "analyze karo climate change ka asar"],
+    },
+    "code": {
+        "en": ["write code for a python login system", "javascript program to sort an array", "python code to read a csv file"],
+        "hi": ["कोड लिखो जो दो नंबर जोड़े", "एक प्रोग्राम लिखो fibonacci के लिए"],
+        "hinglish": ["python mein login system ka code likho", "ek javascript program banao todo list ka"],
+    },
+    "translate": {
+        "en": ["translate to hindi: I love programming", "translate: where is the railway station?"],
+        "hi": ["इसका अनुवाद करो: good morning everyone", "अनुवाद: the weather is nice today"],
+        "hinglish": ["isko translate karo: see you tomorrow", "english se convert karo: thank you so much"],
+    },
+    "image": {
+        "en": ["generate image of a sunset over mountains", "draw a picture of a cat astronaut"],
+        "hi": ["पहाड़ों पर सूर्यास्त की तस्वीर बनाओ", "एक फोटो बनाओ समुद्र की"],
+        "hinglish": ["ek realistic photo banao taj mahal ki", "cartoon style image banao robot ki"],
+    },
+    "video": {
+        "en": ["generate video of waves on a beach", "make a short clip of a city at night"],
+        "hi": ["बारिश का वीडियो बनाओ", "एक वीडियो बनाओ उड़ते पक्षियों का"],
+        "hinglish": ["ek video banao space travel ka", "video banao mountains ka drone shot"],
+    },
+}
+
+DEFAULT_MIX = "chat=40,deep_thinking=10,code=15,translate=15,image=10,video=10"
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        intent, weight = part.split("=")
+        if intent not in TEMPLATES:
+            raise SystemExit(f"unknown intent in --mix: {intent}")
+        mix[intent] = float(weight)
+    return mix
+
+
+def build_corpus(messages, users, mix, seed):
+    rng = random.Random(seed)
+    intents, weights = zip(*mix.items())
+    corpus = []
+    for i in range(messages):
+        intent = rng.choices(intents, weights)[0]
+        lang = rng.choice(list(TEMPLATES[intent]))
+        corpus.append({
+            "chat_id": 100000 + rng.randrange(users),
+            "intent": intent,
+            "lang": lang,
+            "text": rng.choice(TEMPLATES[intent][lang]),
+        })
+    return corpus
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_corpus(path, corpus):
+    with open(path, "w", encoding="utf-8") as f:
+        for item in corpus:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(int(round(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def start_fake_servers(args, telegram):
+    """Run both fake servers on one event loop in a background thread"""
+    ai_port, tg_port = free_port(), free_port()
+    ready = threading.Event()
+
+    async def serve():
+        apps = [(telegram.make_app(), tg_port)]
+        if not args.ai_url:
+            apps.append((make_ai_app(
+                latency=args.ai_latency, reply_chars=args.ai_reply_chars,
+                chunk_chars=args.ai_chunk_chars, chunk_delay=args.ai_chunk_delay,
+                async_jobs=args.ai_async_jobs, job_seconds=args.ai_job_seconds,
+                latency_dist=args.ai_latency_dist, error_rate=args.ai_error_rate,
+                error_statuses=parse_statuses(args.ai_error_statuses)
+            ), ai_port))
+        for app, port in apps:
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", port).start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    threading.Thread(target=lambda: asyncio.run(serve()), daemon=True, name="fake-servers").start()
+    ready.wait(10)
+    return args.ai_url or f"http://127.0.0.1:{ai_port}", tg_port
+
+
+def start_dispatch(bot_module):
+    if bot_module.generation_jobs is not None:
+        bot_module.generation_jobs.start()
+    if bot_module.conversation_store is not None:
+        bot_module.conversation_store.start()
+
+    if bot_module.dispatcher is not None:
+        target = bot_module.dispatcher.run_forever
+    elif bot_module.webhook_ingestor is not None:
+        bot_module.webhook_ingestor.start()
+        target = lambda: bot_module.webhook_ingestor.poll_forever(poll_timeout=5)
+    else:
+        target = lambda: bot_module.bot.infinity_polling(timeout=5, long_polling_timeout=5)
+    threading.Thread(target=target, daemon=True, name="dispatch").start()
+
+
+def run(args):
+    corpus = load_corpus(args.corpus) if args.corpus else build_corpus(
+        args.messages, args.users, parse_mix(args.mix), args.seed
+    )
+    if args.save_corpus:
+        save_corpus(args.save_corpus, corpus)
+
+    telegram = FakeTelegramAPI(args.tg_latency, args.tg_latency_dist, args.tg_flood_rate, args.tg_retry_after)
+    ai_url, tg_port = start_fake_servers(args, telegram)
+
+    workdir = tempfile.mkdtemp(prefix="bench_replay_")
+    try:
+        return replay(args, corpus, telegram, ai_url, tg_port, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)  # Daemon threads may still hold the databases open
+
+
+def replay(args, corpus, telegram, ai_url, tg_port, workdir):
+    os.environ["AI_API_URL"] = ai_url
+    os.environ["DISPATCH_MODE"] = args.dispatch
+    os.environ.setdefault("TELEGRAM_TOKEN", "123456:BENCHMARK")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("JOBS_DB_PATH", os.path.join(workdir, "jobs.db"))
+    os.environ.setdefault("MEMORY_STORE_PATH", os.path.join(workdir, "memory.db"))
+    os.environ.setdefault("RESPONSE_CACHE_PATH", os.path.join(workdir, "cache.db"))
+    os.environ.setdefault("USAGE_DB_PATH", os.path.join(workdir, "usage.db"))
+    if not args.outbound_pacing:
+        # Telegram's real limits (1 msg/s per chat) would make the replay measure the throttle
+        for name in ("OUTBOUND_GLOBAL_RATE", "OUTBOUND_CHAT_RATE", "OUTBOUND_GROUP_RATE"):
+            os.environ.setdefault(name, "1000000")
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before_import = rss_mb()
+
+    import telebot.apihelper
+    import bot as bot_module
+
+    telebot.apihelper.API_URL = f"http://127.0.0.1:{tg_port}/bot{{0}}/{{1}}"
+    if not args.keep_rate_limits:
+        for limit in bot_module.rate_limiter.limits.values():
+            limit["calls"] = 10 ** 9
+        if bot_module.chat_scheduler is not None:
+            # A rejected message never completes; a burst may queue the whole corpus in one chat
+            bot_module.chat_scheduler.max_pending_per_chat = len(corpus)
+
+    # Completion is observed where handle_any_message hands off to the feature handler
+    waiting = defaultdict(deque)  # (chat_id, text) -> update ids in arrival order
+    expected_intent = {}
+    results = []  # (recognized intent, expected intent, latency seconds)
+    lock = threading.Lock()
+    all_done = threading.Event()
+    original_run = bot_module.run_timed_handler
+
+    def traced_run(intent_type, handler, user_id, text):
+        try:
+            original_run(intent_type, handler, user_id, text)
+        finally:
+            finished = time.monotonic()
+            with lock:
+                pending = waiting.get((user_id, text))
+                update_id = pending.popleft() if pending else None
+                if update_id is not None:
+                    started = telegram.served_at.get(update_id, finished)
+                    results.append((intent_type, expected_intent.get(update_id), finished - started))
+                    if len(results) >= len(corpus):
+                        all_done.set()
+
+    bot_module.run_timed_handler = traced_run
+
+    rss_start = rss_mb()
+    heap_start = tracemalloc.get_traced_memory()[0] if args.tracemalloc else None
+    start_dispatch(bot_module)
+
+    print(f"▶ Replaying {len(corpus)} messages ({args.dispatch} dispatch, "
+          f"{'burst' if not args.rate else f'{args.rate}/s'}) ...")
+    started = time.monotonic()
+    for i, item in enumerate(corpus):
+        if args.rate:
+            delay = started + i / args.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        update_id = i + 1  # FakeTelegramAPI numbers updates in push order
+        with lock:
+            waiting[(item["chat_id"], item["text"])].append(update_id)
+            expected_intent[update_id] = item["intent"]
+        telegram.push({
+            "message": {
+                "message_id": update_id, "date": int(time.time()), "text": item["text"],
+                "chat": {"id": item["chat_id"], "type": "private"},
+                "from": {"id": item["chat_id"], "is_bot": False, "first_name": "Bench"},
+            }
+        })
+
+    completed = all_done.wait(args.timeout)
+    elapsed = time.monotonic() - started
+    if not completed:
+        print(f"⚠️ Timed out after {args.timeout}s - {len(results)}/{len(corpus)} messages completed")
+
+    report = build_report(args, bot_module, telegram, corpus, results, elapsed,
+                          rss_before_import, rss_start, heap_start)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def build_report(args, bot_module, telegram, corpus, results, elapsed,
+                 rss_before_import, rss_start, heap_start):
+    by_intent = defaultdict(list)
+    mismatched = 0
+    for intent, expected, latency in results:
+        by_intent[intent].append(latency)
+        if expected and expected != intent:
+            mismatched += 1
+
+    def summary(latencies):
+        latencies = sorted(latencies)
+        return {
+            "count": len(latencies),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "max_ms": round(latencies[-1] * 1000, 1),
+        }
+
+    memory_stats = bot_module.conversation_memory.get_stats()
+    report = {
+        "dispatch": args.dispatch,
+        "messages": len(corpus),
+        "completed": len(results),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_msgs_per_s": round(len(results) / elapsed, 1) if elapsed else None,
+        "intent_mismatches": mismatched,
+        "overall": summary([r[2] for r in results]) if results else None,
+        "per_intent": {intent: summary(lat) for intent, lat in sorted(by_intent.items())},
+        "telegram_calls": dict(telegram.calls),
+        "telegram_flood_replies": telegram.flood_replies,
+        "scheduler_rejected": bot_module.chat_scheduler.rejected if bot_module.chat_scheduler is not None else 0,
+        "outbound_pacing": outbound_pacing(bot_module),
+        "memory": {
+            "rss_import_mb": round(rss_start - rss_before_import, 1),
+            "rss_growth_mb": round(rss_mb() - rss_start, 1),
+            "rss_end_mb": round(rss_mb(), 1),
+            "conversation_users": memory_stats["total_users"],
+            "conversation_bytes": memory_stats["bytes_used"],
+            "rate_limiter_entries": len(bot_module.rate_limiter),
+        },
+    }
+    if heap_start is not None:
+        current, peak = tracemalloc.get_traced_memory()
+        report["memory"]["python_heap_growth_mb"] = round((current - heap_start) / 1024 / 1024, 2)
+        report["memory"]["python_heap_peak_mb"] = round(peak / 1024 / 1024, 2)
+    return report
+
+
+def outbound_pacing(bot_module):
+    if not bot_module.OUTBOUND_SCHEDULER:
+        return "off (OUTBOUND_SCHEDULER=0)"
+    return (f"{bot_module.OUTBOUND_CHAT_RATE:g}/s per chat, {bot_module.OUTBOUND_GROUP_RATE:g}/s per group, "
+            f"{bot_module.OUTBOUND_GLOBAL_RATE:g}/s global")
+
+
+def print_report(report):
+    print(f"\n📊 {report['completed']}/{report['messages']} messages in {report['elapsed_s']}s "
+          f"→ {report['throughput_msgs_per_s']} msgs/s ({report['dispatch']} dispatch)")
+    if report["intent_mismatches"]:
+        print(f"   {report['intent_mismatches']} messages recognized as a different intent than generated")
+    if report["scheduler_rejected"]:
+        print(f"   {report['scheduler_rejected']} messages rejected by the per-chat queue cap (never complete)")
+    print(f"\n{'intent':<15}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = list(report["per_intent"].items())
+    if report["overall"]:
+        rows.append(("ALL", report["overall"]))
+    for intent, s in rows:
+        print(f"{intent:<15}{s['count']:>7}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}{s['max_ms']:>10}")
+    mem = report["memory"]
+    print(f"\n🧠 RSS {mem['rss_end_mb']} MB (+{mem['rss_growth_mb']} MB during replay, "
+          f"{mem['rss_import_mb']} MB at import); conversation memory {mem['conversation_users']} users / "
+          f"{mem['conversation_bytes'] / 1024:.0f} KB; rate-limit windows {mem['rate_limiter_entries']}")
+    if "python_heap_growth_mb" in mem:
+        print(f"   Python heap +{mem['python_heap_growth_mb']} MB (peak {mem['python_heap_peak_mb']} MB)")
+    print(f"📨 Telegram calls: {report['telegram_calls']} (429 replies: {report['telegram_flood_replies']})")
+    print(f"🚦 Outbound pacing: {report['outbound_pacing']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay synthetic updates through the bot end to end")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200, help="distinct chats in the generated corpus")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="intent weights, e.g. chat=40,code=20")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--rate", type=float, default=0, help="offered load in messages/sec (0 = all at once)")
+    parser.add_argument("--dispatch", default="polling", choices=["polling", "async", "webhook"])
+    parser.add_argument("--timeout", type=float, default=300, help="give up waiting after this many seconds")
+    parser.add_argument("--corpus", help="replay this JSONL corpus instead of generating one")
+    parser.add_argument("--save-corpus", help="write the corpus used to this JSONL file")
+    parser.add_argument("--json", help="also write the report as JSON")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="don't lift per-user rate limits or the per-chat queue cap")
+    parser.add_argument("--outbound-pacing", action="store_true",
+                        help="keep the OUTBOUND_* Telegram send rates (lifted by default)")
+    parser.add_argument("--tracemalloc", action="store_true", help="track Python heap growth (slower)")
+
+    ai = parser.add_argument_group("fake AI backend")
+    ai.add_argument("--ai-url", help="use an already running backend instead of the in-process fake")
+    ai.add_argument("--ai-latency", type=float, default=0.05)
+    ai.add_argument("--ai-latency-dist", default="lognormal", choices=["fixed", "uniform", "exponential", "lognormal"])
+    ai.add_argument("--ai-error-rate", type=float, default=0.0)
+    ai.add_argument("--ai-error-statuses", default="500,502,503")
+    ai.add_argument("--ai-reply-chars", type=int, default=1500)
+    ai.add_argument("--ai-chunk-chars", type=int, default=200)
+    ai.add_argument("--ai-chunk-delay", type=float, default=0.005)
+    ai.add_argument("--ai-async-jobs", action="store_true")
+    ai.add_argument("--ai-job-seconds", type=float, default=1.0)
+
+    tg = parser.add_argument_group("fake Telegram API")
+    tg.add_argument("--tg-latency", type=float, default=0.03)
+    tg.add_argument("--tg-latency-dist", default="lognormal", choices=["fixed", "uniform", "exponential", "lognormal"])
+    tg.add_argument("--tg-flood-rate", type=float, default=0.0, help="fraction of chat calls answered with 429")
+    tg.add_argument("--tg-retry-after", type=int, default=1)
+
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Local stand-in for AI_API_URL.
+
+Serves /health and the /api/* endpoints the bot calls. /api/chat streams its
+reply as Server-Sent Events when the request carries ``"stream": true``.
+With --async-jobs, /api/image and /api/video answer with a ``job_id`` that
+/api/jobs/<id> reports as done after --job-seconds.
+
+Response latency is --latency seconds, or drawn around that mean with
+--latency-dist uniform|exponential|lognormal. --error-rate makes that
+fraction of /api/* calls fail with one of --error-statuses.
+
+With --media-kb N, image/video URLs point at this server's /media/<name>,
+which streams N KB of bytes derived from the name (same prompt, same asset)
+with Content-Length and an X-Content-SHA256 header.
+
+Usage:
+    python benchmarks/fake_ai_backend.py [--port 8765] [--latency 0.05]
+        [--latency-dist fixed] [--error-rate 0] [--error-statuses 500,502,503]
+        [--reply-chars 6000] [--chunk-chars 40] [--chunk-delay 0.02]
+        [--async-jobs] [--job-seconds 5] [--media-kb 0]
+
+Then run the bot with AI_API_URL=http://127.0.0.1:8765
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+import uuid
+
+from aiohttp import web
+
+LOREM = (
+    "Yeh ek lamba jawab hai jo dheere dheere stream hota hai. "
+    "AI ka future bahut interesting hai, aur iske kai pehlu hain.\n\n"
+)
+
+
+def make_reply(chars):
+    return (LOREM * (chars // len(LOREM) + 1))[:chars]
+
+
+def sample_latency(mean, dist):
+    if mean <= 0 or dist == "fixed":
+        return mean
+    if dist == "uniform":
+        return random.uniform(0, 2 * mean)
+    if dist == "exponential":
+        return random.expovariate(1 / mean)
+    if dist == "lognormal":
+        sigma = 0.8  # heavy-ish tail: p99 is roughly 4x the median
+        return random.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+    raise ValueError(f"unknown latency distribution: {dist}")
+
+
+def make_app(latency=0.05, reply_chars=6000, chunk_chars=40, chunk_delay=0.02,
+             async_jobs=False, job_seconds=5.0, latency_dist="fixed",
+             error_rate=0.0, error_statuses=(500, 502, 503), media_kb=0):
+    jobs = {}  # backend job id -> (ready_at, result)
+    
+    def media_bytes(name):
+        block = hashlib.sha256(name.encode()).digest() * 32  # 1 KB
+        return block * media_kb
+    
+    def media_url(request, kind, prompt, default):
+        if not media_kb:
+            return default
+        name = hashlib.sha256(str(prompt).encode()).hexdigest()[:12]
+        return f"{request.url.origin()}/media/{kind}-{name}.{'png' if kind == 'image' else 'mp4'}"
+    
+    async def delay():
+        await asyncio.sleep(sample_latency(latency, latency_dist))
+    
+    @web.middleware
+    async def inject_errors(request, handler):
+        if error_rate and request.path.startswith("/api/") and random.random() < error_rate:
+            await delay()
+            status = random.choice(error_statuses)
+            return web.json_response({"error": "injected failure"}, status=status)
+        return await handler(request)
+    
+    def finish_or_defer(result):
+        if not async_jobs:
+            return web.json_response(result)
+        job_id = uuid.uuid4().hex
+        jobs[job_id] = (time.monotonic() + job_seconds, result)
+        return web.json_response({"job_id": job_id, "status": "queued"}, status=200)
+    
+    async def health(request):
+        return web.json_response({"status": "ok"})
+    
+    async def chat(request):
+        payload = await request.json()
+        await delay()
+        reply = make_reply(reply_chars if payload.get("thinking") else min(reply_chars, 500))
+        
+        if not payload.get("stream"):
+            return web.json_response({"response": reply, "model": payload.get("model")})
+        
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream; charset=utf-8"})
+        await response.prepare(request)
+        for i in range(0, len(reply), chunk_chars):
+            event = json.dumps({"delta": reply[i:i + chunk_chars]}, ensure_ascii=False)
+            await response.write(f"data: {event}\n\n".encode("utf-8"))
+            await asyncio.sleep(chunk_delay)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+    
+    async def image(request):
+        payload = await request.json()
+        await delay()
+        image_url = media_url(request, "image", payload.get("prompt"), "https://picsum.photos/1024")
+        return finish_or_defer({"image_url": image_url, "prompt": payload.get("prompt")})
+    
+    async def video(request):
+        payload = await request.json()
+        await delay()
+        video_url = media_url(request, "video", payload.get("prompt"), "https://download.samplelib.com/mp4/sample-5s.mp4")
+        return finish_or_defer({"video_url": video_url})
+    
+    async def media(request):
+        name = request.match_info["name"]
+        body = media_bytes(name)
+        response = web.StreamResponse(headers={
+            "Content-Type": "image/png" if name.endswith(".png") else "video/mp4",
+            "Content-Length": str(len(body)),
+            "X-Content-SHA256": hashlib.sha256(body).hexdigest()
+        })
+        await response.prepare(request)
+        for i in range(0, len(body), 64 * 1024):
+            await response.write(body[i:i + 64 * 1024])
+        await response.write_eof()
+        return response
+    
+    async def job_status(request):
+        job = jobs.get(request.match_info["job_id"])
+        if job is None:
+            return web.json_response({"status": "failed", "error": "unknown job"}, status=404)
+        ready_at, result = job
+        if time.monotonic() < ready_at:
+            return web.json_response({"status": "running"})
+        return web.json_response({"status": "done", **result})
+    
+    async def code(request):
+        payload = await request.json()
+        await delay()
+        return web.json_response({"code": f"# {payload.get('description', '')[:60]}\nprint('hello')\n"})
+    
+    async def translate(request):
+        payload = await request.json()
+        await delay()
+        return web.json_response({"translated_text": f"[{payload.get('target_language')}] {payload.get('text', '')}"})
+    
+    async def translate_batch(request):
+        payload = await request.json()
+        await delay()
+        language = payload.get("target_language")
+        return web.json_response({"translations": [f"[{language}] {text}" for text in payload.get("texts", [])]})
+    
+    app = web.Application(middlewares=[inject_errors])
+    app.router.add_get("/health", health)
+    app.router.add_post("/api/chat", chat)
+    app.router.add_post("/api/image", image)
+    app.router.add_post("/api/video", video)
+    app.router.add_post("/api/code", code)
+    app.router.add_post("/api/translate", translate)
+    app.router.add_post("/api/translate/batch", translate_batch)
+    app.router.add_get("/api/jobs/{job_id}", job_status)
+    app.router.add_get("/media/{name}", media)
+    return app
+
+
+def parse_statuses(text):
+    return tuple(int(status) for status in text.split(",") if status.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake AI backend for local testing")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before each response starts")
+    parser.add_argument("--latency-dist", default="fixed", choices=["fixed", "uniform", "exponential", "lognormal"],
+                        help="distribution of response latency around --latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of /api/* calls that fail")
+    parser.add_argument("--error-statuses", default="500,502,503", help="HTTP statuses used for injected failures")
+    parser.add_argument("--reply-chars", type=int, default=6000, help="length of deep-thinking replies")
+    parser.add_argument("--chunk-chars", type=int, default=40, help="characters per streamed event")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="seconds between streamed events")
+    parser.add_argument("--async-jobs", action="store_true", help="answer image/video with a job_id to poll")
+    parser.add_argument("--job-seconds", type=float, default=5.0, help="time until an async job is done")
+    parser.add_argument("--media-kb", type=int, default=0, help="serve generated media from /media/ with this size")
+    args = parser.parse_args()
+    
+    app = make_app(args.latency, args.reply_chars, args.chunk_chars, args.chunk_delay,
+                   args.async_jobs, args.job_seconds, args.latency_dist,
+                   args.error_rate, parse_statuses(args.error_statuses), args.media_kb)
+    web.run_app(app, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
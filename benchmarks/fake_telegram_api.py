@@ -0,0 +1,188 @@
+"""
+Local stand-in for the Telegram Bot API.
+
+Answers every /bot<token>/<method> call with ``{"ok": true, ...}`` after a
+configurable latency, records outbound calls per chat, and serves
+getUpdates (long polling) from an in-memory queue that callers fill with
+``FakeTelegramAPI.push`` (or ``POST /_push`` from another process;
+``GET /_stats`` returns call counts). A fraction of outbound calls can be
+answered with 429 + retry_after to exercise flood-control handling.
+Uploaded files are read in chunks and answered with a file_id derived from
+their SHA-256, like Telegram's photo/video/document objects.
+
+Point telebot at it with:
+    telebot.apihelper.API_URL = "http://127.0.0.1:8081/bot{0}/{1}"
+
+Usage (standalone, mostly useful together with the replay benchmark):
+    python benchmarks/fake_telegram_api.py [--port 8081] [--latency 0.03]
+        [--flood-rate 0] [--retry-after 1]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import random
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+from fake_ai_backend import sample_latency
+
+
+class FakeTelegramAPI:
+    def __init__(self, latency=0.03, latency_dist="fixed", flood_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.latency_dist = latency_dist
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.pending = []
+        self.next_update_id = 1
+        self.served_at = {}  # update_id -> monotonic time it was handed to the bot
+        self.new_updates = None
+        self.loop = None
+        self.message_ids = itertools.count(1)
+        self.calls = Counter()
+        self.calls_per_chat = defaultdict(int)
+        self.flood_replies = 0
+        self.first_call_at = {}  # method -> monotonic time of its first call
+        self.uploaded_bytes = 0
+
+    # ---- update source ----
+    def push(self, update):
+        """Queue an update dict (any thread); update_id is assigned here"""
+        def add():
+            update["update_id"] = self.next_update_id
+            self.next_update_id += 1
+            self.pending.append(update)
+            self.new_updates.set()
+        self.loop.call_soon_threadsafe(add)
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        self.pending = [u for u in self.pending if u["update_id"] >= offset]
+        if not self.pending and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        batch = self.pending[:100]
+        now = time.monotonic()
+        for update in batch:
+            self.served_at.setdefault(update["update_id"], now)
+        return batch
+
+    # ---- Bot API ----
+    def _message(self, chat_id, text=None):
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id or 0), "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "FakeBot"},
+        }
+        if text is not None:
+            message["text"] = text
+        return message
+
+    async def _read_form(self, request, params):
+        """Form fields into params; uploaded files are read in chunks and replaced by a fake file_id"""
+        reader = await request.multipart()
+        async for part in reader:
+            if part.filename is None:
+                params[part.name] = await part.text()
+                continue
+            digest = hashlib.sha256()
+            while chunk := await part.read_chunk():
+                digest.update(chunk)
+                self.uploaded_bytes += len(chunk)
+            params[part.name] = "file-" + digest.hexdigest()[:16]
+    
+    def _media(self, method, file_id):
+        if method == "sendPhoto":
+            return {"photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 1024, "height": 1024}]}
+        if method == "sendVideo":
+            return {"video": {"file_id": file_id, "file_unique_id": file_id, "width": 640, "height": 360, "duration": 5}}
+        if method == "sendDocument":
+            return {"document": {"file_id": file_id, "file_unique_id": file_id}}
+        return {}
+    
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = dict(request.query)
+        if request.method == "POST" and request.can_read_body:
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            elif request.content_type == "multipart/form-data":
+                await self._read_form(request, params)
+            else:
+                params.update(await request.post())
+
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        self.calls[method] += 1
+        self.first_call_at.setdefault(method, time.monotonic())
+        chat_id = params.get("chat_id")
+        if chat_id is not None:
+            self.calls_per_chat[chat_id] += 1
+        await asyncio.sleep(sample_latency(self.latency, self.latency_dist))
+
+        if self.flood_rate and chat_id is not None and random.random() < self.flood_rate:
+            self.flood_replies += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after}
+            }, status=429)
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        elif method.startswith(("send", "edit")) and chat_id is not None:
+            result = self._message(chat_id, params.get("text"))
+            media = {"sendPhoto": "photo", "sendVideo": "video", "sendDocument": "document"}.get(method)
+            if media in params:
+                result.update(self._media(method, params[media]))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def push_update(self, request):
+        """POST /_push - queue an update from outside the process"""
+        self.push(await request.json())
+        return web.json_response({"ok": True})
+
+    async def stats(self, request):
+        return web.json_response({"calls": self.calls, "calls_per_chat": self.calls_per_chat,
+                                  "flood_replies": self.flood_replies, "uploaded_bytes": self.uploaded_bytes})
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        app.router.add_post("/_push", self.push_update)
+        app.router.add_get("/_stats", self.stats)
+        app.on_startup.append(self._on_startup)
+        return app
+
+    async def _on_startup(self, app):
+        self.loop = asyncio.get_running_loop()
+        self.new_updates = asyncio.Event()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API for local testing")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.03, help="seconds before each reply")
+    parser.add_argument("--latency-dist", default="fixed", choices=["fixed", "uniform", "exponential", "lognormal"])
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="fraction of chat calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after sent with 429 replies")
+    args = parser.parse_args()
+
+    api = FakeTelegramAPI(args.latency, args.latency_dist, args.flood_rate, args.retry_after)
+    web.run_app(api.make_app(), port=args.port)
+
+
+if __name__ == "__main__":
+    main()
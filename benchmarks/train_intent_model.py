@@ -0,0 +1,121 @@
+"""
+Train the char n-gram intent model used by INTENT_CLASSIFIER=model.
+
+Reads a labelled corpus (one ``<intent>\\t<message>`` per line, ``#``
+comments), fits a softmax linear model over NgramIntentModel.features with
+plain SGD, drops near-zero weights and writes the model JSON atomically, so
+a running bot picks it up on its next reload check.
+
+Usage:
+    python benchmarks/train_intent_model.py [--corpus benchmarks/intent_corpus.tsv]
+        [--out intent_model.json] [--epochs 25] [--holdout]
+
+--holdout trains on the training split only (what bench_intent_classifier.py
+evaluates); by default every labelled example is used.
+"""
+
+import argparse
+import hashlib
+import math
+import os
+import random
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import NgramIntentModel  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(HERE, "intent_corpus.tsv")
+DEFAULT_OUT = os.path.join(os.path.dirname(HERE), "intent_model.json")
+
+
+def load_corpus(path):
+    """List of (intent, message) pairs"""
+    examples = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            label, sep, text = line.partition("\t")
+            if not sep or not text.strip():
+                raise ValueError(f"{path}:{line_no}: expected <intent>\\t<message>")
+            examples.append((label.strip(), text.strip()))
+    return examples
+
+
+def split_corpus(examples, test_every=5):
+    """Deterministic train/test split by message hash (about 1 in test_every held out)"""
+    train, test = [], []
+    for label, text in examples:
+        bucket = int(hashlib.md5(text.encode("utf-8")).hexdigest(), 16) % test_every
+        (test if bucket == 0 else train).append((label, text))
+    return train, test
+
+
+def train(examples, epochs=25, learning_rate=0.1, min_weight=0.01, seed=13):
+    """Fit NgramIntentModel weights by SGD on softmax cross-entropy"""
+    classes = sorted({label for label, _ in examples})
+    index = {label: i for i, label in enumerate(classes)}
+    data = [(index[label], list(NgramIntentModel.features(text))) for label, text in examples]
+    bias = [0.0] * len(classes)
+    weights = {}
+    rng = random.Random(seed)
+
+    for epoch in range(epochs):
+        rng.shuffle(data)
+        rate = learning_rate / (1 + epoch * 0.2)
+        for target, features in data:
+            scores = list(bias)
+            for feature in features:
+                w = weights.get(feature)
+                if w is not None:
+                    scores = [s + x for s, x in zip(scores, w)]
+            top = max(scores)
+            exps = [math.exp(s - top) for s in scores]
+            total = sum(exps)
+            gradient = [e / total for e in exps]
+            gradient[target] -= 1.0
+            step = [rate * g for g in gradient]
+            bias = [b - s for b, s in zip(bias, step)]
+            for feature in features:
+                w = weights.get(feature)
+                if w is None:
+                    w = weights[feature] = [0.0] * len(classes)
+                for i, s in enumerate(step):
+                    w[i] -= s
+
+    weights = {f: w for f, w in weights.items() if max(abs(x) for x in w) >= min_weight}
+    meta = {
+        "trained_at": datetime.now().isoformat(timespec="seconds"),
+        "examples": len(examples),
+        "epochs": epochs
+    }
+    return NgramIntentModel(classes, bias, weights, meta)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--out", default=DEFAULT_OUT)
+    parser.add_argument("--epochs", type=int, default=25)
+    parser.add_argument("--learning-rate", type=float, default=0.1)
+    parser.add_argument("--holdout", action="store_true", help="train on the training split only")
+    args = parser.parse_args()
+
+    examples = load_corpus(args.corpus)
+    if args.holdout:
+        examples, _ = split_corpus(examples)
+    model = train(examples, args.epochs, args.learning_rate)
+    model.meta["corpus"] = os.path.basename(args.corpus)
+    model.save(args.out)
+
+    correct = sum(model.predict(text)[0] == label for label, text in examples)
+    print(f"🧭 Trained on {len(examples)} examples, {len(model.weights)} features, classes {model.classes}")
+    print(f"   training accuracy {correct / len(examples):.1%} -> {args.out} ({os.path.getsize(args.out) // 1024} KB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,19 +20,92 @@
 ╚═══════════════════════════════════════════════════════════╝
 """
 
+import time as time_module
+_PROCESS_T0 = time_module.perf_counter()  # Reference point for startup phase timings
+
 import telebot
+from telebot import apihelper
 import requests
 import json
+import math
 import os
+import sys
 from datetime import datetime
 import logging
 from dotenv import load_dotenv
 from functools import wraps
 from time import time
 import threading
-from flask import Flask, jsonify
-from collections import deque
-import time as time_module
+import queue
+import atexit
+import uuid
+from flask import Flask, Response, jsonify, request
+from collections import deque, OrderedDict
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor
+import bisect
+import hashlib
+import heapq
+import importlib
+import inspect
+import io
+import itertools
+import mimetypes
+import hmac
+import random
+import re
+import secrets
+import socket
+import socketserver
+import sqlite3
+import subprocess
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from werkzeug.serving import make_server
+
+
+class _LazyModule:
+    """Imports a module on first attribute access, keeping it off the cold-start path"""
+    
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# Only the async dispatcher / *_async client methods need aiohttp (~130 ms) and asyncio (~20 ms)
+aiohttp = _LazyModule("aiohttp")
+asyncio = _LazyModule("asyncio")
+
+
+class _lazy_attribute:
+    """Instance attribute computed on first access under a lock, then stored on the instance.
+
+    Used for database connections and thread pools, so importing the module
+    opens no files and builds no pools; like functools.cached_property, but
+    safe when several threads race for the first access.
+    """
+    
+    def __init__(self, factory):
+        self.factory = factory
+        self.name = factory.__name__
+        self.lock = threading.Lock()
+        self.__doc__ = factory.__doc__
+    
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        with self.lock:
+            value = obj.__dict__.get(self.name, self)
+            if value is self:
+                value = obj.__dict__[self.name] = self.factory(obj)
+        return value
+
+_IMPORTS_DONE = time_module.perf_counter()
 
 # Load environment variables
 load_dotenv()
@@ -43,12 +116,93 @@ AI_API_URL = os.getenv('AI_API_URL', 'https://ai-api-premium-server.onrender.com
 ADMIN_ID = int(os.getenv('ADMIN_ID', '0'))
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 PORT = int(os.getenv('PORT', 10000))
+DISPATCH_MODE = os.getenv('DISPATCH_MODE', 'polling')  # 'polling', 'async' or 'webhook'
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', 100))
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', os.getenv('RENDER_EXTERNAL_URL', ''))
+WEBHOOK_SECRET_SET = bool(os.getenv('WEBHOOK_SECRET'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)  # Random per process when unset
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 8))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_REGISTER = os.getenv('WEBHOOK_REGISTER', '1') == '1'
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')  # Self-hosted Bot API server, e.g. http://localhost:8081
+SHARD_PROCESSES = int(os.getenv('SHARD_PROCESSES', 0))
+SHARD_WORKER_URLS = [url.strip().rstrip('/') for url in os.getenv('SHARD_WORKER_URLS', '').split(',') if url.strip()]
+SHARD_BASE_PORT = int(os.getenv('SHARD_BASE_PORT', PORT + 1))
+SHARD_INDEX = os.getenv('SHARD_INDEX', '')
+SHARED_STATE = os.getenv('SHARED_STATE', 'none')  # 'none', 'local', 'unix' or 'redis'
+SHARED_STATE_SOCKET = os.getenv('SHARED_STATE_SOCKET', '/tmp/telegram-bot-state.sock')
+CHAT_SCHEDULER_ENABLED = os.getenv('CHAT_SCHEDULER_ENABLED', '1') == '1'
+LANE_WORKERS_STANDARD = int(os.getenv('LANE_WORKERS_STANDARD', 8))
+LANE_WORKERS_THINKING = int(os.getenv('LANE_WORKERS_THINKING', 4))
+LANE_WORKERS_GENERATION = int(os.getenv('LANE_WORKERS_GENERATION', 2))
+STREAMING_ENABLED = os.getenv('STREAMING_ENABLED', '1') == '1'
+STREAM_EDIT_CHARS = int(os.getenv('STREAM_EDIT_CHARS', 800))
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.5))
+REPLY_DOCUMENT_CHARS = int(os.getenv('REPLY_DOCUMENT_CHARS', 16000))
+JOBS_ENABLED = os.getenv('JOBS_ENABLED', '1') == '1'
+JOBS_DB_PATH = os.getenv('JOBS_DB_PATH', 'jobs.db')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+JOB_POLL_INTERVAL = int(os.getenv('JOB_POLL_INTERVAL', 10))
+JOB_CALLBACK_URL = os.getenv('JOB_CALLBACK_URL', '')  # e.g. WEBHOOK_URL; empty = poll only
+MEDIA_RELAY = os.getenv('MEDIA_RELAY', '1') == '1'
+MEDIA_CACHE_SIZE = int(os.getenv('MEDIA_CACHE_SIZE', 1000))
+MEDIA_CHUNK_SIZE = int(os.getenv('MEDIA_CHUNK_SIZE', 64 * 1024))
+MEDIA_FETCH_TIMEOUT = float(os.getenv('MEDIA_FETCH_TIMEOUT', 60))
+AI_POOL_SIZE = int(os.getenv('AI_POOL_SIZE', 20))
+AI_KEEPALIVE = os.getenv('AI_KEEPALIVE', '1') == '1'
+AI_KEEPALIVE_TIMEOUT = int(os.getenv('AI_KEEPALIVE_TIMEOUT', 60))
+AI_CONNECT_TIMEOUT = float(os.getenv('AI_CONNECT_TIMEOUT', 5))
+AI_COALESCE_REQUESTS = os.getenv('AI_COALESCE_REQUESTS', '1') == '1'
+AI_MAX_RETRIES = int(os.getenv('AI_MAX_RETRIES', 2))
+AI_RETRY_BASE_DELAY = float(os.getenv('AI_RETRY_BASE_DELAY', 0.5))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_TIMEOUT = int(os.getenv('BREAKER_RESET_TIMEOUT', 30))
+OUTBOUND_SCHEDULER = os.getenv('OUTBOUND_SCHEDULER', '1') == '1'
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', 30))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', 1.0))
+OUTBOUND_CHAT_BURST = int(os.getenv('OUTBOUND_CHAT_BURST', 3))
+OUTBOUND_GROUP_RATE = float(os.getenv('OUTBOUND_GROUP_RATE', 20 / 60))
+OUTBOUND_WORKERS = int(os.getenv('OUTBOUND_WORKERS', 8))
+TRANSLATE_BATCHING = os.getenv('TRANSLATE_BATCHING', '1') == '1'
+TRANSLATE_BATCH_WINDOW = float(os.getenv('TRANSLATE_BATCH_WINDOW', 0.05))
+TRANSLATE_BATCH_MAX_SEGMENTS = int(os.getenv('TRANSLATE_BATCH_MAX_SEGMENTS', 32))
+TRANSLATE_SEGMENT_CHARS = int(os.getenv('TRANSLATE_SEGMENT_CHARS', 1000))
+TRANSLATE_PARALLELISM = int(os.getenv('TRANSLATE_PARALLELISM', 4))
+HEALTH_CHECK_INTERVAL = int(os.getenv('HEALTH_CHECK_INTERVAL', 30))
+HEALTH_CHECK_DEGRADED_INTERVAL = int(os.getenv('HEALTH_CHECK_DEGRADED_INTERVAL', 5))
+HEALTH_SLOW_THRESHOLD = float(os.getenv('HEALTH_SLOW_THRESHOLD', 2.0))
+RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'memory')  # 'memory', 'sqlite' or 'off'
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 1000))
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 3600))
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', 'response_cache.db')
 MAX_MEMORY_SIZE = 10
+MEMORY_BUDGET_MB = int(os.getenv('MEMORY_BUDGET_MB', 64))
+MEMORY_MAX_IDLE_HOURS = int(os.getenv('MEMORY_MAX_IDLE_HOURS', 168))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 800))
+CONTEXT_REPLY_TOKENS = int(os.getenv('CONTEXT_REPLY_TOKENS', 150))
+CONTEXT_USER_TOKENS = int(os.getenv('CONTEXT_USER_TOKENS', 300))
+MEMORY_STORE = os.getenv('MEMORY_STORE', 'none')  # 'none', 'sqlite' or 'redis'
+MEMORY_STORE_PATH = os.getenv('MEMORY_STORE_PATH', 'conversations.db')
+MEMORY_STORE_FLUSH_INTERVAL = float(os.getenv('MEMORY_STORE_FLUSH_INTERVAL', 1.0))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+RATE_LIMIT_MAX_ENTRIES = int(os.getenv('RATE_LIMIT_MAX_ENTRIES', 200000))
+RATE_LIMIT_SWEEP_INTERVAL = int(os.getenv('RATE_LIMIT_SWEEP_INTERVAL', 60))
+INTENT_CLASSIFIER = os.getenv('INTENT_CLASSIFIER', 'model')  # 'model' or 'keyword'
+INTENT_MODEL_PATH = os.getenv('INTENT_MODEL_PATH', 'intent_model.json')
+INTENT_MIN_CONFIDENCE = float(os.getenv('INTENT_MIN_CONFIDENCE', 0.5))
+INTENT_MODEL_RELOAD_INTERVAL = int(os.getenv('INTENT_MODEL_RELOAD_INTERVAL', 30))
+USAGE_LEDGER = os.getenv('USAGE_LEDGER', '1') == '1'
+USAGE_DB_PATH = os.getenv('USAGE_DB_PATH', 'usage.db')
+USAGE_DAILY_CREDITS = float(os.getenv('USAGE_DAILY_CREDITS', 200))  # 0 = no limit
+USAGE_MONTHLY_CREDITS = float(os.getenv('USAGE_MONTHLY_CREDITS', 3000))
+USAGE_FLUSH_INTERVAL = float(os.getenv('USAGE_FLUSH_INTERVAL', 5))
 DEEP_THINKING_MODEL = "claude-3.5-sonnet-thinking"
 STANDARD_MODEL = "claude-3"
 
 # Initialize bot
-bot = telebot.TeleBot(TELEGRAM_TOKEN)
+bot = telebot.TeleBot(TELEGRAM_TOKEN, threaded=DISPATCH_MODE == 'polling')
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL.rstrip('/') + "/bot{0}/{1}"
 app = Flask(__name__)
 
 # Configure logging
@@ -58,6 +212,545 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ============ STARTUP TIMINGS ============
+class StartupTimer:
+    """Milliseconds from interpreter start of this module to each startup phase (first time only)"""
+    
+    def __init__(self, t0):
+        self.t0 = t0
+        self.phases = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def mark(self, phase, at=None):
+        if phase in self.phases:
+            return  # Fast path - called on every Telegram request
+        with self.lock:
+            if phase in self.phases:
+                return
+            elapsed = ((at or time_module.perf_counter()) - self.t0) * 1000
+            self.phases[phase] = round(elapsed, 1)
+        logger.info(f"⏱️ Startup: {phase} after {elapsed:.0f} ms")
+    
+    def get_stats(self):
+        with self.lock:
+            return dict(self.phases)
+
+startup_timer = StartupTimer(_PROCESS_T0)
+startup_timer.mark("imports", _IMPORTS_DONE)
+
+# ============ METRICS (PROMETHEUS TEXT FORMAT) ============
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape_label(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+    
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = list(self.values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram; ``observe`` is a bisect plus three adds under a lock"""
+    
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+    
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+    
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = [(k, list(v)) for k, v in self.series.items()]
+        bucket_names = self.label_names + ("le",)
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(bucket_names, label_values + (bound,))} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "label_values", "started")
+    
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+    
+    def __enter__(self):
+        self.started = time_module.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.histogram.observe(time_module.perf_counter() - self.started, *self.label_values)
+
+
+class GaugeCallback:
+    """Gauge read at scrape time; ``fn`` returns a number or {label values tuple: number}"""
+    
+    def __init__(self, name, help_text, fn, labels=(), kind="gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.fn = fn
+        self.label_names = tuple(labels)
+        self.kind = kind
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.debug(f"Metric {self.name} unavailable: {e}")
+            return lines
+        if value is None:
+            return lines
+        if isinstance(value, dict):
+            for label_values, v in value.items():
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {v}")
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+    
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+    
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+    
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+    
+    def gauge(self, name, help_text, fn, labels=(), kind="gauge"):
+        return self.register(GaugeCallback(name, help_text, fn, labels, kind))
+    
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+ai_call_latency = metrics.histogram(
+    "bot_ai_call_duration_seconds", "AdvancedAIAPIClient method latency", ("method", "outcome")
+)
+intent_counter = metrics.counter("bot_intents_total", "Messages per recognized intent", ("intent",))
+handler_latency = metrics.histogram(
+    "bot_handler_duration_seconds", "End-to-end feature handler latency per intent", ("intent",)
+)
+telegram_latency = metrics.histogram(
+    "bot_telegram_api_duration_seconds", "Telegram Bot API call latency", ("method", "outcome")
+)
+
+
+def instrument_ai_call(func):
+    """Record latency of a client method (sync, async or generator) by name and outcome.
+    Methods that swallow errors report them as {"error": ...} dicts."""
+    name = func.__name__
+    
+    def outcome_of(result):
+        return "error" if isinstance(result, dict) and "error" in result else "ok"
+    
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            started = time_module.perf_counter()
+            outcome = "exception"
+            try:
+                result = await func(*args, **kwargs)
+                outcome = outcome_of(result)
+                return result
+            finally:
+                ai_call_latency.observe(time_module.perf_counter() - started, name, outcome)
+        return async_wrapper
+    
+    if inspect.isgeneratorfunction(func):
+        @wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            started = time_module.perf_counter()
+            outcome = "exception"
+            try:
+                yield from func(*args, **kwargs)
+                outcome = "ok"
+            except GeneratorExit:
+                outcome = "ok"
+                raise
+            finally:
+                ai_call_latency.observe(time_module.perf_counter() - started, name, outcome)
+        return generator_wrapper
+    
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time_module.perf_counter()
+        outcome = "exception"
+        try:
+            result = func(*args, **kwargs)
+            outcome = outcome_of(result)
+            return result
+        finally:
+            ai_call_latency.observe(time_module.perf_counter() - started, name, outcome)
+    return wrapper
+
+
+def _instrument_telegram_requests():
+    """Time every Bot API request made through telebot's apihelper"""
+    make_request = apihelper._make_request
+    
+    @wraps(make_request)
+    def timed_request(token, method_name, *args, **kwargs):
+        started = time_module.perf_counter()
+        outcome = "error"
+        try:
+            result = make_request(token, method_name, *args, **kwargs)
+            outcome = "ok"
+            if method_name == "getUpdates":
+                startup_timer.mark("first_poll")
+                if result:
+                    startup_timer.mark("first_update")
+            elif method_name.startswith("send"):
+                startup_timer.mark("first_reply")
+            return result
+        finally:
+            telegram_latency.observe(time_module.perf_counter() - started, method_name, outcome)
+    
+    apihelper._make_request = timed_request
+
+_instrument_telegram_requests()
+
+
+def _queue_depths():
+    depths = {}
+    if globals().get('chat_scheduler') is not None:
+        for lane, q in chat_scheduler.lanes.items():
+            depths[(f"scheduler_{lane}",)] = q.qsize()
+        depths[("scheduler_waiting_in_chats",)] = sum(len(w) for w in chat_scheduler.chats.values())
+    if globals().get('webhook_ingestor') is not None:
+        depths[("webhook",)] = webhook_ingestor.updates.qsize()
+    if globals().get('dispatcher') is not None:
+        depths[("async_active_tasks",)] = dispatcher.active_tasks
+    if globals().get('generation_jobs') is not None:
+        depths[("generation_awaiting_backend",)] = len(generation_jobs.polling)
+    if globals().get('conversation_store') is not None:
+        depths[("store_pending_writes",)] = conversation_store.pending.qsize()
+    if globals().get('outbound_scheduler') is not None:
+        depths[("telegram_outbound",)] = sum(len(outbox.calls) for outbox in list(outbound_scheduler.chats.values()))
+    return depths
+
+metrics.gauge("bot_queue_depth", "Items waiting per internal queue", _queue_depths, ("queue",))
+metrics.gauge(
+    "bot_rate_limit_rejections_total", "Requests rejected by the rate limiter per tier",
+    lambda: {(tier,): n for tier, n in rate_limiter.rejections.items()}, ("tier",), kind="counter"
+)
+metrics.gauge(
+    "bot_usage_quota_rejections_total", "Requests refused by the usage ledger's daily/monthly quotas",
+    lambda: {(period,): n for period, n in usage_ledger.rejections.items()} if usage_ledger is not None else None,
+    ("period",), kind="counter"
+)
+metrics.gauge("bot_memory_users", "Users with conversation memory in RAM", lambda: len(conversation_memory.memory))
+metrics.gauge("bot_memory_bytes", "Approximate bytes held by conversation memory", lambda: conversation_memory.bytes_used)
+metrics.gauge("bot_rate_limiter_entries", "Tracked rate-limit windows", lambda: len(rate_limiter))
+metrics.gauge(
+    "bot_response_cache_entries", "Entries in the AI response cache",
+    lambda: len(response_cache.backend) if response_cache is not None else None
+)
+metrics.gauge(
+    "bot_circuit_open", "1 when the endpoint's circuit breaker is not closed",
+    lambda: {(path,): int(b.state != "closed") for path, b in ai_client.breakers.items()}, ("endpoint",)
+)
+
+# ============ OUTBOUND TELEGRAM SCHEDULER ============
+class _TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time_module.monotonic()
+    
+    def delay(self, now):
+        """Seconds until a token is available (0 if one is available now)"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+    
+    def take(self):
+        self.tokens -= 1
+
+
+class _OutboundCall:
+    __slots__ = ("send", "merge_key", "future", "attempts", "enqueued_at", "metered")
+    
+    def __init__(self, send, merge_key, metered):
+        self.send = send
+        self.merge_key = merge_key
+        self.metered = metered
+        self.future = Future()
+        self.attempts = 0
+        self.enqueued_at = time_module.monotonic()
+
+
+class _ChatOutbox:
+    __slots__ = ("calls", "bucket", "busy", "blocked_until", "last_used")
+    
+    def __init__(self, bucket):
+        self.calls = deque()
+        self.bucket = bucket
+        self.busy = False
+        self.blocked_until = 0.0
+        self.last_used = time_module.monotonic()
+
+
+class OutboundScheduler:
+    """Paces Bot API calls that target a chat.
+
+    Calls are queued per chat (FIFO, one in flight per chat) and released
+    when both the chat's token bucket and the global bucket allow it, so
+    different chats send in parallel on a small worker pool. A 429 parks the
+    chat for ``retry_after`` and retries the same call. A new editMessageText
+    for a message whose previous edit is still queued replaces it, and both
+    callers get the one result. Callers block until their call completes, so
+    telebot's return values and exceptions are unchanged.
+    """
+    
+    UNMETERED = {"deleteMessage", "sendChatAction"}  # Ordered with the chat, but don't spend tokens
+    
+    def __init__(self, global_rate=30, chat_rate=1.0, chat_burst=3, group_rate=20 / 60, group_burst=3,
+                 workers=8, max_retries=3, idle_seconds=60):
+        self.global_bucket = _TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.idle_seconds = idle_seconds
+        self.chats = OrderedDict()  # chat_id -> _ChatOutbox, least recently used first
+        self.ready = []  # heap of (not_before, seq, chat_id)
+        self.seq = itertools.count()
+        self.in_flight = 0
+        self.cond = threading.Condition()
+        self.calls = queue.SimpleQueue()
+        self.thread = None
+        self.sent = 0
+        self.merged_edits = 0
+        self.rate_limited = 0
+        self.max_wait = 0.0
+    
+    def _outbox(self, chat_id, now):
+        outbox = self.chats.get(chat_id)
+        if outbox is None:
+            group = str(chat_id).startswith("-")
+            bucket = _TokenBucket(self.group_rate, self.group_burst) if group else _TokenBucket(self.chat_rate, self.chat_burst)
+            outbox = self.chats[chat_id] = _ChatOutbox(bucket)
+            # Forget chats idle long enough that their bucket has refilled anyway
+            while self.chats:
+                oldest_id, oldest = next(iter(self.chats.items()))
+                if oldest.calls or oldest.busy or now - oldest.last_used < self.idle_seconds:
+                    break
+                del self.chats[oldest_id]
+        else:
+            self.chats.move_to_end(chat_id)
+        outbox.last_used = now
+        return outbox
+    
+    def call(self, chat_id, method_name, send, merge_key=None):
+        """Queue ``send`` for chat_id and block until it has been executed"""
+        with self.cond:
+            if self.thread is None:
+                self._start()
+            outbox = self._outbox(chat_id, time_module.monotonic())
+            if merge_key is not None:
+                for queued in outbox.calls:
+                    if queued.merge_key == merge_key:
+                        queued.send = send  # Only the newest text matters
+                        self.merged_edits += 1
+                        future = queued.future
+                        break
+                else:
+                    future = None
+            else:
+                future = None
+            if future is None:
+                queued = _OutboundCall(send, merge_key, method_name not in self.UNMETERED)
+                future = queued.future
+                outbox.calls.append(queued)
+                if len(outbox.calls) == 1 and not outbox.busy:
+                    self._schedule(chat_id, outbox.blocked_until)
+        return future.result()
+    
+    def _schedule(self, chat_id, not_before):
+        heapq.heappush(self.ready, (not_before, next(self.seq), chat_id))
+        self.cond.notify()
+    
+    def _next_call(self):
+        """Wait for a chat whose turn has come; returns (chat_id, outbox, call) - call with cond held"""
+        while True:
+            now = time_module.monotonic()
+            wait = None
+            if self.ready and self.in_flight < self.workers:
+                not_before, _, chat_id = self.ready[0]
+                outbox = self.chats[chat_id]
+                head = outbox.calls[0]
+                wait = max(not_before - now, outbox.bucket.delay(now) if head.metered else 0.0)
+                if wait <= 0 and head.metered:
+                    wait = self.global_bucket.delay(now)
+                if wait <= 0:
+                    heapq.heappop(self.ready)
+                    if head.metered:
+                        outbox.bucket.take()
+                        self.global_bucket.take()
+                    outbox.busy = True
+                    self.in_flight += 1
+                    self.max_wait = max(self.max_wait, now - head.enqueued_at)
+                    return chat_id, outbox, outbox.calls.popleft()
+                if not_before < now + wait:
+                    # Re-key the chat so others that are ready now go first
+                    heapq.heapreplace(self.ready, (now + wait, next(self.seq), chat_id))
+                    continue
+            self.cond.wait(wait)
+    
+    def _start(self):
+        # Daemon threads: a send still blocked at shutdown must not hold the process open
+        self.thread = threading.Thread(target=self._loop, daemon=True, name="tg-outbound")
+        self.thread.start()
+        for i in range(self.workers):
+            threading.Thread(target=self._work, daemon=True, name=f"tg-send-{i}").start()
+    
+    def _loop(self):
+        while True:
+            with self.cond:
+                self.calls.put(self._next_call())
+    
+    def _work(self):
+        while True:
+            self._run(*self.calls.get())
+    
+    def _run(self, chat_id, outbox, call):
+        call.attempts += 1
+        retry_after = None
+        try:
+            result = call.send()
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code == 429 and call.attempts <= self.max_retries:
+                retry_after = (e.result_json or {}).get("parameters", {}).get("retry_after", 5)
+            else:
+                call.future.set_exception(e)
+        except Exception as e:
+            call.future.set_exception(e)
+        else:
+            call.future.set_result(result)
+        
+        with self.cond:
+            self.in_flight -= 1
+            outbox.busy = False
+            if retry_after is not None:
+                self.rate_limited += 1
+                outbox.blocked_until = time_module.monotonic() + retry_after
+                outbox.calls.appendleft(call)
+                logger.warning(f"⏳ Telegram 429 for chat {chat_id}, retrying in {retry_after}s")
+            else:
+                self.sent += 1
+            if outbox.calls:
+                self._schedule(chat_id, outbox.blocked_until)
+            else:
+                self.cond.notify()
+    
+    def get_stats(self):
+        with self.cond:
+            return {
+                "queued": sum(len(outbox.calls) for outbox in self.chats.values()),
+                "in_flight": self.in_flight,
+                "tracked_chats": len(self.chats),
+                "sent": self.sent,
+                "merged_edits": self.merged_edits,
+                "rate_limited": self.rate_limited,
+                "max_wait_seconds": round(self.max_wait, 3)
+            }
+
+
+def _route_telegram_requests(scheduler):
+    """Send chat-targeted Bot API calls through the outbound scheduler"""
+    make_request = apihelper._make_request
+    paced = {
+        "sendMessage", "editMessageText", "editMessageCaption", "editMessageMedia", "sendPhoto",
+        "sendVideo", "sendDocument", "sendAudio", "sendAnimation", "sendMediaGroup",
+        "sendChatAction", "deleteMessage"
+    }
+    
+    @wraps(make_request)
+    def routed_request(token, method_name, method='get', params=None, files=None):
+        chat_id = params.get("chat_id") if params else None
+        if chat_id is None or method_name not in paced:
+            return make_request(token, method_name, method=method, params=params, files=files)
+        merge_key = (method_name, params.get("message_id")) if method_name == "editMessageText" and not files else None
+        return scheduler.call(
+            chat_id, method_name,
+            lambda: make_request(token, method_name, method=method, params=params, files=files),
+            merge_key
+        )
+    
+    apihelper._make_request = routed_request
+
+outbound_scheduler = OutboundScheduler(
+    global_rate=OUTBOUND_GLOBAL_RATE,
+    chat_rate=OUTBOUND_CHAT_RATE,
+    chat_burst=OUTBOUND_CHAT_BURST,
+    group_rate=OUTBOUND_GROUP_RATE,
+    workers=OUTBOUND_WORKERS
+) if OUTBOUND_SCHEDULER else None
+
+if outbound_scheduler is not None:
+    _route_telegram_requests(outbound_scheduler)
+
 # ============ FLASK HEALTH ENDPOINTS ============
 @app.route('/', methods=['GET'])
 def home():
@@ -80,12 +773,14 @@ def home():
 
 @app.route('/health', methods=['GET'])
 def health():
-    api_health = ai_client.check_health() if 'ai_client' in globals() else False
+    api_health = health_monitor.get_stats() if 'health_monitor' in globals() else {'state': 'unknown'}
     return jsonify({
         'bot': 'online',
-        'api': 'healthy' if api_health else 'offline',
+        'api': api_health['state'],
+        'api_health': api_health,
         'memory_active': True,
         'thinking_ai': 'enabled',
+        'circuit_breakers': ai_client.get_breaker_states(),
         'timestamp': datetime.now().isoformat()
     })
 
@@ -104,99 +799,1242 @@ def status():
             'memory',
             'context'
         ],
+        'dispatch': (shard_router or dispatcher or webhook_ingestor).get_stats() if shard_router or DISPATCH_MODE != 'polling' else {'mode': DISPATCH_MODE},
+        'shard': {'index': SHARD_INDEX, 'shared_state': SHARED_STATE} if SHARD_INDEX else None,
+        'connection_pool': ai_client.get_pool_stats() if 'ai_client' in globals() else {},
+        'scheduler': chat_scheduler.get_stats() if globals().get('chat_scheduler') else None,
+        'generation_jobs': generation_jobs.get_stats() if globals().get('generation_jobs') else None,
+        'media_relay': media_relay.get_stats() if globals().get('media_relay') else None,
+        'memory': conversation_memory.get_stats(),
+        'rate_limiter': rate_limiter.get_stats(),
+        'usage_ledger': usage_ledger.get_stats() if globals().get('usage_ledger') else None,
+        'intent_classifier': intent_recognizer.get_stats() if isinstance(intent_recognizer, ModelIntentRecognizer) else {'classifier': 'keyword'},
+        'response_cache': response_cache.get_stats() if response_cache is not None else None,
+        'telegram_outbound': outbound_scheduler.get_stats() if outbound_scheduler is not None else None,
+        'translation_batching': translation_batcher.get_stats() if globals().get('translation_batcher') else None,
+        'request_coalescing': ai_client.single_flight.get_stats() if 'ai_client' in globals() and ai_client.single_flight else None,
+        'startup_ms': startup_timer.get_stats(),
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/webhook', methods=['POST'])
+def telegram_webhook():
+    if webhook_ingestor is None and shard_router is None:
+        return jsonify({'error': 'webhook mode disabled'}), 404
+    if not hmac.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', '').encode(), WEBHOOK_SECRET.encode()):
+        return jsonify({'error': 'forbidden'}), 403
+    
+    if shard_router is not None:
+        update = request.get_json(silent=True)
+        if not isinstance(update, dict) or 'update_id' not in update:
+            return jsonify({'error': 'bad update'}), 400
+        if not shard_router.submit(update):
+            return jsonify({'error': 'busy'}), 503, {'Retry-After': '5'}
+        return '', 200
+    
+    update = telebot.types.Update.de_json(request.get_data(as_text=True))
+    if update is None:
+        return jsonify({'error': 'bad update'}), 400
+    if not webhook_ingestor.submit(update):
+        # Queue full - Telegram will redeliver later
+        return jsonify({'error': 'busy'}), 503, {'Retry-After': '5'}
+    return '', 200
+
+if JOBS_ENABLED and JOB_CALLBACK_URL:
+    # Only exists when the backend is told to call back; the job's own token authenticates it
+    @app.route('/jobs/callback/<job_id>', methods=['POST'])
+    def job_callback(job_id):
+        accepted = generation_jobs.handle_callback(
+            job_id, request.args.get('token', ''), request.get_json(force=True, silent=True) or {}
+        )
+        return jsonify({'accepted': accepted}), 200 if accepted else 404
+
+# ============ SHARED STATE (MULTI-PROCESS) ============
+class LocalSharedState:
+    """In-process implementation of the shared-state operations.
+
+    Every operation is atomic under one lock. Used directly for tests and
+    single-process runs, and as the backing store of ``SharedStateServer``.
+    """
+    
+    name = "local"
+    
+    def __init__(self, sweep_every=10000):
+        self.lock = threading.Lock()
+        self.counters = {}  # key -> [window, current, previous, expires_at]
+        self.lists = {}
+        self.sweep_every = sweep_every
+        self.ops = 0
+    
+    def rate_hit(self, key, limit, period):
+        """Sliding-window counter: count this call and return True if it is within limit"""
+        now = time()
+        window = int(now // period)
+        with self.lock:
+            self.ops += 1
+            if self.ops % self.sweep_every == 0:
+                self.counters = {k: v for k, v in self.counters.items() if v[3] > now}
+            state = self.counters.get(key)
+            if state is None:
+                state = self.counters[key] = [window, 0, 0, 0.0]
+            elif state[0] != window:
+                state[2] = state[1] if window == state[0] + 1 else 0
+                state[1] = 0
+                state[0] = window
+            state[3] = now + 2 * period
+            overlap = 1.0 - (now - window * period) / period
+            if state[2] * overlap + state[1] < limit:
+                state[1] += 1
+                return True
+            return False
+    
+    def list_append(self, key, items, max_len):
+        with self.lock:
+            values = self.lists.setdefault(key, [])
+            values.extend(items)
+            del values[:-max_len]
+    
+    def list_range(self, key, count):
+        with self.lock:
+            return list(self.lists.get(key, ())[-count:])
+    
+    def delete(self, key):
+        with self.lock:
+            self.lists.pop(key, None)
+            self.counters.pop(key, None)
+
+
+class RedisSharedState:
+    """Shared state in Redis; the rate check-and-increment runs as one Lua script"""
+    
+    name = "redis"
+    
+    RATE_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+if previous * tonumber(ARGV[2]) + current < tonumber(ARGV[1]) then
+    redis.call('INCR', KEYS[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return 1
+end
+return 0
+"""
+    
+    def __init__(self, url="redis://localhost:6379/0", prefix="bot:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SHARED_STATE=redis needs the 'redis' package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.rate_script = self.client.register_script(self.RATE_SCRIPT)
+    
+    def rate_hit(self, key, limit, period):
+        now = time()
+        window = int(now // period)
+        overlap = 1.0 - (now - window * period) / period
+        keys = [f"{self.prefix}rl:{key}:{window}", f"{self.prefix}rl:{key}:{window - 1}"]
+        return bool(self.rate_script(keys=keys, args=[limit, overlap, 2 * period]))
+    
+    def list_append(self, key, items, max_len):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(f"{self.prefix}{key}", *items)
+        pipe.ltrim(f"{self.prefix}{key}", -max_len, -1)
+        pipe.execute()
+    
+    def list_range(self, key, count):
+        return [item.decode("utf-8") for item in self.client.lrange(f"{self.prefix}{key}", -count, -1)]
+    
+    def delete(self, key):
+        self.client.delete(f"{self.prefix}{key}")
+
+
+class UnixSocketSharedState:
+    """Client for ``SharedStateServer`` - one JSON line per request, one connection per thread"""
+    
+    name = "unix"
+    
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+    
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+            conn = self.local.conn = (sock, sock.makefile("rb"))
+        return conn
+    
+    def _close(self):
+        conn, self.local.conn = getattr(self.local, "conn", None), None
+        if conn is not None:
+            sock, reader = conn
+            reader.close()
+            sock.close()
+    
+    def _call(self, op, *args):
+        request = json.dumps([op, *args], ensure_ascii=False).encode("utf-8") + b"\n"
+        for attempt in range(2):
+            sent = False
+            try:
+                sock, reader = self._connection()
+                sock.sendall(request)
+                sent = True
+                line = reader.readline()
+                if not line:
+                    raise ConnectionError("shared state server closed the connection")
+                reply = json.loads(line)
+                if "error" in reply:
+                    raise RuntimeError(reply["error"])
+                return reply["result"]
+            except OSError:
+                self._close()
+                # Reconnect once (server restarted) - but only for a request that never went
+                # out, since the server may already have applied one that did (rate_hit)
+                if attempt or sent:
+                    raise
+    
+    def rate_hit(self, key, limit, period):
+        return self._call("rate_hit", key, limit, period)
+    
+    def list_append(self, key, items, max_len):
+        return self._call("list_append", key, items, max_len)
+    
+    def list_range(self, key, count):
+        return self._call("list_range", key, count)
+    
+    def delete(self, key):
+        return self._call("delete", key)
+
+
+class SharedStateServer:
+    """Serves a LocalSharedState over a Unix socket so worker processes on one
+    host share rate limits and conversation history without Redis."""
+    
+    OPS = ("rate_hit", "list_append", "list_range", "delete")
+    
+    def __init__(self, path, state=None):
+        self.path = path
+        self.state = state or LocalSharedState()
+        self.server = None
+    
+    def start(self):
+        state, ops = self.state, self.OPS
+        
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        op, *args = json.loads(line)
+                        if op not in ops:
+                            raise ValueError(f"unknown op {op}")
+                        reply = {"result": getattr(state, op)(*args)}
+                    except Exception as e:
+                        reply = {"error": str(e)}
+                    self.wfile.write(json.dumps(reply, ensure_ascii=False).encode("utf-8") + b"\n")
+        
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="shared-state").start()
+        logger.info(f"🔗 Shared state server on {self.path}")
+        return self
+
+
+def build_shared_state(kind):
+    if kind == "local":
+        return LocalSharedState()
+    if kind == "unix":
+        return UnixSocketSharedState(SHARED_STATE_SOCKET)
+    if kind == "redis":
+        return RedisSharedState(REDIS_URL)
+    return None
+
+shared_state = build_shared_state(SHARED_STATE)
+
+# ============ PERSISTENT CONVERSATION STORE ============
+class BatchedConversationStore:
+    """Base for durable conversation stores.
+
+    Writes are queued and flushed in batches by a background thread, so the
+    request path never waits on disk or network. Subclasses implement
+    ``_write_batch``, ``_load`` and ``compact``.
+    """
+    
+    name = "base"
+    
+    def __init__(self, max_size=10, flush_interval=1.0, batch_size=500, compact_interval=3600):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.compact_interval = compact_interval
+        self.pending = queue.Queue()
+        self.write_lock = threading.Lock()
+        self.written = 0
+        self.batches = 0
+        self.loads = 0
+        self._writer = None
+    
+    def append(self, user_id, role, message, timestamp):
+        self.pending.put(("append", user_id, role, message, timestamp))
+    
+    def clear(self, user_id):
+        self.pending.put(("clear", user_id))
+    
+    def load(self, user_id):
+        """Last max_size (role, message, timestamp) tuples for a user, oldest first"""
+        # Stored rows plus this user's still-queued ops, so a just-evicted user's latest
+        # messages are visible without forcing a flush. write_lock keeps a batch from
+        # being half-way between the queue and the database while we look.
+        with self.write_lock:
+            rows = list(self._load(user_id))
+            with self.pending.mutex:
+                queued = [op for op in self.pending.queue if op[1] == user_id]
+        self.loads += 1
+        for op in queued:
+            if op[0] == "clear":
+                rows = []
+            else:
+                rows.append(op[2:])
+        return rows[-self.max_size:]
+    
+    def flush(self):
+        with self.write_lock:
+            while True:
+                batch = []
+                try:
+                    while len(batch) < self.batch_size:
+                        batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    pass
+                if not batch:
+                    return
+                try:
+                    self._write_batch(batch)
+                    self.written += len(batch)
+                    self.batches += 1
+                except Exception as e:
+                    logger.error(f"❌ Conversation store write failed ({len(batch)} ops): {e}")
+    
+    def start(self):
+        def loop():
+            last_compact = time()
+            while True:
+                time_module.sleep(self.flush_interval)
+                self.flush()
+                if time() - last_compact >= self.compact_interval:
+                    last_compact = time()
+                    try:
+                        self.compact()
+                    except Exception as e:
+                        logger.error(f"❌ Conversation store compaction failed: {e}")
+        
+        if self._writer is None:
+            self._writer = threading.Thread(target=loop, daemon=True, name="conversation-store")
+            self._writer.start()
+            atexit.register(self.flush)
+    
+    def get_stats(self):
+        return {
+            "backend": self.name,
+            "pending_writes": self.pending.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "loads": self.loads
+        }
+
+
+class SQLiteConversationStore(BatchedConversationStore):
+    """Conversation log in SQLite (WAL mode), compacted to max_size per user"""
+    
+    name = "sqlite"
+    
+    def __init__(self, path="conversations.db", **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.read_lock = threading.Lock()
+    
+    @_lazy_attribute
+    def write_conn(self):
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, "
+            "role TEXT NOT NULL, message TEXT NOT NULL, ts REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_user ON messages(user_id, id)")
+        conn.commit()
+        return conn
+    
+    @_lazy_attribute
+    def read_conn(self):
+        self.write_conn  # Creates the table first
+        return self._connect()
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def _write_batch(self, batch):
+        with self.write_conn:
+            for op in batch:
+                if op[0] == "append":
+                    self.write_conn.execute(
+                        "INSERT INTO messages (user_id, role, message, ts) VALUES (?, ?, ?, ?)", op[1:]
+                    )
+                else:
+                    self.write_conn.execute("DELETE FROM messages WHERE user_id = ?", (op[1],))
+    
+    def _load(self, user_id):
+        with self.read_lock:
+            rows = self.read_conn.execute(
+                "SELECT role, message, ts FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                (user_id, self.max_size)
+            ).fetchall()
+        rows.reverse()
+        return rows
+    
+    def compact(self):
+        """Drop everything older than each user's last max_size messages"""
+        with self.write_lock:
+            with self.write_conn:
+                deleted = self.write_conn.execute(
+                    "DELETE FROM messages WHERE id IN ("
+                    "SELECT id FROM (SELECT id, ROW_NUMBER() OVER "
+                    "(PARTITION BY user_id ORDER BY id DESC) AS rn FROM messages) WHERE rn > ?)",
+                    (self.max_size,)
+                ).rowcount
+            self.write_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if deleted:
+            logger.info(f"🧹 Conversation store: compacted {deleted} old messages")
+        return deleted
+
+
+class RedisConversationStore(BatchedConversationStore):
+    """Conversation lists in Redis (or any Redis-compatible server)"""
+    
+    name = "redis"
+    
+    def __init__(self, url="redis://localhost:6379/0", prefix="conv:", **kwargs):
+        super().__init__(**kwargs)
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("MEMORY_STORE=redis needs the 'redis' package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+    
+    def _write_batch(self, batch):
+        pipe = self.client.pipeline(transaction=False)
+        for op in batch:
+            key = f"{self.prefix}{op[1]}"
+            if op[0] == "append":
+                pipe.rpush(key, json.dumps(op[2:], ensure_ascii=False))
+                pipe.ltrim(key, -self.max_size, -1)
+            else:
+                pipe.delete(key)
+        pipe.execute()
+    
+    def _load(self, user_id):
+        raw = self.client.lrange(f"{self.prefix}{user_id}", -self.max_size, -1)
+        return [tuple(json.loads(item)) for item in raw]
+    
+    def compact(self):
+        return 0  # LTRIM on every append keeps lists bounded
+
+
+class SharedConversationStore(BatchedConversationStore):
+    """Conversation lists in the SHARED_STATE backend, so any worker process can load a chat"""
+    
+    name = "shared"
+    
+    def __init__(self, state, prefix="conv:", **kwargs):
+        super().__init__(**kwargs)
+        self.state = state
+        self.prefix = prefix
+    
+    def _write_batch(self, batch):
+        appends = {}
+        for op in batch:
+            key = f"{self.prefix}{op[1]}"
+            if op[0] == "append":
+                appends.setdefault(key, []).append(json.dumps(op[2:], ensure_ascii=False))
+            else:
+                appends.pop(key, None)  # Anything queued before the clear is gone anyway
+                self.state.delete(key)
+        for key, items in appends.items():
+            self.state.list_append(key, items[-self.max_size:], self.max_size)
+    
+    def _load(self, user_id):
+        return [tuple(json.loads(item)) for item in self.state.list_range(f"{self.prefix}{user_id}", self.max_size)]
+    
+    def compact(self):
+        return 0  # list_append trims to max_size
+
+
+def build_conversation_store(kind):
+    options = {"max_size": MAX_MEMORY_SIZE, "flush_interval": MEMORY_STORE_FLUSH_INTERVAL}
+    if kind == "sqlite":
+        return SQLiteConversationStore(MEMORY_STORE_PATH, **options)
+    if kind == "redis":
+        return RedisConversationStore(REDIS_URL, **options)
+    if kind == "shared":
+        if shared_state is None:
+            raise RuntimeError("MEMORY_STORE=shared needs SHARED_STATE set to local, unix or redis")
+        return SharedConversationStore(shared_state, **options)
+    return None
+
+conversation_store = build_conversation_store(MEMORY_STORE)
+
 # ============ ADVANCED CONVERSATION MEMORY ============
+def estimate_tokens(text):
+    """Cheap token estimate (~4 UTF-8 bytes per token, so Devanagari counts heavier)"""
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def condense(text, max_tokens):
+    """Trim text to about max_tokens, preferring to cut at a paragraph or sentence end"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    cut = text.encode("utf-8")[:max_tokens * 4].decode("utf-8", "ignore")
+    for boundary in ("\n\n", "\n", ". ", "। ", "? ", "! "):
+        index = cut.rfind(boundary)
+        if index > len(cut) // 2:
+            cut = cut[:index + len(boundary.rstrip())]
+            break
+    return cut.rstrip() + " …"
+
+
+class MemoryEntry:
+    """One stored message - slotted, with an epoch-float timestamp.
+
+    ``context_text`` is the (possibly condensed) form used in prompts and
+    ``tokens`` its estimated size; both are computed once when stored.
+    """
+    __slots__ = ("role", "message", "timestamp", "context_text", "tokens")
+    
+    def __init__(self, role, message, timestamp, context_text=None):
+        self.role = role
+        self.message = message
+        self.timestamp = timestamp
+        self.context_text = message if context_text is None else context_text
+        self.tokens = estimate_tokens(self.context_text)
+    
+    def to_dict(self):
+        return {"role": self.role, "message": self.message, "timestamp": self.timestamp}
+
+
+class ContextWindow:
+    """A user's prompt context: the newest entries that fit the token budget.
+
+    Kept up to date as messages arrive (``push`` appends and trims from the
+    oldest end) and rendered only when the text is asked for.
+    """
+    __slots__ = ("last_n", "entries", "tokens", "text")
+    
+    def __init__(self, last_n):
+        self.last_n = last_n
+        self.entries = deque()
+        self.tokens = 0
+        self.text = None
+    
+    def push(self, entry, budget, limit):
+        self.entries.append(entry)
+        self.tokens += entry.tokens
+        while self.entries and (len(self.entries) > limit or (len(self.entries) > 1 and self.tokens > budget)):
+            self.tokens -= self.entries.popleft().tokens
+        self.text = None
+    
+    def render(self):
+        if self.text is None:
+            lines = "\n".join(f"{'👤 User' if e.role == 'user' else '🤖 Assistant'}: {e.context_text}"
+                              for e in self.entries)
+            self.text = "\n📚 **PREVIOUS CONVERSATION CONTEXT:**\n" + lines + "\n**END OF CONTEXT**\n\n"
+        return self.text
+
+
+# Fixed per-entry cost on top of the message string: slotted object + float
+_ENTRY_OVERHEAD = sys.getsizeof(MemoryEntry("user", "", 0.0)) + sys.getsizeof(0.0)
+# Per-user container cost: the deque plus (roughly) its dict slots in memory/user_bytes
+_USER_OVERHEAD = sys.getsizeof(deque(maxlen=10)) + 2 * 24
+
+
 class ConversationMemory:
-    """Advanced memory system with context awareness"""
+    """Advanced memory system with context awareness.
+
+    Users are kept in LRU order under a global byte budget; when it is
+    exceeded the least recently active users are evicted whole (history,
+    topics and preferences). Users idle longer than ``max_idle`` are swept
+    in the background. With a ``store`` every message is also persisted, and
+    a user's history is loaded lazily the first time they are touched.
+    """
     
-    def __init__(self, max_size=10):
-        self.memory = {}
+    def __init__(self, max_size=10, budget_bytes=64 * 1024 * 1024, max_idle=7 * 24 * 3600, store=None,
+                 context_tokens=800, reply_tokens=150, user_tokens=300):
+        self.memory = OrderedDict()  # user_id -> deque[MemoryEntry], LRU order
         self.max_size = max_size
+        self.context_tokens = context_tokens
+        self.entry_tokens = {"user": user_tokens, "bot": reply_tokens}
+        self.context_cache = {}  # user_id -> ContextWindow, updated as messages arrive
+        self.context_cache_hits = 0
+        self.budget_bytes = budget_bytes
+        self.max_idle = max_idle
         self.user_topics = {}  # Track user interests
         self.user_preferences = {}  # Remember preferences
+        self.user_bytes = {}
+        self.bytes_used = 0
+        self.evicted_users = 0
+        self.store = store
+        self.lock = threading.RLock()
+        self._sweeper = None
+    
+    def _make_entry(self, role, message, timestamp):
+        role = sys.intern(role)
+        limit = self.entry_tokens.get(role, self.entry_tokens["bot"])
+        return MemoryEntry(role, message, timestamp, condense(message, limit))
+    
+    @staticmethod
+    def _entry_size(entry):
+        size = _ENTRY_OVERHEAD + sys.getsizeof(entry.message)
+        if entry.context_text is not entry.message:
+            size += sys.getsizeof(entry.context_text)
+        return size
+    
+    def _load_stored(self, user_id):
+        """Stored rows for a user not in memory, read before taking the lock (None if not needed)"""
+        if self.store is None or user_id in self.memory:
+            return None
+        return self.store.load(user_id)
+    
+    def _touch(self, user_id, stored=None):
+        """Get (creating if needed) a user's history and mark them most recently used"""
+        history = self.memory.get(user_id)
+        if history is None:
+            history = self.memory[user_id] = deque(maxlen=self.max_size)
+            size = _USER_OVERHEAD
+            if self.store is not None:
+                if stored is None:
+                    stored = self.store.load(user_id)  # Evicted since _load_stored looked - rare
+                for role, message, timestamp in stored:
+                    entry = self._make_entry(role, message, timestamp)
+                    history.append(entry)
+                    size += self._entry_size(entry)
+            self.user_bytes[user_id] = size
+            self.bytes_used += size
+        else:
+            self.memory.move_to_end(user_id)
+        return history
+    
+    def _drop_user(self, user_id):
+        self.memory.pop(user_id, None)
+        self.context_cache.pop(user_id, None)
+        self.bytes_used -= self.user_bytes.pop(user_id, 0)
+        self.user_topics.pop(user_id, None)
+        self.user_preferences.pop(user_id, None)
+    
+    def _enforce_budget(self, keep_user):
+        while self.bytes_used > self.budget_bytes and len(self.memory) > 1:
+            oldest = next(iter(self.memory))
+            if oldest == keep_user:
+                break
+            self._drop_user(oldest)
+            self.evicted_users += 1
     
     def add_message(self, user_id, role, message):
-        if user_id not in self.memory:
-            self.memory[user_id] = deque(maxlen=self.max_size)
-        
-        self.memory[user_id].append({
-            "role": role,
-            "message": message,
-            "timestamp": datetime.now().isoformat()
-        })
+        entry = self._make_entry(role, message, time())
+        size = self._entry_size(entry)
+        stored = self._load_stored(user_id)
+        with self.lock:
+            history = self._touch(user_id, stored)
+            if len(history) == history.maxlen:
+                size -= self._entry_size(history[0])  # deque drops the oldest
+            history.append(entry)
+            window = self.context_cache.get(user_id)
+            if window is not None:
+                window.push(entry, self.context_tokens, min(window.last_n, len(history)))
+            self.user_bytes[user_id] += size
+            self.bytes_used += size
+            self._enforce_budget(user_id)
+        if self.store is not None:
+            self.store.append(user_id, entry.role, message, entry.timestamp)
         logger.info(f"💾 Memory: User {user_id} - {role}: {message[:60]}...")
     
+    def _existing_history(self, user_id, stored=None):
+        """History for a known (or stored) user, or None - call with the lock held"""
+        if user_id in self.memory:
+            return self._touch(user_id)
+        if self.store is None:
+            return None
+        history = self._touch(user_id, stored)
+        if not history:
+            self._drop_user(user_id)  # Nothing stored - don't keep an empty slot
+            return None
+        return history
+    
     def get_history(self, user_id, last_n=5):
-        if user_id not in self.memory:
-            return []
-        history = list(self.memory[user_id])
-        return history[-last_n:] if len(history) > last_n else history
+        stored = self._load_stored(user_id)
+        with self.lock:
+            history = self._existing_history(user_id, stored)
+            if not history:
+                return []
+            start = max(len(history) - last_n, 0)
+            return [history[i].to_dict() for i in range(start, len(history))]
     
     def get_context_string(self, user_id, last_n=5):
-        """Get enriched context with memory"""
-        history = self.get_history(user_id, last_n)
-        if not history:
-            return ""
-        
-        context = "\n📚 **PREVIOUS CONVERSATION CONTEXT:**\n"
-        for entry in history:
-            role = "👤 User" if entry["role"] == "user" else "🤖 Assistant"
-            context += f"{role}: {entry['message']}\n"
-        context += "**END OF CONTEXT**\n\n"
-        return context
+        """Get enriched context with memory.
+
+        Takes the newest entries (condensed when stored) that fit in
+        ``context_tokens``; the window is kept per user and updated by
+        ``add_message``, so it is only rebuilt when ``last_n`` changes.
+        """
+        stored = self._load_stored(user_id)
+        with self.lock:
+            window = self.context_cache.get(user_id)
+            if window is not None and window.last_n == last_n:
+                self.context_cache_hits += 1
+                self.memory.move_to_end(user_id)
+                return window.render()
+            
+            history = self._existing_history(user_id, stored)
+            if not history:
+                return ""
+            
+            window = ContextWindow(last_n)
+            for i in range(max(len(history) - last_n, 0), len(history)):
+                window.push(history[i], self.context_tokens, last_n)
+            self.context_cache[user_id] = window
+            return window.render()
     
     def clear_history(self, user_id):
-        if user_id in self.memory:
-            self.memory[user_id].clear()
-        if user_id in self.user_topics:
-            del self.user_topics[user_id]
+        with self.lock:
+            self.context_cache.pop(user_id, None)
+            if user_id in self.memory:
+                self.memory[user_id].clear()
+                self.bytes_used -= self.user_bytes[user_id] - _USER_OVERHEAD
+                self.user_bytes[user_id] = _USER_OVERHEAD
+            if user_id in self.user_topics:
+                del self.user_topics[user_id]
+        if self.store is not None:
+            self.store.clear(user_id)
         return True
     
+    def evict_idle(self, max_idle=None):
+        """Drop users whose last message is older than max_idle seconds"""
+        cutoff = time() - (self.max_idle if max_idle is None else max_idle)
+        removed = 0
+        with self.lock:
+            while self.memory:
+                user_id, history = next(iter(self.memory.items()))
+                if history and history[-1].timestamp >= cutoff:
+                    break
+                self._drop_user(user_id)
+                removed += 1
+            self.evicted_users += removed
+        return removed
+    
+    def start_sweeper(self, interval=300):
+        def loop():
+            while True:
+                time_module.sleep(interval)
+                removed = self.evict_idle()
+                if removed:
+                    logger.info(f"🧹 Memory: evicted {removed} idle users")
+        
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=loop, daemon=True, name="memory-sweeper")
+            self._sweeper.start()
+    
     def get_stats(self):
-        total_users = len(self.memory)
-        total_messages = sum(len(h) for h in self.memory.values())
-        return {
-            "total_users": total_users,
-            "total_messages": total_messages,
-            "max_size": self.max_size
-        }
+        with self.lock:
+            total_users = len(self.memory)
+            total_messages = sum(len(h) for h in self.memory.values())
+            return {
+                "total_users": total_users,
+                "total_messages": total_messages,
+                "max_size": self.max_size,
+                "bytes_used": self.bytes_used,
+                "budget_bytes": self.budget_bytes,
+                "evicted_users": self.evicted_users,
+                "context_token_budget": self.context_tokens,
+                "context_cache_hits": self.context_cache_hits,
+                "store": self.store.get_stats() if self.store is not None else None
+            }
 
-conversation_memory = ConversationMemory(max_size=MAX_MEMORY_SIZE)
+conversation_memory = ConversationMemory(
+    max_size=MAX_MEMORY_SIZE,
+    budget_bytes=MEMORY_BUDGET_MB * 1024 * 1024,
+    max_idle=MEMORY_MAX_IDLE_HOURS * 3600,
+    store=conversation_store,
+    context_tokens=CONTEXT_TOKEN_BUDGET,
+    reply_tokens=CONTEXT_REPLY_TOKENS,
+    user_tokens=CONTEXT_USER_TOKENS
+)
 
 # ============ ADVANCED RATE LIMITER ============
+class _RateWindow:
+    """Fixed-size sliding-window counter state for one (user, tier)"""
+    __slots__ = ("window", "current", "previous")
+    
+    def __init__(self, window):
+        self.window = window
+        self.current = 0
+        self.previous = 0
+
+
 class AdvancedRateLimiter:
-    """Smart rate limiting with different tiers"""
+    """Smart rate limiting with different tiers.
+
+    Uses a sliding-window counter: each (user, tier) keeps only the call
+    counts of the current and previous fixed window, and the previous one is
+    weighted by how much of it still overlaps the sliding window. Every call
+    is O(1) regardless of the tier's call limit. Each tier has its own table
+    keyed by user id in LRU order, so idle users can be swept from the front
+    cheaply; the tables together are hard-capped at ``max_entries``.
+    """
     
-    def __init__(self):
-        self.user_calls = {}
+    def __init__(self, max_entries=200_000, shared=None):
+        self.windows = {}  # tier -> OrderedDict[user_id -> _RateWindow], LRU order
+        self.entries = 0
+        self.max_entries = max_entries
+        self.shared = shared  # Shared-state backend: limits hold across worker processes
+        self.lock = threading.Lock()
         self.limits = {
             'standard': {'calls': 20, 'period': 60},
             'thinking': {'calls': 5, 'period': 120},
             'generation': {'calls': 3, 'period': 300}
         }
+        self.rejections = {tier: 0 for tier in self.limits}
+        self.evicted = 0
+        self._sweeper = None
+    
+    def __len__(self):
+        return self.entries
     
     def is_allowed(self, user_id, tier='standard'):
+        limit = self.limits[tier]
+        period = limit['period']
+        if self.shared is not None:
+            try:
+                if self.shared.rate_hit(f"{user_id}:{tier}", limit['calls'], period):
+                    return True
+                self.rejections[tier] = self.rejections.get(tier, 0) + 1
+                return False
+            except Exception as e:
+                logger.warning(f"⚠️ Shared rate limit unavailable, using local limits: {e}")
         now = time()
-        if user_id not in self.user_calls:
-            self.user_calls[user_id] = {}
+        window = int(now // period)
         
-        if tier not in self.user_calls[user_id]:
-            self.user_calls[user_id][tier] = []
+        with self.lock:
+            table = self.windows.get(tier)
+            if table is None:
+                table = self.windows[tier] = OrderedDict()
+            state = table.get(user_id)
+            if state is None:
+                state = table[user_id] = _RateWindow(window)
+                self.entries += 1
+                if self.entries > self.max_entries:
+                    # Oldest entry of the biggest table - close enough to global LRU
+                    max(self.windows.values(), key=len).popitem(last=False)
+                    self.entries -= 1
+                    self.evicted += 1
+            else:
+                table.move_to_end(user_id)
+            
+            if state.window != window:
+                state.previous = state.current if window == state.window + 1 else 0
+                state.current = 0
+                state.window = window
+            
+            overlap = 1.0 - (now - window * period) / period
+            if state.previous * overlap + state.current < limit['calls']:
+                state.current += 1
+                return True
+            self.rejections[tier] = self.rejections.get(tier, 0) + 1
+            return False
+    
+    def sweep(self):
+        """Drop entries idle for 2+ windows of their tier (they no longer affect limits)"""
+        now = time()
+        removed = 0
+        with self.lock:
+            for tier, table in self.windows.items():
+                current = int(now // self.limits[tier]['period'])
+                # LRU order: the front entry is the longest idle, so stop at the first live one
+                dropped = 0
+                while table:
+                    user_id, state = next(iter(table.items()))
+                    if state.window + 2 > current:
+                        break
+                    del table[user_id]
+                    dropped += 1
+                if dropped and dropped >= len(table):
+                    # Dicts never shrink in place; rebuild so freed slots go back to the OS
+                    self.windows[tier] = OrderedDict(table)
+                removed += dropped
+            self.entries -= removed
+            self.evicted += removed
+        return removed
+    
+    def start_sweeper(self, interval=60):
+        def loop():
+            while True:
+                time_module.sleep(interval)
+                removed = self.sweep()
+                if removed:
+                    logger.info(f"🧹 Rate limiter: swept {removed} idle entries")
         
-        limit = self.limits[tier]
-        self.user_calls[user_id][tier] = [
-            t for t in self.user_calls[user_id][tier]
-            if now - t < limit['period']
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=loop, daemon=True, name="rate-limit-sweeper")
+            self._sweeper.start()
+    
+    def get_stats(self):
+        return {
+            "entries": self.entries,
+            "evicted": self.evicted,
+            "rejections": dict(self.rejections)
+        }
+
+rate_limiter = AdvancedRateLimiter(max_entries=RATE_LIMIT_MAX_ENTRIES, shared=shared_state)
+
+# ============ USAGE LEDGER & QUOTAS ============
+class _UsageTotals:
+    __slots__ = ("day", "day_credits", "month", "month_credits", "alerted_day")
+    
+    def __init__(self, day, day_credits, month, month_credits):
+        self.day = day
+        self.day_credits = day_credits
+        self.month = month
+        self.month_credits = month_credits
+        self.alerted_day = None
+
+
+class UsageLedger:
+    """Per-user usage accounting with daily and monthly credit quotas.
+
+    Every finished request is charged in credits: a fixed cost per endpoint
+    plus its tokens and generation seconds. Charges update in-memory totals
+    at once and are queued for SQLite, where a background thread upserts
+    them in batches into one row per (user, day, intent). Admission compares
+    a user's totals plus the request's estimated cost (endpoint cost, input
+    tokens and a running average of what that intent has cost so far) with
+    the quotas. ADMIN_ID is exempt, is told when a user first hits a quota
+    and gets a summary of the previous day after midnight.
+    """
+    
+    ENDPOINT_CREDITS = {"chat": 1, "translate": 1, "code": 2, "deep_thinking": 4, "image": 10, "video": 30}
+    CREDITS_PER_1K_TOKENS = 1.0
+    CREDITS_PER_GENERATION_SECOND = 0.05
+    
+    def __init__(self, path="usage.db", daily_credits=200, monthly_credits=3000, admin_id=0,
+                 flush_interval=5.0, max_users=100_000, send_reports=True):
+        self.path = path
+        self.daily_credits = daily_credits
+        self.monthly_credits = monthly_credits
+        self.admin_id = admin_id
+        self.flush_interval = flush_interval
+        self.max_users = max_users
+        self.send_reports = send_reports  # Only one shard reports, or the admin gets one per worker
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.users = OrderedDict()  # user_id -> _UsageTotals, least recently used first
+        self.variable_cost = {}  # intent -> running average of token/second credits
+        self.pending = queue.Queue()
+        self.rejections = {"daily": 0, "monthly": 0}
+        self.written = 0
+        self.batches = 0
+        self.report_day = self._today()
+        self._writer = None
+    
+    @_lazy_attribute
+    def conn(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage_daily ("
+            "user_id INTEGER NOT NULL, day TEXT NOT NULL, intent TEXT NOT NULL, "
+            "calls INTEGER NOT NULL, tokens INTEGER NOT NULL, seconds REAL NOT NULL, credits REAL NOT NULL, "
+            "PRIMARY KEY (user_id, day, intent))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_day ON usage_daily(day)")
+        conn.commit()
+        return conn
+    
+    @staticmethod
+    def _today():
+        return datetime.now().strftime("%Y-%m-%d")
+    
+    def cost(self, intent, tokens=0, seconds=0.0):
+        return (self.ENDPOINT_CREDITS.get(intent, 1) + tokens / 1000 * self.CREDITS_PER_1K_TOKENS
+                + seconds * self.CREDITS_PER_GENERATION_SECOND)
+    
+    def estimate(self, intent, text=""):
+        return self.cost(intent, estimate_tokens(text)) + self.variable_cost.get(intent, 0.0)
+    
+    def _stored_totals(self, user_id, day):
+        """(day, month) credits from SQLite plus the user's still-queued charges.
+
+        Holds only write_lock, so no batch is half-way between the queue and
+        the table while we look; never call it with self.lock held.
+        """
+        month = day[:7]
+        with self.write_lock:
+            day_credits, month_credits = self.conn.execute(
+                "SELECT COALESCE(SUM(CASE WHEN day = ? THEN credits END), 0), COALESCE(SUM(credits), 0) "
+                "FROM usage_daily WHERE user_id = ? AND day LIKE ?", (day, user_id, month + "%")
+            ).fetchone()
+            with self.pending.mutex:
+                queued = [item for item in self.pending.queue if item[0] == user_id]
+        for _, charged_day, _, _, _, credits in queued:
+            if charged_day[:7] == month:
+                month_credits += credits
+                if charged_day == day:
+                    day_credits += credits
+        return day_credits, month_credits
+    
+    def _prefetch(self, user_id, day):
+        """Stored totals for a user not in memory yet (None if they are), read before taking self.lock"""
+        if user_id in self.users:
+            return None
+        return self._stored_totals(user_id, day)
+    
+    def _totals(self, user_id, day, stored=None):
+        """Current totals for a user; call with self.lock held, passing _prefetch's result"""
+        month = day[:7]
+        totals = self.users.get(user_id)
+        if totals is None:
+            if stored is None:
+                stored = self._stored_totals(user_id, day)  # Evicted since _prefetch looked - rare
+            totals = self.users[user_id] = _UsageTotals(day, stored[0], month, stored[1])
+            if len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+        else:
+            self.users.move_to_end(user_id)
+            if totals.day != day:
+                totals.day, totals.day_credits = day, 0.0
+            if totals.month != month:
+                totals.month, totals.month_credits = month, 0.0
+        return totals
+    
+    def admit(self, user_id, intent, text=""):
+        """None if the request fits the user's quotas, otherwise the message to send back"""
+        if user_id == self.admin_id:
+            return None
+        needed = self.estimate(intent, text)
+        day = self._today()
+        stored = self._prefetch(user_id, day)
+        with self.lock:
+            totals = self._totals(user_id, day, stored)
+            if self.daily_credits and totals.day_credits + needed > self.daily_credits:
+                period, used, quota = "daily", totals.day_credits, self.daily_credits
+            elif self.monthly_credits and totals.month_credits + needed > self.monthly_credits:
+                period, used, quota = "monthly", totals.month_credits, self.monthly_credits
+            else:
+                return None
+            self.rejections[period] += 1
+            first_today = totals.alerted_day != totals.day
+            totals.alerted_day = totals.day
+        
+        if first_today and self.admin_id:
+            try:
+                bot.send_message(self.admin_id, f"🚨 User {user_id} ne {period} quota cross kiya ({used:.0f}/{quota:g} credits)")
+            except Exception as e:
+                logger.warning(f"⚠️ Admin quota alert failed: {e}")
+        label = "Aaj ka" if period == "daily" else "Is mahine ka"
+        return (f"⚠️ {label} usage quota khatam ho gaya ({used:.0f}/{quota:g} credits, "
+                f"is request ke ~{needed:.0f} chahiye). Details: /usage")
+    
+    def record(self, user_id, intent, tokens=0, seconds=0.0):
+        """Charge a finished request; returns its cost in credits"""
+        credits = self.cost(intent, tokens, seconds)
+        day = self._today()
+        stored = self._prefetch(user_id, day)
+        with self.lock:
+            totals = self._totals(user_id, day, stored)
+            totals.day_credits += credits
+            totals.month_credits += credits
+            variable = credits - self.ENDPOINT_CREDITS.get(intent, 1)
+            self.variable_cost[intent] = 0.8 * self.variable_cost.get(intent, variable) + 0.2 * variable
+        self.pending.put((user_id, day, intent, tokens, seconds, credits))
+        return credits
+    
+    # ---- persistence ----
+    def flush(self):
+        with self.write_lock:
+            rows = {}
+            try:
+                while True:
+                    user_id, day, intent, tokens, seconds, credits = self.pending.get_nowait()
+                    row = rows.setdefault((user_id, day, intent), [0, 0, 0.0, 0.0])
+                    row[0] += 1
+                    row[1] += tokens
+                    row[2] += seconds
+                    row[3] += credits
+            except queue.Empty:
+                pass
+            if not rows:
+                return
+            try:
+                with self.conn:
+                    self.conn.executemany(
+                        "INSERT INTO usage_daily (user_id, day, intent, calls, tokens, seconds, credits) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (user_id, day, intent) DO UPDATE SET "
+                        "calls = calls + excluded.calls, tokens = tokens + excluded.tokens, "
+                        "seconds = seconds + excluded.seconds, credits = credits + excluded.credits",
+                        [(*key, *values) for key, values in rows.items()]
+                    )
+                self.written += len(rows)
+                self.batches += 1
+            except Exception as e:
+                logger.error(f"❌ Usage ledger write failed ({len(rows)} rows): {e}")
+    
+    # ---- reporting ----
+    def user_report(self, user_id):
+        """Today's per-intent breakdown and the day/month totals for a user"""
+        self.flush()
+        day = self._today()
+        stored = self._prefetch(user_id, day)
+        with self.lock:
+            totals = self._totals(user_id, day, stored)
+            day_credits, month_credits = totals.day_credits, totals.month_credits
+        with self.write_lock:
+            rows = self.conn.execute(
+                "SELECT intent, calls, tokens, seconds, credits FROM usage_daily "
+                "WHERE user_id = ? AND day = ? ORDER BY credits DESC", (user_id, day)
+            ).fetchall()
+        return {"day": day, "day_credits": day_credits, "month_credits": month_credits, "intents": rows}
+    
+    def day_report(self, day=None, top=5):
+        self.flush()
+        day = day or self._today()
+        with self.write_lock:
+            users, calls, tokens, seconds, credits = self.conn.execute(
+                "SELECT COUNT(DISTINCT user_id), COALESCE(SUM(calls), 0), COALESCE(SUM(tokens), 0), "
+                "COALESCE(SUM(seconds), 0), COALESCE(SUM(credits), 0) FROM usage_daily WHERE day = ?", (day,)
+            ).fetchone()
+            top_users = self.conn.execute(
+                "SELECT user_id, SUM(calls), SUM(credits) FROM usage_daily WHERE day = ? "
+                "GROUP BY user_id ORDER BY SUM(credits) DESC LIMIT ?", (day, top)
+            ).fetchall()
+        return {"day": day, "users": users, "calls": calls, "tokens": tokens, "seconds": seconds,
+                "credits": credits, "top_users": top_users}
+    
+    def format_day_report(self, report):
+        lines = [
+            f"📊 **Usage report {report['day']}**", "",
+            f"Users: {report['users']} | Requests: {report['calls']}",
+            f"Tokens: ~{report['tokens']} | Generation: {report['seconds'] / 60:.1f} min",
+            f"Credits: {report['credits']:.1f}"
         ]
+        if report["top_users"]:
+            lines += ["", "Top users:"]
+            lines += [f"• `{user_id}` - {calls} requests, {credits:.1f} credits" for user_id, calls, credits in report["top_users"]]
+        return "\n".join(lines)
+    
+    def _send_daily_report(self):
+        today = self._today()
+        if today == self.report_day:
+            return
+        day, self.report_day = self.report_day, today
+        if not self.admin_id or not self.send_reports:
+            return
+        try:
+            bot.send_message(self.admin_id, self.format_day_report(self.day_report(day)), parse_mode='Markdown')
+        except Exception as e:
+            logger.warning(f"⚠️ Daily usage report failed: {e}")
+    
+    def start(self):
+        def loop():
+            while True:
+                time_module.sleep(self.flush_interval)
+                self.flush()
+                self._send_daily_report()
         
-        if len(self.user_calls[user_id][tier]) < limit['calls']:
-            self.user_calls[user_id][tier].append(now)
-            return True
-        return False
+        if self._writer is None:
+            self._writer = threading.Thread(target=loop, daemon=True, name="usage-ledger")
+            self._writer.start()
+            atexit.register(self.flush)
+    
+    def get_stats(self):
+        return {
+            "tracked_users": len(self.users),
+            "daily_credits": self.daily_credits,
+            "monthly_credits": self.monthly_credits,
+            "rejections": dict(self.rejections),
+            "pending_writes": self.pending.qsize(),
+            "written": self.written,
+            "batches": self.batches
+        }
+
+usage_ledger = UsageLedger(
+    path=USAGE_DB_PATH,
+    daily_credits=USAGE_DAILY_CREDITS,
+    monthly_credits=USAGE_MONTHLY_CREDITS,
+    admin_id=ADMIN_ID,
+    flush_interval=USAGE_FLUSH_INTERVAL,
+    send_reports=SHARD_INDEX in ('', '0')
+) if USAGE_LEDGER else None
+
+# ============ COMPILED KEYWORD MATCHER ============
+def _trie_regex(words):
+    """Build a regex alternation shaped like a trie so shared prefixes are tested once"""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+    
+    def build(node):
+        end = "" in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        # Greedy optional suffix: the match at a position is always the longest keyword
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return "(?:" + body + ")?" if end else body
+    
+    return build(trie)
+
 
-rate_limiter = AdvancedRateLimiter()
+class KeywordMatcher:
+    """All keyword hits from one compiled trie regex.
+
+    Each search returns the longest keyword starting at the leftmost hit;
+    shorter keywords matching at the same position are exactly its prefixes,
+    which are precomputed. Resuming one character later finds overlapping
+    keywords without re-testing the whole table per message.
+    """
+    
+    def __init__(self, keyword_owners):
+        # keyword_owners: lowercased keyword -> list of intent names
+        self.keyword_owners = keyword_owners
+        keywords = sorted(keyword_owners, key=len, reverse=True)
+        self.prefixes = {
+            kw: [other for other in keywords if kw.startswith(other)]
+            for kw in keywords
+        }
+        self.pattern = re.compile(_trie_regex(keywords))
+    
+    def find_all(self, text_lower):
+        """List of (position, keyword) for every keyword occurrence"""
+        found = []
+        search = self.pattern.search
+        match = search(text_lower)
+        while match is not None:
+            position = match.start()
+            for keyword in self.prefixes[match.group()]:
+                found.append((position, keyword))
+            match = search(text_lower, position + 1)
+        return found
 
 # ============ ADVANCED NLP INTENT RECOGNITION ============
 class AdvancedIntentRecognizer:
@@ -246,216 +2084,2580 @@ class AdvancedIntentRecognizer:
                 "type": "chat"
             }
         }
+        self.compile()
+    
+    def compile(self):
+        """Compile the keyword table into one matcher (call again after editing intents)"""
+        self.priority = sorted(
+            self.intents,
+            key=lambda name: self.intents[name]["type"] != "deep_thinking"
+        )
+        keyword_owners = {}
+        for intent in self.priority:
+            for keyword in self.intents[intent]["keywords"]:
+                owners = keyword_owners.setdefault(keyword.lower(), [])
+                if intent not in owners:
+                    owners.append(intent)
+        self.rank = {intent: i for i, intent in enumerate(self.priority)}
+        self.matcher = KeywordMatcher(keyword_owners)
+        # Longest keyword at a hit -> (rank, intent) of the best intent among it and its prefixes
+        self.best_owner = {
+            kw: min((self.rank[intent], intent) for prefix in prefixes for intent in keyword_owners[prefix])
+            for kw, prefixes in self.matcher.prefixes.items()
+        }
+    
+    def find_matches(self, text):
+        """Every matched keyword as {"intent", "keyword", "position"}, in text order"""
+        matches = []
+        for position, keyword in self.matcher.find_all(text.lower()):
+            for intent in self.matcher.keyword_owners[keyword]:
+                matches.append({"intent": intent, "keyword": keyword, "position": position})
+        return matches
+    
+    def recognize_intent(self, text):
+        # Deep thinking first (highest priority), then intents in table order. Hits come
+        # in text order, so the first hit of a better rank is also its earliest one.
+        best_owner = self.best_owner
+        search = self.matcher.pattern.search
+        text_lower = text.lower()
+        best = None
+        match = search(text_lower)
+        while match is not None:
+            owner = best_owner[match.group()]
+            if best is None or owner < best:
+                best = owner
+                if best[0] == 0:
+                    break  # Nothing outranks the top intent
+            match = search(text_lower, match.start() + 1)
+        
+        if best is not None:
+            intent = best[1]
+            intent_type = self.intents[intent]["type"]
+            return {
+                "intent": intent,
+                "type": intent_type,
+                "confidence": 0.95 if intent_type == "deep_thinking" else 0.85
+            }
+        
+        # Default to chat
+        return {
+            "intent": "general_query",
+            "type": "chat",
+            "confidence": 0.5
+        }
+
+# ============ LEARNED INTENT MODEL ============
+class NgramIntentModel:
+    """Linear intent classifier over character n-grams and words.
+
+    A message's features are the 2-4 character n-grams of its lowercased,
+    space-padded text plus its words. A class scores its bias plus the
+    weights of the features present; softmax turns scores into
+    probabilities. Weights are trained offline from a labelled corpus
+    (benchmarks/train_intent_model.py) and stored as JSON.
+    """
+    
+    NGRAM_SIZES = (2, 3, 4)
+    MAX_CHARS = 300  # The intent is in the first few sentences; keeps long messages fast
+    
+    def __init__(self, classes, bias, weights, meta=None):
+        self.classes = list(classes)
+        self.bias = list(bias)
+        self.weights = weights  # feature -> list of per-class weights
+        self.meta = meta or {}
+    
+    @classmethod
+    def features(cls, text):
+        text = (" " + " ".join(text.lower().split()) + " ")[:cls.MAX_CHARS]
+        grams = {"w:" + word for word in text.split()}
+        for n in cls.NGRAM_SIZES:
+            grams.update(text[i:i + n] for i in range(len(text) - n + 1))
+        return grams
+    
+    def probabilities(self, text):
+        scores = self.bias
+        weights = self.weights
+        for feature in self.features(text):
+            w = weights.get(feature)
+            if w is not None:
+                scores = [s + x for s, x in zip(scores, w)]
+        top = max(scores)
+        exps = [math.exp(s - top) for s in scores]
+        total = sum(exps)
+        return [e / total for e in exps]
+    
+    def predict(self, text):
+        """(intent type, probability) of the most likely class"""
+        probs = self.probabilities(text)
+        best = max(range(len(probs)), key=probs.__getitem__)
+        return self.classes[best], probs[best]
+    
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        classes = data["classes"]
+        if len(data["bias"]) != len(classes) or any(len(w) != len(classes) for w in data["weights"].values()):
+            raise ValueError(f"{path}: weight rows don't match {len(classes)} classes")
+        return cls(classes, data["bias"], data["weights"], data.get("meta"))
+    
+    def save(self, path, precision=4):
+        """Write atomically, so a recognizer watching the file never reads half a model"""
+        data = {
+            "classes": self.classes,
+            "bias": [round(b, precision) for b in self.bias],
+            "weights": {f: [round(x, precision) for x in w] for f, w in sorted(self.weights.items())},
+            "meta": self.meta
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+
+class ModelIntentRecognizer:
+    """Intent recognition by an NgramIntentModel file, reloaded without a restart.
+
+    The model is loaded by the watcher thread from ``start()``, off the
+    startup path (or on first use when no watcher runs). The file's mtime is
+    then checked every ``reload_interval`` seconds and a changed file is
+    swapped in (a file that fails to load keeps the current model).
+    Messages the model is unsure about (top probability below
+    ``min_confidence``), and all messages while no model is loaded, go to
+    the keyword recognizer. Results have the same shape as the keyword
+    recognizer's plus ``source``.
+    """
+    
+    def __init__(self, path, fallback, min_confidence=0.5, reload_interval=30):
+        self.path = path
+        self.fallback = fallback
+        self.min_confidence = min_confidence
+        self.reload_interval = reload_interval
+        self.model = None
+        self.mtime = None
+        self.loaded_at = None
+        self.reloads = 0
+        self.load_errors = 0
+        self.by_source = {"model": 0, "keyword": 0}
+        self.lock = threading.Lock()
+        self._watcher = None
+    
+    def reload(self):
+        """Load the model file if it changed; True when a new model was swapped in"""
+        with self.lock:
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                return False
+            if mtime == self.mtime:
+                return False
+            self.mtime = mtime
+            try:
+                model = NgramIntentModel.load(self.path)
+            except Exception as e:
+                self.load_errors += 1
+                logger.error(f"❌ Intent model {self.path} not loaded, keeping the current one: {e}")
+                return False
+            self.model = model
+            self.loaded_at = datetime.now().isoformat()
+            self.reloads += 1
+        logger.info(f"🧭 Intent model loaded: {len(model.weights)} features, classes {model.classes}")
+        return True
+    
+    def recognize_intent(self, text):
+        if self.model is None and self._watcher is None:
+            self.reload()
+        model = self.model
+        if model is not None:
+            intent_type, confidence = model.predict(text)
+            if confidence >= self.min_confidence:
+                self.by_source["model"] += 1
+                return {
+                    "intent": intent_type,
+                    "type": intent_type,
+                    "confidence": round(confidence, 3),
+                    "source": "model"
+                }
+        self.by_source["keyword"] += 1
+        result = self.fallback.recognize_intent(text)
+        result["source"] = "keyword"
+        return result
+    
+    def start(self):
+        def loop():
+            while True:
+                self.reload()
+                time_module.sleep(self.reload_interval)
+        
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=loop, daemon=True, name="intent-model-reload")
+            self._watcher.start()
+    
+    def get_stats(self):
+        model = self.model
+        return {
+            "classifier": "model" if model is not None else "keyword (no model loaded)",
+            "model_path": self.path,
+            "model_meta": model.meta if model is not None else None,
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "load_errors": self.load_errors,
+            "by_source": dict(self.by_source)
+        }
+
+
+def build_intent_recognizer(kind):
+    if kind == 'model':
+        return ModelIntentRecognizer(
+            INTENT_MODEL_PATH, AdvancedIntentRecognizer(),
+            min_confidence=INTENT_MIN_CONFIDENCE,
+            reload_interval=INTENT_MODEL_RELOAD_INTERVAL
+        )
+    return AdvancedIntentRecognizer()
+
+intent_recognizer = build_intent_recognizer(INTENT_CLASSIFIER)
+
+# ============ HTTP CONNECTION POOL ============
+class ConnectionCounter:
+    """Thread-safe counters for new vs reused backend connections"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+    
+    def record_request(self):
+        with self.lock:
+            self.requests += 1
+    
+    def record_new(self):
+        with self.lock:
+            self.new_connections += 1
+    
+    def record_reuse(self):
+        with self.lock:
+            self.reused_connections += 1
+    
+    def get_stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": self.reused_connections,
+                "reuse_ratio": round(self.reused_connections / self.requests, 3) if self.requests else 0.0
+            }
+
+
+def _counting_pool_class(base, counter, idle_timeout=None):
+    """urllib3 pool subclass that reports every freshly opened socket.
+
+    urllib3 never expires idle connections itself, so with ``idle_timeout``
+    a connection that sat in the pool longer than that is closed when it is
+    next taken out and reconnected, like one the server had dropped.
+    """
+    
+    class CountingPool(base):
+        def _new_conn(self):
+            counter.record_new()
+            return super()._new_conn()
+        
+        def _get_conn(self, timeout=None):
+            conn = super()._get_conn(timeout)
+            idle_since = getattr(conn, "_idle_since", None)
+            if idle_timeout and idle_since is not None and time() - idle_since > idle_timeout and conn.sock is not None:
+                conn.close()
+                counter.record_new()
+            return conn
+        
+        def _put_conn(self, conn):
+            if conn is not None:
+                conn._idle_since = time()
+            super()._put_conn(conn)
+    
+    return CountingPool
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """requests adapter with a fixed-size keep-alive pool and connection counters"""
+    
+    def __init__(self, counter, pool_size=20, idle_timeout=None, **kwargs):
+        self.counter = counter
+        self.idle_timeout = idle_timeout
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0, **kwargs)
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool_class(HTTPConnectionPool, self.counter, self.idle_timeout),
+            "https": _counting_pool_class(HTTPSConnectionPool, self.counter, self.idle_timeout)
+        }
+    
+    def send(self, request, **kwargs):
+        self.counter.record_request()
+        return super().send(request, **kwargs)
+    
+    def get_stats(self):
+        stats = self.counter.get_stats()
+        # urllib3 has no reuse hook, so reuse is every request that didn't open a socket
+        stats["reused_connections"] = max(stats["requests"] - stats["new_connections"], 0)
+        stats["reuse_ratio"] = round(stats["reused_connections"] / stats["requests"], 3) if stats["requests"] else 0.0
+        return stats
+
+# ============ RESPONSE CACHE ============
+class MemoryCacheBackend:
+    """In-process LRU cache with per-entry TTL"""
+    
+    name = "memory"
+    
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+    
+    def get(self, key, now):
+        """Returns (value, expired) - value is None on miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, False
+            expires_at, value = entry
+            if expires_at <= now:
+                del self.entries[key]
+                return None, True
+            self.entries.move_to_end(key)
+            return value, False
+    
+    def set(self, key, value, expires_at):
+        """Store value, returns number of LRU evictions"""
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            evicted = 0
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                evicted += 1
+            return evicted
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def __len__(self):
+        return len(self.entries)
+
+
+class SQLiteCacheBackend:
+    """On-disk cache (survives restarts) with TTL and LRU eviction"""
+    
+    name = "sqlite"
+    
+    def __init__(self, path="response_cache.db", max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+    
+    @_lazy_attribute
+    def conn(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON response_cache(accessed_at)")
+        conn.commit()
+        return conn
+    
+    def get(self, key, now):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None, False
+            value, expires_at = row
+            if expires_at <= now:
+                self.conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self.conn.commit()
+                return None, True
+            self.conn.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            return json.loads(value), False
+    
+    def set(self, key, value, expires_at):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, time())
+            )
+            overflow = self.conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self.conn.execute(
+                    "DELETE FROM response_cache WHERE key IN "
+                    "(SELECT key FROM response_cache ORDER BY accessed_at LIMIT ?)", (overflow,)
+                )
+            self.conn.commit()
+            return max(overflow, 0)
+    
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM response_cache")
+            self.conn.commit()
+    
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+class ResponseCache:
+    """Payload-keyed cache for deterministic backend calls.
+
+    Only operations listed in ``rules`` (operation -> TTL seconds) are cached;
+    callers pass ``cache_op=None`` for anything context-dependent.
+    """
+    
+    def __init__(self, backend, default_ttl=3600):
+        self.backend = backend
+        self.rules = {
+            "translate": default_ttl,
+            "generate_code": default_ttl,
+            "standard_chat": default_ttl
+        }
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def is_cacheable(self, op):
+        return op in self.rules
+    
+    def make_key(self, op, payload):
+        normalized = {
+            k: " ".join(v.split()) if isinstance(v, str) else v
+            for k, v in payload.items()
+        }
+        raw = json.dumps([op, normalized], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def get(self, key):
+        value, expired = self.backend.get(key, time())
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                if expired:
+                    self.expirations += 1
+            else:
+                self.hits += 1
+        return value
+    
+    def set(self, op, key, value):
+        evicted = self.backend.set(key, value, time() + self.rules[op])
+        if evicted:
+            with self.lock:
+                self.evictions += evicted
+    
+    def clear(self):
+        self.backend.clear()
+    
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+
+def build_response_cache(kind):
+    if kind == "memory":
+        return ResponseCache(MemoryCacheBackend(RESPONSE_CACHE_SIZE), RESPONSE_CACHE_TTL)
+    if kind == "sqlite":
+        return ResponseCache(SQLiteCacheBackend(RESPONSE_CACHE_PATH, RESPONSE_CACHE_SIZE), RESPONSE_CACHE_TTL)
+    return None
+
+response_cache = build_response_cache(RESPONSE_CACHE_BACKEND)
+
+# ============ REQUEST COALESCING (SINGLE-FLIGHT) ============
+class _Flight:
+    __slots__ = ("done", "result", "error", "waiters")
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class _AsyncFlight:
+    __slots__ = ("task", "waiters")
+    
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Collapse concurrent identical backend calls into one upstream request.
+
+    The first caller for a key (the leader) performs the call; everyone who
+    arrives while it is in flight waits and receives the same result.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.async_flights = {}
+        self.leader_calls = 0
+        self.deduplicated = 0
+    
+    # Per-request routing fields - identical generations from different jobs still collapse
+    KEY_EXCLUDE = ("callback_url", "job_id")
+    
+    @classmethod
+    def make_key(cls, path, payload):
+        payload = {k: v for k, v in payload.items() if k not in cls.KEY_EXCLUDE}
+        raw = json.dumps([path, payload], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def do(self, key, fn):
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = _Flight()
+                self.leader_calls += 1
+                leader = True
+            else:
+                flight.waiters += 1
+                self.deduplicated += 1
+                leader = False
+        
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        
+        try:
+            flight.result = fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+    
+    async def do_async(self, key, coro_fn):
+        # The call runs in its own task and every caller awaits it through a shield, so a
+        # cancelled caller - the leader included - doesn't cancel it for the others
+        flight = self.async_flights.get(key)
+        if flight is None:
+            flight = self.async_flights[key] = _AsyncFlight(asyncio.ensure_future(coro_fn()))
+            flight.task.add_done_callback(functools.partial(self._async_done, key))
+            with self.lock:
+                self.leader_calls += 1
+        else:
+            with self.lock:
+                self.deduplicated += 1
+        
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                flight.task.cancel()  # Every caller gave up
+    
+    def _async_done(self, key, task):
+        del self.async_flights[key]
+        if not task.cancelled():
+            task.exception()  # Mark retrieved when nobody was left waiting
+    
+    def get_stats(self):
+        with self.lock:
+            upstream = self.leader_calls
+            total = upstream + self.deduplicated
+            return {
+                "upstream_calls": upstream,
+                "deduplicated_calls": self.deduplicated,
+                "in_flight": len(self.flights) + len(self.async_flights),
+                "dedup_ratio": round(self.deduplicated / total, 3) if total else 0.0
+            }
+
+# ============ RETRIES & CIRCUIT BREAKER ============
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose breaker is open"""
+
+
+class CircuitBreaker:
+    """Per-endpoint breaker: closed -> open after N consecutive failures ->
+    half-open after ``reset_timeout`` (one probe call) -> closed on success."""
+    
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.trips = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+    
+    def before_call(self):
+        with self.lock:
+            if self.state == "open":
+                remaining = self.reset_timeout - (time() - self.opened_at)
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"AI backend unavailable ({self.name}), retry in {remaining:.0f}s")
+                self.state = "half_open"
+                self.probe_in_flight = False
+            if self.state == "half_open":
+                if self.probe_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"AI backend recovering ({self.name}), retry shortly")
+                self.probe_in_flight = True
+    
+    def release_probe(self):
+        """Free the half-open probe slot after a call that ended without an outcome (e.g. cancelled)"""
+        with self.lock:
+            self.probe_in_flight = False
+    
+    def record_success(self):
+        with self.lock:
+            if self.state != "closed":
+                logger.info(f"✅ Circuit {self.name} closed")
+            self.state = "closed"
+            self.failures = 0
+            self.probe_in_flight = False
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.trips += 1
+                    logger.warning(f"⚠️ Circuit {self.name} opened after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time()
+    
+    def snapshot(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "retry_in": max(round(self.reset_timeout - (time() - self.opened_at), 1), 0) if self.state == "open" else 0
+            }
+
+# ============ ADVANCED AI API CLIENT ============
+class AdvancedAIAPIClient:
+    """Enhanced API client with multiple AI models (sync + async)"""
+    
+    def __init__(self, base_url, pool_size=20, keepalive=True, keepalive_timeout=60, connect_timeout=5, cache=None, coalesce=True,
+                 max_retries=2, retry_base_delay=0.5, breaker_threshold=5, breaker_reset=30,
+                 translate_parallelism=4):
+        self.base_url = base_url
+        self.cache = cache
+        self.single_flight = SingleFlight() if coalesce else None
+        self.timeout = 120  # Default read timeout for unlisted endpoints
+        self.connect_timeout = connect_timeout
+        self.read_timeouts = {
+            "/health": 5,
+            "/api/chat": 120,  # Increased for thinking
+            "/api/image": 120,
+            "/api/video": 300,
+            "/api/code": 90,
+            "/api/translate": 30,
+            "/api/translate/batch": 60,
+            "/api/jobs": 10
+        }
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.keepalive_timeout = keepalive_timeout
+        
+        self.adapter = PooledHTTPAdapter(ConnectionCounter(), pool_size=pool_size,
+                                         idle_timeout=keepalive_timeout if keepalive else None)
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self.session.headers.update(self._keepalive_headers())
+        
+        self._async_session = None
+        self._async_counter = ConnectionCounter()
+        
+        # Retries only where repeating the call is harmless (no generation side effects)
+        self.idempotent_paths = {"/api/chat", "/api/code", "/api/translate", "/api/translate/batch", "/api/jobs"}
+        self.retryable_statuses = {502, 503, 504}
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.breakers = {}
+        self.retries = 0
+        
+        # Flipped off the first time the backend has no batch translate endpoint
+        self.batch_translate_supported = True
+        self.translate_parallelism = translate_parallelism
+    
+    @_lazy_attribute
+    def translate_pool(self):
+        return ThreadPoolExecutor(max_workers=self.translate_parallelism, thread_name_prefix="translate")
+    
+    def _keepalive_headers(self):
+        if self.keepalive:
+            return {"Connection": "keep-alive", "Keep-Alive": f"timeout={self.keepalive_timeout}"}
+        return {"Connection": "close"}
+    
+    def _timeout_for(self, path):
+        """(connect, read) timeout tuple for an endpoint"""
+        return (self.connect_timeout, self.read_timeouts.get(path, self.timeout))
+    
+    # ---- transport ----
+    def _post(self, path, payload):
+        response = self.session.post(
+            f"{self.base_url}{path}",
+            json=payload,
+            timeout=self._timeout_for(path)
+        )
+        if response.status_code == 200:
+            return response.status_code, response.json()
+        return response.status_code, None
+    
+    async def _get_async_session(self):
+        if self._async_session is None or self._async_session.closed:
+            counter = self._async_counter
+            
+            async def on_request_start(session, ctx, params):
+                counter.record_request()
+            
+            async def on_connection_create_end(session, ctx, params):
+                counter.record_new()
+            
+            async def on_connection_reuseconn(session, ctx, params):
+                counter.record_reuse()
+            
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_request_start.append(on_request_start)
+            trace_config.on_connection_create_end.append(on_connection_create_end)
+            trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+            
+            if self.keepalive:
+                connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+            else:
+                connector = aiohttp.TCPConnector(limit=self.pool_size, force_close=True)
+            self._async_session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self._keepalive_headers(),
+                trace_configs=[trace_config]
+            )
+        return self._async_session
+    
+    def _async_timeout_for(self, path):
+        connect, read = self._timeout_for(path)
+        return aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+    
+    async def _post_async(self, path, payload):
+        session = await self._get_async_session()
+        async with session.post(f"{self.base_url}{path}", json=payload, timeout=self._async_timeout_for(path)) as response:
+            if response.status == 200:
+                return response.status, await response.json(content_type=None)
+            return response.status, None
+    
+    # ---- retries + circuit breaker ----
+    def _breaker(self, path):
+        breaker = self.breakers.get(path)
+        if breaker is None:
+            breaker = self.breakers.setdefault(
+                path, CircuitBreaker(path, self.breaker_threshold, self.breaker_reset)
+            )
+        return breaker
+    
+    def _retries_for(self, path):
+        return self.max_retries if path in self.idempotent_paths else 0
+    
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, self.retry_base_delay * (2 ** attempt))
+    
+    @staticmethod
+    def _is_retryable(e):
+        # Connection failures never reached the backend; read timeouts may have, so don't repeat them
+        if isinstance(e, requests.ConnectionError):
+            return True
+        if not type(e).__module__.startswith("aiohttp"):
+            return False  # Don't import aiohttp just to classify a sync-path error
+        return isinstance(e, aiohttp.ClientConnectionError) and not isinstance(e, asyncio.TimeoutError)
+    
+    def _call_resilient(self, path, send):
+        breaker = self._breaker(path)
+        retries = self._retries_for(path)
+        for attempt in range(retries + 1):
+            breaker.before_call()
+            try:
+                status, data = send()
+            except Exception as e:
+                breaker.record_failure()
+                if attempt < retries and self._is_retryable(e):
+                    self.retries += 1
+                    time_module.sleep(self._backoff(attempt))
+                    continue
+                raise
+            except BaseException:
+                breaker.release_probe()  # Interrupted - otherwise a half-open breaker waits on this probe forever
+                raise
+            if status < 500:
+                breaker.record_success()
+                return status, data
+            breaker.record_failure()
+            if attempt < retries and status in self.retryable_statuses:
+                self.retries += 1
+                time_module.sleep(self._backoff(attempt))
+                continue
+            return status, data
+    
+    async def _call_resilient_async(self, path, send):
+        breaker = self._breaker(path)
+        retries = self._retries_for(path)
+        for attempt in range(retries + 1):
+            breaker.before_call()
+            try:
+                status, data = await send()
+            except Exception as e:
+                breaker.record_failure()
+                if attempt < retries and self._is_retryable(e):
+                    self.retries += 1
+                    await asyncio.sleep(self._backoff(attempt))
+                    continue
+                raise
+            except BaseException:
+                breaker.release_probe()  # Cancelled - otherwise a half-open breaker waits on this probe forever
+                raise
+            if status < 500:
+                breaker.record_success()
+                return status, data
+            breaker.record_failure()
+            if attempt < retries and status in self.retryable_statuses:
+                self.retries += 1
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            return status, data
+    
+    def get_breaker_states(self):
+        return {path: breaker.snapshot() for path, breaker in self.breakers.items()}
+    
+    # ---- cache-aware, coalesced request path ----
+    def _cache_lookup(self, payload, cache_op):
+        if self.cache is None or not self.cache.is_cacheable(cache_op):
+            return None, None
+        key = self.cache.make_key(cache_op, payload)
+        return key, self.cache.get(key)
+    
+    def _cache_store(self, cache_op, key, data):
+        if key is not None and data is not None and "error" not in data:
+            self.cache.set(cache_op, key, data)
+    
+    def _request(self, path, payload, cache_op=None):
+        key, cached = self._cache_lookup(payload, cache_op)
+        if cached is not None:
+            return 200, cached
+        send = lambda: self._call_resilient(path, lambda: self._post(path, payload))
+        if self.single_flight is None:
+            status, data = send()
+        else:
+            flight_key = self.single_flight.make_key(path, payload)
+            status, data = self.single_flight.do(flight_key, send)
+        self._cache_store(cache_op, key, data)
+        return status, data
+    
+    async def _request_async(self, path, payload, cache_op=None):
+        key, cached = self._cache_lookup(payload, cache_op)
+        if cached is not None:
+            return 200, cached
+        send = lambda: self._call_resilient_async(path, lambda: self._post_async(path, payload))
+        if self.single_flight is None:
+            status, data = await send()
+        else:
+            flight_key = self.single_flight.make_key(path, payload)
+            status, data = await self.single_flight.do_async(flight_key, send)
+        self._cache_store(cache_op, key, data)
+        return status, data
+    
+    def get_pool_stats(self):
+        return {
+            "pool_size": self.pool_size,
+            "keepalive": self.keepalive,
+            "keepalive_timeout": self.keepalive_timeout,
+            "sync": self.adapter.get_stats(),
+            "async": self._async_counter.get_stats()
+        }
+    
+    async def close_async(self):
+        if self._async_session is not None and not self._async_session.closed:
+            await self._async_session.close()
+        self._async_session = None
+    
+    # ---- payload builders (shared by sync + async methods) ----
+    def _deep_thinking_payload(self, message, context):
+        full_message = context + message if context else message
+        return {
+            "message": full_message,
+            "model": DEEP_THINKING_MODEL,
+            "max_tokens": 2000,
+            "thinking": True,
+            "temperature": 0.7,
+            "deep_analysis": True
+        }
+    
+    def _standard_chat_payload(self, message, context):
+        full_message = context + message if context else message
+        return {
+            "message": full_message,
+            "model": STANDARD_MODEL,
+            "max_tokens": 1000
+        }
+    
+    def _image_payload(self, prompt, style, callback_url=None):
+        payload = {
+            "prompt": prompt,
+            "style": style,
+            "size": "1024x1024",
+            "quality": "high",
+            "detailed": True
+        }
+        if callback_url:
+            payload["callback_url"] = callback_url
+        return payload
+    
+    def _video_payload(self, description, duration, callback_url=None):
+        payload = {
+            "description": description,
+            "duration": duration,
+            "quality": "1080p",
+            "detailed": True
+        }
+        if callback_url:
+            payload["callback_url"] = callback_url
+        return payload
+    
+    def _code_payload(self, description, language):
+        return {
+            "description": description,
+            "language": language,
+            "detailed": True,
+            "with_comments": True
+        }
+    
+    def _translate_payload(self, text, target_language):
+        return {
+            "text": text,
+            "target_language": target_language,
+            "preserve_meaning": True
+        }
+    
+    def _translate_batch_payload(self, texts, target_language):
+        return {
+            "texts": texts,
+            "target_language": target_language,
+            "preserve_meaning": True
+        }
+    
+    def _split_cached_translations(self, texts, target_language):
+        """Per-segment cache lookups -> (results with hits filled in, cache keys, indexes still to translate)"""
+        results, keys, misses = [None] * len(texts), [None] * len(texts), []
+        for i, text in enumerate(texts):
+            keys[i], cached = self._cache_lookup(self._translate_payload(text, target_language), "translate")
+            if cached is not None:
+                results[i] = cached
+            else:
+                misses.append(i)
+        return results, keys, misses
+    
+    def _apply_batch_translations(self, results, keys, misses, data):
+        translations = data.get("translations") if data else None
+        if not isinstance(translations, list) or len(translations) != len(misses):
+            for i in misses:
+                results[i] = {"error": "Batch translation failed"}
+            return
+        for i, translated in zip(misses, translations):
+            results[i] = {"translated_text": translated}
+            self._cache_store("translate", keys[i], results[i])
+    
+    # ---- sync API ----
+    @instrument_ai_call
+    def check_health(self):
+        try:
+            response = self.session.get(f"{self.base_url}/health", timeout=self._timeout_for("/health"))
+            return response.status_code == 200
+        except:
+            return False
+    
+    @instrument_ai_call
+    def deep_thinking_chat(self, message, context=""):
+        """🧠 Deep Thinking AI - Like Claude with Extended Thinking"""
+        try:
+            logger.info(f"🧠 Deep Thinking Request: {message[:50]}...")
+            status, data = self._request("/api/chat", self._deep_thinking_payload(message, context))
+            if data is not None:
+                return data
+            return {"error": f"API Error: {status}"}
+        except Exception as e:
+            logger.error(f"Deep thinking error: {e}")
+            return {"error": str(e)}
+    
+    @instrument_ai_call
+    def standard_chat(self, message, context=""):
+        """Standard AI Chat"""
+        try:
+            status, data = self._request("/api/chat", self._standard_chat_payload(message, context),
+                                         cache_op=None if context else "standard_chat")
+            if data is not None:
+                return data
+            return {"error": f"API Error: {status}"}
+        except Exception as e:
+            return {"error": str(e)}
+    
+    @instrument_ai_call
+    def generate_image(self, prompt, style="realistic", callback_url=None):
+        """🎨 Advanced Image Generation"""
+        try:
+            logger.info(f"🎨 Image Generation: {prompt}")
+            status, data = self._request("/api/image", self._image_payload(prompt, style, callback_url))
+            if data is not None:
+                return data
+            return {"error": f"Image generation failed: {status}"}
+        except Exception as e:
+            logger.error(f"Image gen error: {e}")
+            return {"error": str(e)}
+    
+    @instrument_ai_call
+    def generate_video(self, description, duration=10, callback_url=None):
+        """🎥 Advanced Video Generation"""
+        try:
+            logger.info(f"🎥 Video Generation: {description}")
+            status, data = self._request("/api/video", self._video_payload(description, duration, callback_url))
+            if data is not None:
+                return data
+            return {"error": f"Video generation failed: {status}"}
+        except Exception as e:
+            logger.error(f"Video gen error: {e}")
+            return {"error": str(e)}
+    
+    @instrument_ai_call
+    def get_job_status(self, backend_job_id):
+        """Status of an asynchronously accepted generation job"""
+        def send():
+            response = self.session.get(
+                f"{self.base_url}/api/jobs/{backend_job_id}",
+                timeout=self._timeout_for("/api/jobs")
+            )
+            return response.status_code, response.json() if response.status_code == 200 else None
+        
+        try:
+            status, data = self._call_resilient("/api/jobs", send)
+            if data is not None:
+                return data
+            return {"status": "unknown", "error": f"Job status failed: {status}"}
+        except Exception as e:
+            return {"status": "unknown", "error": str(e)}
+    
+    @instrument_ai_call
+    def generate_code(self, description, language="python"):
+        """💻 Advanced Code Generation"""
+        try:
+            status, data = self._request("/api/code", self._code_payload(description, language),
+                                         cache_op="generate_code")
+            if data is not None:
+                return data
+            return {"error": f"Code generation failed"}
+        except Exception as e:
+            return {"error": str(e)}
+    
+    @instrument_ai_call
+    def translate(self, text, target_language="hindi"):
+        """🌐 Advanced Translation"""
+        try:
+            status, data = self._request("/api/translate", self._translate_payload(text, target_language),
+                                         cache_op="translate")
+            if data is not None:
+                return data
+            return {"error": "Translation failed"}
+        except Exception as e:
+            return {"error": str(e)}
+    
+    @instrument_ai_call
+    def translate_batch(self, texts, target_language="hindi"):
+        """🌐 Translate several segments in one upstream call.
+
+        Returns one result dict per text, in order. Falls back to parallel
+        single translate calls when the backend has no batch endpoint.
+        """
+        results, keys, misses = self._split_cached_translations(texts, target_language)
+        if not misses:
+            return results
+        if self.batch_translate_supported:
+            try:
+                status, data = self._request(
+                    "/api/translate/batch", self._translate_batch_payload([texts[i] for i in misses], target_language)
+                )
+            except Exception as e:
+                for i in misses:
+                    results[i] = {"error": str(e)}
+                return results
+            if status not in (404, 405, 501):
+                self._apply_batch_translations(results, keys, misses, data)
+                return results
+            self.batch_translate_supported = False
+            logger.info("🌐 Backend has no batch translate endpoint - using parallel calls")
+        
+        for i, result in zip(misses, self.translate_pool.map(lambda i: self.translate(texts[i], target_language), misses)):
+            results[i] = result
+        return results
+    
+    # ---- streaming API ----
+    @staticmethod
+    def _stream_text(data):
+        """Text carried by one SSE data line ({"delta"|"text"|"content"|"response": ...} or raw)"""
+        try:
+            event = json.loads(data)
+        except ValueError:
+            return data
+        if isinstance(event, dict):
+            for field in ("delta", "text", "content", "response"):
+                if isinstance(event.get(field), str):
+                    return event[field]
+            return ""
+        return str(event)
+    
+    @instrument_ai_call
+    def deep_thinking_chat_stream(self, message, context=""):
+        """🧠 Deep Thinking AI, streamed - yields text chunks as the backend produces them.
+
+        Understands SSE (``data: ...`` lines, ``[DONE]`` terminator) and plain
+        chunked text; a backend that ignores ``stream`` and answers with one
+        JSON body yields its ``response`` in a single chunk. Raises on errors.
+        """
+        payload = self._deep_thinking_payload(message, context)
+        payload["stream"] = True
+        logger.info(f"🧠 Deep Thinking Stream: {message[:50]}...")
+        
+        breaker = self._breaker("/api/chat")
+        breaker.before_call()
+        failed = True
+        try:
+            with self.session.post(
+                f"{self.base_url}/api/chat",
+                json=payload,
+                timeout=self._timeout_for("/api/chat"),
+                headers={"Accept": "text/event-stream"},
+                stream=True
+            ) as response:
+                if response.status_code != 200:
+                    failed = response.status_code >= 500
+                    raise RuntimeError(f"API Error: {response.status_code}")
+                
+                content_type = response.headers.get("Content-Type", "")
+                if "charset" not in content_type:
+                    response.encoding = "utf-8"
+                
+                if "text/event-stream" in content_type:
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        text = self._stream_text(data)
+                        if text:
+                            yield text
+                elif "application/json" in content_type:
+                    yield response.json().get("response", "")
+                else:
+                    for chunk in response.iter_content(chunk_size=None, decode_unicode=True):
+                        if chunk:
+                            yield chunk
+            failed = False
+        except GeneratorExit:
+            failed = False  # Consumer stopped early; not the backend's fault
+            raise
+        finally:
+            if failed:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+    
+    # ---- async API (used by the asyncio dispatcher) ----
+    @instrument_ai_call
+    async def check_health_async(self):
+        try:
+            session = await self._get_async_session()
+            async with session.get(f"{self.base_url}/health", timeout=self._async_timeout_for("/health")) as response:
+                return response.status == 200
+        except:
+            return False
+    
+    @instrument_ai_call
+    async def deep_thinking_chat_async(self, message, context=""):
+        """🧠 Deep Thinking AI (async)"""
+        try:
+            logger.info(f"🧠 Deep Thinking Request: {message[:50]}...")
+            status, data = await self._request_async("/api/chat", self._deep_thinking_payload(message, context))
+            if data is not None:
+                return data
+            return {"error": f"API Error: {status}"}
+        except Exception as e:
+            logger.error(f"Deep thinking error: {e}")
+            return {"error": str(e) or type(e).__name__}
+    
+    @instrument_ai_call
+    async def standard_chat_async(self, message, context=""):
+        """Standard AI Chat (async)"""
+        try:
+            status, data = await self._request_async("/api/chat", self._standard_chat_payload(message, context),
+                                                     cache_op=None if context else "standard_chat")
+            if data is not None:
+                return data
+            return {"error": f"API Error: {status}"}
+        except Exception as e:
+            return {"error": str(e) or type(e).__name__}
+    
+    @instrument_ai_call
+    async def generate_image_async(self, prompt, style="realistic", callback_url=None):
+        """🎨 Advanced Image Generation (async)"""
+        try:
+            logger.info(f"🎨 Image Generation: {prompt}")
+            status, data = await self._request_async("/api/image", self._image_payload(prompt, style, callback_url))
+            if data is not None:
+                return data
+            return {"error": f"Image generation failed: {status}"}
+        except Exception as e:
+            logger.error(f"Image gen error: {e}")
+            return {"error": str(e) or type(e).__name__}
+    
+    @instrument_ai_call
+    async def generate_video_async(self, description, duration=10, callback_url=None):
+        """🎥 Advanced Video Generation (async)"""
+        try:
+            logger.info(f"🎥 Video Generation: {description}")
+            status, data = await self._request_async("/api/video", self._video_payload(description, duration, callback_url))
+            if data is not None:
+                return data
+            return {"error": f"Video generation failed: {status}"}
+        except Exception as e:
+            logger.error(f"Video gen error: {e}")
+            return {"error": str(e) or type(e).__name__}
+    
+    @instrument_ai_call
+    async def generate_code_async(self, description, language="python"):
+        """💻 Advanced Code Generation (async)"""
+        try:
+            status, data = await self._request_async("/api/code", self._code_payload(description, language),
+                                                     cache_op="generate_code")
+            if data is not None:
+                return data
+            return {"error": f"Code generation failed"}
+        except Exception as e:
+            return {"error": str(e) or type(e).__name__}
+    
+    @instrument_ai_call
+    async def translate_async(self, text, target_language="hindi"):
+        """🌐 Advanced Translation (async)"""
+        try:
+            status, data = await self._request_async("/api/translate", self._translate_payload(text, target_language),
+                                                     cache_op="translate")
+            if data is not None:
+                return data
+            return {"error": "Translation failed"}
+        except Exception as e:
+            return {"error": str(e) or type(e).__name__}
+    
+    @instrument_ai_call
+    async def translate_batch_async(self, texts, target_language="hindi"):
+        """🌐 Translate several segments in one upstream call (async)"""
+        results, keys, misses = self._split_cached_translations(texts, target_language)
+        if not misses:
+            return results
+        if self.batch_translate_supported:
+            try:
+                status, data = await self._request_async(
+                    "/api/translate/batch", self._translate_batch_payload([texts[i] for i in misses], target_language)
+                )
+            except Exception as e:
+                for i in misses:
+                    results[i] = {"error": str(e) or type(e).__name__}
+                return results
+            if status not in (404, 405, 501):
+                self._apply_batch_translations(results, keys, misses, data)
+                return results
+            self.batch_translate_supported = False
+            logger.info("🌐 Backend has no batch translate endpoint - using parallel calls")
+        
+        translated = await asyncio.gather(*(self.translate_async(texts[i], target_language) for i in misses))
+        for i, result in zip(misses, translated):
+            results[i] = result
+        return results
+
+ai_client = AdvancedAIAPIClient(
+    AI_API_URL,
+    pool_size=AI_POOL_SIZE,
+    keepalive=AI_KEEPALIVE,
+    keepalive_timeout=AI_KEEPALIVE_TIMEOUT,
+    connect_timeout=AI_CONNECT_TIMEOUT,
+    cache=response_cache,
+    coalesce=AI_COALESCE_REQUESTS,
+    max_retries=AI_MAX_RETRIES,
+    retry_base_delay=AI_RETRY_BASE_DELAY,
+    breaker_threshold=BREAKER_FAILURE_THRESHOLD,
+    breaker_reset=BREAKER_RESET_TIMEOUT,
+    translate_parallelism=TRANSLATE_PARALLELISM
+)
+
+# ============ BACKGROUND HEALTH MONITOR ============
+class HealthMonitor:
+    """Probes the AI backend on a background thread so /health, /status and
+    startup answer from the last known state instead of a blocking GET.
+    Probes every ``interval`` seconds while healthy and every
+    ``degraded_interval`` seconds otherwise."""
+    
+    def __init__(self, client, interval=30, degraded_interval=5, slow_threshold=2.0, history_size=60):
+        self.client = client
+        self.interval = interval
+        self.degraded_interval = degraded_interval
+        self.slow_threshold = slow_threshold
+        self.history = deque(maxlen=history_size)  # (timestamp, ok, latency_seconds)
+        self.state = "unknown"
+        self.last_check = 0.0
+        self.last_ok = 0.0
+        self.last_change = time()
+        self.consecutive_failures = 0
+        self.probes = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+    
+    def _classify(self, ok, latency):
+        if not ok:
+            return "offline"
+        if latency > self.slow_threshold or self.consecutive_failures:
+            return "degraded"
+        if any(b["state"] != "closed" for b in self.client.get_breaker_states().values()):
+            return "degraded"
+        return "healthy"
+    
+    def probe(self):
+        started = time_module.perf_counter()
+        ok = self.client.check_health()
+        latency = time_module.perf_counter() - started
+        now = time()
+        with self.lock:
+            self.probes += 1
+            self.last_check = now
+            self.history.append((now, ok, latency))
+            if ok:
+                self.last_ok = now
+            state = self._classify(ok, latency)
+            self.consecutive_failures = 0 if ok else self.consecutive_failures + 1
+            previous, self.state = self.state, state
+            if state != previous:
+                self.last_change = now
+        if state != previous:
+            icon = {"healthy": "✅", "degraded": "⚠️", "offline": "❌"}[state]
+            logger.info(f"📊 API Health: {icon} {state.upper()} ({latency * 1000:.0f} ms)")
+        return state
+    
+    def next_interval(self):
+        return self.interval if self.state == "healthy" else self.degraded_interval
+    
+    def refresh(self):
+        """Ask the monitor thread to probe now (non-blocking)"""
+        self.wake.set()
+    
+    def _loop(self):
+        while True:
+            try:
+                self.probe()
+            except Exception as e:
+                logger.error(f"❌ Health probe error: {e}")
+            self.wake.wait(self.next_interval())
+            self.wake.clear()
+    
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, daemon=True, name="health-monitor")
+            self.thread.start()
+    
+    @property
+    def is_healthy(self):
+        return self.state in ("healthy", "degraded")
+    
+    def get_stats(self):
+        with self.lock:
+            history = list(self.history)
+            latencies = sorted(latency for _, ok, latency in history if ok)
+            return {
+                "state": self.state,
+                "last_check": datetime.fromtimestamp(self.last_check).isoformat() if self.last_check else None,
+                "last_ok": datetime.fromtimestamp(self.last_ok).isoformat() if self.last_ok else None,
+                "state_since": datetime.fromtimestamp(self.last_change).isoformat(),
+                "consecutive_failures": self.consecutive_failures,
+                "probe_interval": self.next_interval(),
+                "probes": self.probes,
+                "success_rate": round(sum(1 for _, ok, _ in history if ok) / len(history), 3) if history else None,
+                "latency_ms": {
+                    "last": round(history[-1][2] * 1000, 1) if history else None,
+                    "p50": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+                    "max": round(latencies[-1] * 1000, 1) if latencies else None,
+                }
+            }
+
+
+health_monitor = HealthMonitor(
+    ai_client,
+    interval=HEALTH_CHECK_INTERVAL,
+    degraded_interval=HEALTH_CHECK_DEGRADED_INTERVAL,
+    slow_threshold=HEALTH_SLOW_THRESHOLD
+)
+
+# ============ ASYNCIO DISPATCH ENGINE ============
+class AsyncDispatcher:
+    """Asyncio update dispatcher - every update runs as its own task.
+
+    Telegram updates are fetched on an event loop and each one is handled in
+    its own task, capped by a global semaphore. Handlers are still plain
+    telebot (sync) functions, so they run on a worker pool sized to the cap,
+    while every backend call they make is awaited on the shared loop via the
+    ``*_async`` client methods (see ``call_ai``).
+    """
+    
+    def __init__(self, bot, max_concurrency=100, poll_timeout=20):
+        self.bot = bot
+        self.max_concurrency = max_concurrency
+        self.poll_timeout = poll_timeout
+        self.loop = None
+        self.semaphore = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="update"
+        )
+        self.running = False
+        self.tasks = set()  # The loop only keeps weak references to tasks
+        self.active_tasks = 0
+        self.processed = 0
+    
+    @property
+    def is_running(self):
+        return self.running and self.loop is not None
+    
+    def run_coroutine(self, coro):
+        """Run a coroutine on the dispatcher loop from a handler thread and wait"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+    
+    async def _dispatch(self, update):
+        async with self.semaphore:
+            self.active_tasks += 1
+            try:
+                await self.loop.run_in_executor(
+                    self.executor, self.bot.process_new_updates, [update]
+                )
+            except Exception as e:
+                logger.error(f"❌ Dispatch error for update {update.update_id}: {e}")
+            finally:
+                self.active_tasks -= 1
+                self.processed += 1
+    
+    async def _poll(self):
+        offset = None
+        while self.running:
+            try:
+                updates = await self.loop.run_in_executor(
+                    None,
+                    functools.partial(
+                        self.bot.get_updates,
+                        offset=offset,
+                        timeout=self.poll_timeout,
+                        long_polling_timeout=self.poll_timeout
+                    )
+                )
+            except Exception as e:
+                logger.error(f"❌ getUpdates error: {e}")
+                await asyncio.sleep(3)
+                continue
+            
+            for update in updates:
+                offset = update.update_id + 1
+                task = self.loop.create_task(self._dispatch(update))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+    
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            await self._poll()
+        finally:
+            await ai_client.close_async()
+    
+    def run_forever(self):
+        self.running = True
+        self.bot.remove_webhook()
+        try:
+            asyncio.run(self._main())
+        finally:
+            self.running = False
+            self.executor.shutdown(wait=False)
+    
+    def stop(self):
+        self.running = False
+    
+    def get_stats(self):
+        return {
+            "mode": "async",
+            "max_concurrency": self.max_concurrency,
+            "active_tasks": self.active_tasks,
+            "processed": self.processed
+        }
+
+dispatcher = AsyncDispatcher(bot, max_concurrency=MAX_CONCURRENT_UPDATES) if DISPATCH_MODE == 'async' else None
+
+def call_ai(method, *args, **kwargs):
+    """Call an ai_client method - awaited on the dispatcher loop in async mode"""
+    if dispatcher is not None and dispatcher.is_running:
+        coro = getattr(ai_client, f"{method}_async")(*args, **kwargs)
+        return dispatcher.run_coroutine(coro)
+    return getattr(ai_client, method)(*args, **kwargs)
+
+# ============ WEBHOOK INGESTION ============
+class WebhookIngestor:
+    """Bounded update queue fed by the Flask webhook, drained by a worker pool.
+
+    ``submit`` never blocks: when the queue is full the webhook answers 503
+    and Telegram redelivers the update later (backpressure). If the webhook
+    can't be registered, ``poll_forever`` long-polls into the same queue.
+    """
+    
+    def __init__(self, bot, workers=8, queue_size=1000):
+        self.bot = bot
+        self.workers = workers
+        self.updates = queue.Queue(maxsize=queue_size)
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.source = "webhook"
+        self._threads = []
+    
+    def submit(self, update):
+        try:
+            self.updates.put_nowait(update)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+    
+    def _work(self):
+        while True:
+            update = self.updates.get()
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                logger.error(f"❌ Webhook worker error for update {update.update_id}: {e}")
+            finally:
+                self.processed += 1
+                self.updates.task_done()
+    
+    def start(self):
+        for i in range(self.workers - len(self._threads)):
+            thread = threading.Thread(target=self._work, daemon=True, name=f"webhook-worker-{i}")
+            thread.start()
+            self._threads.append(thread)
+    
+    def register(self, url, secret=None):
+        """Point Telegram at our webhook; False means fall back to polling"""
+        try:
+            return bool(self.bot.set_webhook(url=url, secret_token=secret or None, max_connections=self.workers * 5))
+        except Exception as e:
+            logger.error(f"❌ set_webhook failed: {e}")
+            return False
+    
+    def poll_forever(self, poll_timeout=20):
+        """Polling fallback - long-poll into the same queue (blocking put = backpressure)"""
+        self.source = "polling"
+        self.bot.remove_webhook()
+        offset = None
+        while True:
+            try:
+                updates = self.bot.get_updates(offset=offset, timeout=poll_timeout, long_polling_timeout=poll_timeout)
+            except Exception as e:
+                logger.error(f"❌ getUpdates error: {e}")
+                time_module.sleep(3)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                self.updates.put(update)
+                self.accepted += 1
+    
+    def get_stats(self):
+        return {
+            "mode": "webhook",
+            "source": self.source,
+            "workers": self.workers,
+            "queue_depth": self.updates.qsize(),
+            "queue_size": self.updates.maxsize,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "processed": self.processed
+        }
+
+webhook_ingestor = WebhookIngestor(bot, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE) if DISPATCH_MODE == 'webhook' else None
+
+# ============ SHARD ROUTER (MULTI-PROCESS) ============
+class ShardRouter:
+    """Front process for sharded deployments.
+
+    Takes updates from getUpdates (or its own webhook) and forwards each one
+    to the worker that owns its chat, ``chat_id % len(workers)``, so a chat's
+    memory, limits and ordering always live in one process. Each shard has a
+    bounded queue and one forwarding thread, which keeps per-chat order. A
+    worker answering 503 is retried after its Retry-After.
+    """
+    
+    def __init__(self, worker_urls, secret="", queue_size=1000):
+        self.worker_urls = worker_urls
+        self.secret = secret
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in worker_urls]
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=len(worker_urls), pool_maxsize=2))
+        self.forwarded = [0] * len(worker_urls)
+        self.retries = 0
+        self.rejected = 0
+        self.processes = []
+    
+    @staticmethod
+    def chat_id_of(update):
+        for field in ("message", "edited_message", "channel_post", "edited_channel_post",
+                      "my_chat_member", "chat_member", "chat_join_request"):
+            chat = (update.get(field) or {}).get("chat")
+            if chat:
+                return chat["id"]
+        callback = update.get("callback_query")
+        if callback:
+            return ((callback.get("message") or {}).get("chat") or callback["from"])["id"]
+        for value in update.values():
+            if isinstance(value, dict) and "from" in value:
+                return value["from"]["id"]
+        return 0
+    
+    def shard_for(self, update):
+        return self.chat_id_of(update) % len(self.worker_urls)
+    
+    def submit(self, update):
+        """Non-blocking (webhook path); False when the shard's queue is full"""
+        try:
+            self.queues[self.shard_for(update)].put_nowait(update)
+            return True
+        except queue.Full:
+            self.rejected += 1
+            return False
+    
+    def _forward(self, index):
+        url = f"{self.worker_urls[index]}/webhook"
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.secret} if self.secret else {}
+        updates = self.queues[index]
+        while True:
+            update = updates.get()
+            delay = 0.5
+            while True:
+                try:
+                    response = self.session.post(url, json=update, headers=headers, timeout=(3, 10))
+                    if response.status_code == 200:
+                        break
+                    if response.status_code != 503:
+                        logger.error(f"❌ Shard {index} rejected update {update.get('update_id')}: {response.status_code}")
+                        break
+                    delay = float(response.headers.get("Retry-After", delay))
+                except requests.RequestException as e:
+                    logger.warning(f"⚠️ Shard {index} unreachable: {e}")
+                self.retries += 1
+                time_module.sleep(delay)
+                delay = min(delay * 2, 30)
+            self.forwarded[index] += 1
+    
+    def start(self):
+        for index in range(len(self.worker_urls)):
+            threading.Thread(target=self._forward, args=(index,), daemon=True, name=f"shard-forward-{index}").start()
+    
+    def spawn_local_workers(self, count, base_port):
+        """Start ``count`` worker processes of this script on base_port, base_port + 1, ..."""
+        for index in range(count):
+            env = dict(
+                os.environ,
+                PORT=str(base_port + index),
+                DISPATCH_MODE="webhook",
+                WEBHOOK_REGISTER="0",
+                SHARD_PROCESSES="0",
+                SHARD_WORKER_URLS="",
+                SHARD_INDEX=str(index),
+                WEBHOOK_SECRET=WEBHOOK_SECRET,
+                JOBS_DB_PATH=f"{JOBS_DB_PATH}.shard{index}"
+            )
+            self.processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env))
+        atexit.register(self.stop_workers)
+    
+    def stop_workers(self):
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+    
+    def poll_forever(self, poll_timeout=20):
+        """Long-poll raw updates and hand them to the shards (blocking put = backpressure)"""
+        bot.remove_webhook()
+        offset = None
+        while True:
+            try:
+                updates = apihelper.get_updates(
+                    TELEGRAM_TOKEN, offset=offset, timeout=poll_timeout, long_polling_timeout=poll_timeout
+                )
+            except Exception as e:
+                logger.error(f"❌ getUpdates error: {e}")
+                time_module.sleep(3)
+                continue
+            for update in updates:
+                offset = update["update_id"] + 1
+                self.queues[self.shard_for(update)].put(update)
+    
+    def get_stats(self):
+        return {
+            "mode": "router",
+            "shards": [
+                {"url": url, "queued": self.queues[i].qsize(), "forwarded": self.forwarded[i]}
+                for i, url in enumerate(self.worker_urls)
+            ],
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "local_workers": len(self.processes)
+        }
+
+
+def shard_worker_urls():
+    if SHARD_WORKER_URLS:
+        return SHARD_WORKER_URLS
+    return [f"http://127.0.0.1:{SHARD_BASE_PORT + i}" for i in range(SHARD_PROCESSES)]
+
+shard_router = ShardRouter(shard_worker_urls(), WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE) if SHARD_PROCESSES or SHARD_WORKER_URLS else None
+
+# ============ ERROR HANDLER ============
+def report_error(chat_id, where, e):
+    logger.error(f"❌ Error in {where}: {str(e)}")
+    bot.send_message(
+        chat_id,
+        f"❌ कुछ गलत हुआ। कृपया दोबारा कोशिश करें।\n\nError: {str(e)[:50]}..."
+    )
+
+def error_handler(func):
+    @wraps(func)
+    def wrapper(message, *args, **kwargs):
+        try:
+            return func(message, *args, **kwargs)
+        except Exception as e:
+            report_error(message.chat.id, func.__name__, e)
+    return wrapper
+
+# ============ PER-CHAT SCHEDULER ============
+class ChatScheduler:
+    """Ordered per chat, parallel across chats, with one worker lane per tier.
+
+    A chat has at most one job running; later messages from the same chat
+    wait in that chat's FIFO and are released into their own lane when the
+    running job finishes. Each lane (standard / thinking / generation) has a
+    dedicated worker pool, so slow generation jobs can never occupy the
+    workers that serve quick chat replies. ``max_running`` (0 = off) caps
+    the jobs running across all lanes together.
+    """
+    
+    def __init__(self, lane_workers, max_pending_per_chat=20, max_running=0):
+        self.lane_workers = lane_workers
+        self.max_pending_per_chat = max_pending_per_chat
+        self.max_running = max_running
+        self.running_slots = threading.BoundedSemaphore(max_running) if max_running else None
+        self.lanes = {lane: queue.Queue() for lane in lane_workers}
+        self.chats = {}  # chat_id -> deque of waiting (lane, fn, args); present = a job is running
+        self.lock = threading.Lock()
+        self.active = {lane: 0 for lane in lane_workers}
+        self.completed = {lane: 0 for lane in lane_workers}
+        self.rejected = 0
+        self._threads = []
+    
+    def start(self):
+        with self.lock:
+            if self._threads:
+                return
+            for lane, count in self.lane_workers.items():
+                for i in range(count):
+                    thread = threading.Thread(target=self._work, args=(lane,), daemon=True, name=f"{lane}-worker-{i}")
+                    thread.start()
+                    self._threads.append(thread)
+    
+    def submit(self, chat_id, lane, fn, *args):
+        """Queue fn(*args) for a chat; False when that chat already has too much queued"""
+        if not self._threads:
+            self.start()
+        with self.lock:
+            waiting = self.chats.get(chat_id)
+            if waiting is None:
+                self.chats[chat_id] = deque()
+                self.lanes[lane].put((chat_id, fn, args))
+            elif len(waiting) >= self.max_pending_per_chat:
+                self.rejected += 1
+                return False
+            else:
+                waiting.append((lane, fn, args))
+        return True
+    
+    def _release_next(self, chat_id):
+        with self.lock:
+            waiting = self.chats[chat_id]
+            if waiting:
+                lane, fn, args = waiting.popleft()
+                self.lanes[lane].put((chat_id, fn, args))
+            else:
+                del self.chats[chat_id]
+    
+    def _work(self, lane):
+        jobs = self.lanes[lane]
+        while True:
+            chat_id, fn, args = jobs.get()
+            if self.running_slots is not None:
+                self.running_slots.acquire()
+            self.active[lane] += 1
+            try:
+                fn(*args)
+            except Exception as e:
+                report_error(chat_id, fn.__name__, e)
+            finally:
+                self.active[lane] -= 1
+                self.completed[lane] += 1
+                if self.running_slots is not None:
+                    self.running_slots.release()
+                self._release_next(chat_id)
+    
+    def get_stats(self):
+        with self.lock:
+            return {
+                "lanes": {
+                    lane: {
+                        "workers": self.lane_workers[lane],
+                        "queued": self.lanes[lane].qsize(),
+                        "active": self.active[lane],
+                        "completed": self.completed[lane]
+                    }
+                    for lane in self.lanes
+                },
+                "max_running": self.max_running,
+                "busy_chats": len(self.chats),
+                "waiting_in_chats": sum(len(w) for w in self.chats.values()),
+                "rejected": self.rejected
+            }
+
+def scale_lane_workers(lane_workers, total):
+    """Spread ``total`` workers over the lanes in proportion to their configured sizes (at least 1 each)"""
+    configured = sum(lane_workers.values())
+    shares = {lane: total * count / configured for lane, count in lane_workers.items()}
+    scaled = {lane: max(1, int(share)) for lane, share in shares.items()}
+    # Largest remainders take what rounding down left over
+    for lane in sorted(shares, key=lambda lane: shares[lane] - int(shares[lane]), reverse=True):
+        if sum(scaled.values()) >= total:
+            break
+        scaled[lane] += 1
+    return scaled
+
+LANE_WORKERS = {
+    'standard': LANE_WORKERS_STANDARD,
+    'thinking': LANE_WORKERS_THINKING,
+    'generation': LANE_WORKERS_GENERATION
+}
+if DISPATCH_MODE == 'async':
+    # Handlers run on the lanes, so the lanes are what actually bounds concurrency -
+    # size them from MAX_CONCURRENT_UPDATES, keeping the configured ratio between tiers
+    LANE_WORKERS = scale_lane_workers(LANE_WORKERS, MAX_CONCURRENT_UPDATES)
+
+chat_scheduler = ChatScheduler(
+    LANE_WORKERS,
+    max_running=MAX_CONCURRENT_UPDATES if DISPATCH_MODE == 'async' else 0
+) if CHAT_SCHEDULER_ENABLED else None
+
+
+# ============ MEDIA RELAY ============
+class MediaStream:
+    """A backend asset handed to telebot as an upload and read in chunks while it is sent.
+
+    Iterating opens the URL again if the first response was already used, so
+    a send retried after a 429 streams the asset once more. ``digest`` holds
+    the SHA-256 of the bytes that went out once the upload has finished.
+    """
     
-    def recognize_intent(self, text):
-        text_lower = text.lower()
-        
-        # Check for deep thinking keywords first (highest priority)
-        for intent, data in self.intents.items():
-            if data["type"] == "deep_thinking":
-                for keyword in data["keywords"]:
-                    if keyword.lower() in text_lower:
-                        return {
-                            "intent": intent,
-                            "type": "deep_thinking",
-                            "confidence": 0.95
-                        }
-        
-        # Check other intents
-        for intent, data in self.intents.items():
-            if data["type"] != "deep_thinking":
-                for keyword in data["keywords"]:
-                    if keyword.lower() in text_lower:
-                        return {
-                            "intent": intent,
-                            "type": data["type"],
-                            "confidence": 0.85
-                        }
-        
-        # Default to chat
-        return {
-            "intent": "general_query",
-            "type": "chat",
-            "confidence": 0.5
-        }
+    def __init__(self, session, url, response, chunk_size=64 * 1024, timeout=60):
+        self.session = session
+        self.url = url
+        self.response = response
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.content_type = response.headers.get("Content-Type", "application/octet-stream").split(";")[0]
+        length = response.headers.get("Content-Length")
+        self.length = int(length) if length and length.isdigit() else None
+        name = os.path.basename(urlsplit(url).path)
+        if "." not in name:
+            name = "media" + (mimetypes.guess_extension(self.content_type) or "")
+        self.filename = name
+        self.digest = None
+        self.bytes_sent = 0
+    
+    def chunks(self):
+        response, self.response = self.response, None
+        if response is None:
+            response = MediaRelay.fetch(self.session, self.url, self.timeout)
+        hasher = hashlib.sha256()
+        sent = 0
+        with response:
+            for chunk in response.iter_content(self.chunk_size):
+                hasher.update(chunk)
+                sent += len(chunk)
+                yield chunk
+        self.digest = hasher.hexdigest()
+        self.bytes_sent = sent
 
-intent_recognizer = AdvancedIntentRecognizer()
 
-# ============ ADVANCED AI API CLIENT ============
-class AdvancedAIAPIClient:
-    """Enhanced API client with multiple AI models"""
+class _MultipartBody:
+    """multipart/form-data body generated part by part; len() is known when every
+    stream has a Content-Length, otherwise requests falls back to chunked encoding"""
     
-    def __init__(self, base_url):
-        self.base_url = base_url
-        self.timeout = 120  # Increased for thinking
+    def __init__(self, files):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self.parts = []
+        for name, stream in files.items():
+            head = (
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{stream.filename}"\r\n'
+                f'Content-Type: {stream.content_type}\r\n\r\n'
+            ).encode()
+            self.parts.append((head, stream))
+        self.tail = f"--{boundary}--\r\n".encode()
     
-    def check_health(self):
+    def __bool__(self):
+        return True  # requests drops falsy data, and len() is 0 when unknown
+    
+    def __len__(self):
+        if any(stream.length is None for _, stream in self.parts):
+            return 0
+        return sum(len(head) + stream.length + 2 for head, stream in self.parts) + len(self.tail)
+    
+    def __iter__(self):
+        for head, stream in self.parts:
+            yield head
+            yield from stream.chunks()
+            yield b"\r\n"
+        yield self.tail
+
+
+def _send_bot_api_request(method, url, params=None, files=None, timeout=None, proxies=None):
+    """apihelper.CUSTOM_REQUEST_SENDER: MediaStream uploads are streamed, everything else is sent as before"""
+    session = apihelper._get_req_session()
+    if files and all(isinstance(value, MediaStream) for value in files.values()):
+        body = _MultipartBody(files)
+        return session.request(method, url, params=params, data=body, headers={"Content-Type": body.content_type},
+                               timeout=timeout, proxies=proxies)
+    return session.request(method, url, params=params, files=files, timeout=timeout, proxies=proxies)
+
+
+class MediaRelay:
+    """Delivers generated images/videos by streaming them from the backend to Telegram.
+
+    Telegram is not asked to fetch the backend URL itself (it may be private
+    or slow); the asset is read from the backend in ``chunk_size`` pieces and
+    written straight into the multipart upload, so it is never held in
+    memory whole. The ``file_id`` Telegram returns is cached by the asset's
+    SHA-256 (from the backend's ``X-Content-SHA256`` header when it sends one,
+    otherwise hashed on the way through), so a repeated asset is re-sent by
+    ``file_id`` without uploading it again. If the backend can't be reached
+    the URL is passed to Telegram as before. Only URLs on ``allowed_hosts``
+    (the AI backend) are fetched by us; anything else goes to Telegram as a URL.
+    """
+    
+    DIGEST_HEADER = "X-Content-SHA256"
+    
+    def __init__(self, max_entries=1000, chunk_size=64 * 1024, timeout=60, allowed_hosts=()):
+        self.max_entries = max_entries
+        self.allowed_hosts = {host.lower() for host in allowed_hosts if host}
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.file_ids = OrderedDict()  # (send method, sha256) -> file_id, least recently used first
+        self.url_digests = OrderedDict()  # url -> sha256
+        self.cache_hits = 0
+        self.uploads = 0
+        self.bytes_streamed = 0
+        self.url_fallbacks = 0
+    
+    def _relayable(self, url):
+        parts = urlsplit(url)
+        return parts.scheme in ("http", "https") and (parts.hostname or "").lower() in self.allowed_hosts
+    
+    @staticmethod
+    def fetch(session, url, timeout):
+        # identity: Content-Length must match the bytes iter_content yields
+        response = session.get(url, stream=True, timeout=(AI_CONNECT_TIMEOUT, timeout),
+                               headers={"Accept-Encoding": "identity"})
         try:
-            response = requests.get(f"{self.base_url}/health", timeout=5)
-            return response.status_code == 200
-        except:
-            return False
+            response.raise_for_status()
+        except requests.HTTPError:
+            response.close()
+            raise
+        return response
     
-    def deep_thinking_chat(self, message, context=""):
-        """🧠 Deep Thinking AI - Like Claude with Extended Thinking"""
+    def _cached(self, send_method, digest):
+        with self.lock:
+            file_id = self.file_ids.get((send_method, digest))
+            if file_id is not None:
+                self.file_ids.move_to_end((send_method, digest))
+            return file_id
+    
+    def _remember(self, send_method, url, digest, file_id, size):
+        with self.lock:
+            self.uploads += 1
+            self.bytes_streamed += size
+            if not file_id:
+                return
+            self.file_ids[(send_method, digest)] = file_id
+            self.file_ids.move_to_end((send_method, digest))
+            self.url_digests[url] = digest
+            self.url_digests.move_to_end(url)
+            while len(self.file_ids) > self.max_entries:
+                self.file_ids.popitem(last=False)
+            while len(self.url_digests) > self.max_entries:
+                self.url_digests.popitem(last=False)
+    
+    def _forget(self, send_method, digest):
+        with self.lock:
+            self.file_ids.pop((send_method, digest), None)
+    
+    @staticmethod
+    def _file_id_of(message):
+        if message.photo:
+            return message.photo[-1].file_id  # Largest size
+        for attr in ("video", "animation", "document"):
+            media = getattr(message, attr, None)
+            if media is not None:
+                return media.file_id
+        return None
+    
+    def _send_cached(self, send, send_method, digest, chat_id, **kwargs):
+        """Re-send by file_id; None if there is no usable cached file_id"""
+        file_id = self._cached(send_method, digest) if digest else None
+        if file_id is None:
+            return None
         try:
-            full_message = context + message if context else message
-            
-            payload = {
-                "message": full_message,
-                "model": DEEP_THINKING_MODEL,
-                "max_tokens": 2000,
-                "thinking": True,
-                "temperature": 0.7,
-                "deep_analysis": True
-            }
-            
-            logger.info(f"🧠 Deep Thinking Request: {message[:50]}...")
-            response = requests.post(
-                f"{self.base_url}/api/chat",
-                json=payload,
-                timeout=self.timeout
-            )
-            
-            if response.status_code == 200:
-                return response.json()
-            return {"error": f"API Error: {response.status_code}"}
-        except Exception as e:
-            logger.error(f"Deep thinking error: {e}")
-            return {"error": str(e)}
+            message = send(chat_id, file_id, **kwargs)
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code != 400:
+                raise
+            self._forget(send_method, digest)  # file_id no longer valid - upload again
+            return None
+        with self.lock:
+            self.cache_hits += 1
+        return message
     
-    def standard_chat(self, message, context=""):
-        """Standard AI Chat"""
+    def send(self, chat_id, send_method, url, **kwargs):
+        """``bot.<send_method>(chat_id, <asset at url>, **kwargs)`` via cache or streamed upload"""
+        send = getattr(bot, send_method)
+        with self.lock:
+            digest = self.url_digests.get(url)
+        message = self._send_cached(send, send_method, digest, chat_id, **kwargs)
+        if message is not None:
+            return message
+        if not self._relayable(url):
+            logger.warning("📦 Media URL not on the AI backend; letting Telegram fetch it")
+            with self.lock:
+                self.url_fallbacks += 1
+            return send(chat_id, url, **kwargs)
+        
         try:
-            full_message = context + message if context else message
-            
-            payload = {
-                "message": full_message,
-                "model": STANDARD_MODEL,
-                "max_tokens": 1000
+            response = self.fetch(self.session, url, self.timeout)
+        except requests.RequestException as e:
+            logger.warning(f"📦 Media fetch failed ({e}); letting Telegram fetch the URL")
+            with self.lock:
+                self.url_fallbacks += 1
+            return send(chat_id, url, **kwargs)
+        
+        digest = response.headers.get(self.DIGEST_HEADER, "").lower() or None
+        message = self._send_cached(send, send_method, digest, chat_id, **kwargs)
+        if message is not None:
+            response.close()
+            return message
+        
+        stream = MediaStream(self.session, url, response, self.chunk_size, self.timeout)
+        try:
+            message = send(chat_id, stream, **kwargs)
+        finally:
+            if stream.response is not None:
+                stream.response.close()  # Send failed before the body was read
+        self._remember(send_method, url, digest or stream.digest, self._file_id_of(message), stream.bytes_sent)
+        logger.info(f"📦 Streamed {stream.bytes_sent // 1024} KB to chat {chat_id} via {send_method}")
+        return message
+    
+    def get_stats(self):
+        with self.lock:
+            return {
+                "cached_files": len(self.file_ids),
+                "cache_hits": self.cache_hits,
+                "uploads": self.uploads,
+                "bytes_streamed": self.bytes_streamed,
+                "url_fallbacks": self.url_fallbacks
             }
-            
-            response = requests.post(
-                f"{self.base_url}/api/chat",
-                json=payload,
-                timeout=self.timeout
-            )
-            
-            if response.status_code == 200:
-                return response.json()
-            return {"error": f"API Error: {response.status_code}"}
+
+media_relay = MediaRelay(
+    max_entries=MEDIA_CACHE_SIZE,
+    chunk_size=MEDIA_CHUNK_SIZE,
+    timeout=MEDIA_FETCH_TIMEOUT,
+    allowed_hosts=(urlsplit(AI_API_URL).hostname,)
+) if MEDIA_RELAY else None
+
+if media_relay is not None:
+    apihelper.CUSTOM_REQUEST_SENDER = _send_bot_api_request
+
+
+# ============ GENERATION JOBS ============
+# kind -> how to call the backend and deliver the result
+GENERATION_KINDS = {
+    "image": {
+        "method": "generate_image", "kwargs": {"style": "realistic"},
+        "url_field": "image_url", "send": "send_photo", "label": "Image", "emoji": "🖼️"
+    },
+    "video": {
+        "method": "generate_video", "kwargs": {"duration": 10},
+        "url_field": "video_url", "send": "send_video", "label": "Video", "emoji": "🎬"
+    }
+}
+
+
+def deliver_generation(chat_id, kind, prompt, response, status_message_id, started_at=None):
+    """Send a finished image/video (or its error) to the chat; returns (ok, error).
+    Delivered results are charged to the usage ledger with the seconds since started_at."""
+    spec = GENERATION_KINDS[kind]
+    if "error" not in response and spec["url_field"] in response:
+        try:
+            caption = f"{spec['emoji']} {prompt[:80]}..."
+            if media_relay is not None:
+                media_relay.send(chat_id, spec["send"], response[spec["url_field"]], caption=caption, parse_mode='Markdown')
+            else:
+                getattr(bot, spec["send"])(chat_id, response[spec["url_field"]], caption=caption, parse_mode='Markdown')
+            bot.delete_message(chat_id, status_message_id)
+            conversation_memory.add_message(chat_id, "bot", f"{spec['label']} generated")
+            if usage_ledger is not None:
+                seconds = time() - started_at if started_at else 0.0
+                usage_ledger.record(chat_id, kind, estimate_tokens(prompt), seconds)
+            return True, None
         except Exception as e:
-            return {"error": str(e)}
+            bot.edit_message_text(f"❌ Send error: {str(e)[:80]}", chat_id, status_message_id)
+            return False, str(e)
     
-    def generate_image(self, prompt, style="realistic"):
-        """🎨 Advanced Image Generation"""
-        try:
-            logger.info(f"🎨 Image Generation: {prompt}")
-            
-            payload = {
-                "prompt": prompt,
-                "style": style,
-                "size": "1024x1024",
-                "quality": "high",
-                "detailed": True
-            }
-            
-            response = requests.post(
-                f"{self.base_url}/api/image",
-                json=payload,
-                timeout=self.timeout
+    error = response.get('error', 'Unknown error')
+    bot.edit_message_text(f"❌ {spec['label']} generation failed: {error}", chat_id, status_message_id)
+    return False, error
+
+
+class GenerationJobManager:
+    """Background image/video generation with persisted job state.
+
+    Handlers submit a job and return at once. A small worker pool calls the
+    backend; if it answers with a ``job_id`` instead of a finished URL the
+    job is completed later by polling ``/api/jobs/<id>`` or by the backend
+    POSTing to ``/jobs/callback/<job_id>?token=<callback_token>``, where the
+    token is random per job. Jobs live in SQLite, so pending ones are resumed
+    after a restart.
+    """
+    
+    DONE_STATES = ("done", "completed", "succeeded", "success")
+    FAILED_STATES = ("failed", "error", "cancelled")
+    
+    def __init__(self, path="jobs.db", workers=2, poll_interval=10, timeout=1800, callback_base=""):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.callback_base = callback_base.rstrip("/")
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.polling = {}  # job_id -> backend job id
+        self.completed = 0
+        self.failed = 0
+        self._poller = None
+    
+    @_lazy_attribute
+    def executor(self):
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="generation-job")
+    
+    @_lazy_attribute
+    def conn(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, chat_id INTEGER NOT NULL, kind TEXT NOT NULL, prompt TEXT NOT NULL, "
+            "status TEXT NOT NULL, status_message_id INTEGER, backend_job_id TEXT, "
+            "result_url TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, callback_token TEXT)"
+        )
+        if "callback_token" not in {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}:
+            conn.execute("ALTER TABLE jobs ADD COLUMN callback_token TEXT")  # Databases from older versions
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_chat ON jobs(chat_id, created_at)")
+        conn.commit()
+        return conn
+    
+    # ---- persistence ----
+    def _save(self, job_id, **fields):
+        fields["updated_at"] = time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock:
+            self.conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+            self.conn.commit()
+    
+    def get(self, job_id):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+    
+    def list_jobs(self, chat_id, limit=10):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM jobs WHERE chat_id = ? ORDER BY created_at DESC LIMIT ?", (chat_id, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+    
+    # ---- lifecycle ----
+    def submit(self, chat_id, kind, prompt, status_message_id):
+        job_id = uuid.uuid4().hex[:8]
+        token = secrets.token_urlsafe(24) if self.callback_base else None
+        now = time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO jobs (id, chat_id, kind, prompt, status, status_message_id, created_at, updated_at, "
+                "callback_token) VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, chat_id, kind, prompt, status_message_id, now, now, token)
             )
-            
-            if response.status_code == 200:
-                return response.json()
-            return {"error": f"Image generation failed: {response.status_code}"}
-        except Exception as e:
-            logger.error(f"Image gen error: {e}")
-            return {"error": str(e)}
+            self.conn.commit()
+        self.executor.submit(self._run, job_id)
+        logger.info(f"🧾 Job {job_id}: {kind} for {chat_id} queued")
+        return job_id
     
-    def generate_video(self, description, duration=10):
-        """🎥 Advanced Video Generation"""
+    def _run(self, job_id):
+        job = self.get(job_id)
+        spec = GENERATION_KINDS[job["kind"]]
+        kwargs = dict(spec["kwargs"])
+        if self.callback_base:
+            token = job["callback_token"] or secrets.token_urlsafe(24)  # Recovered from an older version
+            self._save(job_id, status="running", callback_token=token)
+            kwargs["callback_url"] = f"{self.callback_base}/jobs/callback/{job_id}?token={token}"
+        else:
+            self._save(job_id, status="running")
         try:
-            logger.info(f"🎥 Video Generation: {description}")
-            
-            payload = {
-                "description": description,
-                "duration": duration,
-                "quality": "1080p",
-                "detailed": True
-            }
-            
-            response = requests.post(
-                f"{self.base_url}/api/video",
-                json=payload,
-                timeout=self.timeout
-            )
-            
-            if response.status_code == 200:
-                return response.json()
-            return {"error": f"Video generation failed: {response.status_code}"}
+            response = call_ai(spec["method"], job["prompt"], **kwargs)
         except Exception as e:
-            logger.error(f"Video gen error: {e}")
-            return {"error": str(e)}
+            response = {"error": str(e)}
+        
+        backend_job_id = response.get("job_id")
+        if "error" not in response and backend_job_id and spec["url_field"] not in response:
+            # Backend accepted the work asynchronously - finish via poll or callback
+            self._save(job_id, backend_job_id=str(backend_job_id))
+            with self.lock:
+                self.polling[job_id] = str(backend_job_id)
+            return
+        self._complete(job, response)
     
-    def generate_code(self, description, language="python"):
-        """💻 Advanced Code Generation"""
+    def _claim(self, job_id):
+        """Only one of poller/callback may finish a backend job"""
+        with self.lock:
+            return self.polling.pop(job_id, None) is not None
+    
+    def _complete(self, job, response):
+        # Runs on an executor future nobody waits on, so nothing may escape - and the job
+        # must not be left 'running' whatever happens during delivery
+        ok, error = False, "delivery interrupted"
         try:
-            payload = {
-                "description": description,
-                "language": language,
-                "detailed": True,
-                "with_comments": True
-            }
-            
-            response = requests.post(
-                f"{self.base_url}/api/code",
-                json=payload,
-                timeout=self.timeout
-            )
-            
-            if response.status_code == 200:
-                return response.json()
-            return {"error": f"Code generation failed"}
+            ok, error = deliver_generation(job["chat_id"], job["kind"], job["prompt"], response,
+                                           job["status_message_id"], job["created_at"])
         except Exception as e:
-            return {"error": str(e)}
+            error = e
+            logger.error(f"❌ Job {job['id']}: delivery failed: {e}")
+        finally:
+            try:
+                if ok:
+                    self.completed += 1
+                    self._save(job["id"], status="done", result_url=response.get(GENERATION_KINDS[job["kind"]]["url_field"]))
+                else:
+                    self.failed += 1
+                    self._save(job["id"], status="failed", error=str(error)[:500])
+            except Exception as e:
+                logger.error(f"❌ Job {job['id']}: could not save final state: {e}")
+        logger.info(f"🧾 Job {job['id']}: {'done' if ok else 'failed'}")
     
-    def translate(self, text, target_language="hindi"):
-        """🌐 Advanced Translation"""
-        try:
-            payload = {
-                "text": text,
-                "target_language": target_language,
-                "preserve_meaning": True
-            }
-            
-            response = requests.post(
-                f"{self.base_url}/api/translate",
-                json=payload,
-                timeout=self.timeout
-            )
+    def handle_callback(self, job_id, token, data):
+        """Completion pushed by the backend; False if the job isn't waiting or the token is wrong"""
+        job = self.get(job_id)
+        if not job or not job["callback_token"] or not hmac.compare_digest(job["callback_token"].encode(), token.encode()):
+            return False
+        if not self._claim(job_id):
+            return False
+        self.executor.submit(self._complete, job, data)
+        return True
+    
+    def _poll_once(self):
+        with self.lock:
+            waiting = list(self.polling.items())
+        for job_id, backend_job_id in waiting:
+            job = self.get(job_id)
+            status = ai_client.get_job_status(backend_job_id)
+            state = str(status.get("status", "")).lower()
+            url_field = GENERATION_KINDS[job["kind"]]["url_field"]
             
-            if response.status_code == 200:
-                return response.json()
-            return {"error": "Translation failed"}
-        except Exception as e:
-            return {"error": str(e)}
+            if state in self.DONE_STATES or url_field in status:
+                response = status
+            elif state in self.FAILED_STATES:
+                response = {"error": status.get("error", state)}
+            elif time() - job["created_at"] > self.timeout:
+                response = {"error": "timed out"}
+            else:
+                continue
+            if self._claim(job_id):
+                self.executor.submit(self._complete, job, response)
+    
+    def recover(self):
+        """Resume jobs that were queued/running when the process stopped"""
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        for row in rows:
+            if row["backend_job_id"]:
+                with self.lock:
+                    self.polling[row["id"]] = row["backend_job_id"]
+            else:
+                self.executor.submit(self._run, row["id"])
+        if rows:
+            logger.info(f"🧾 Recovered {len(rows)} pending generation jobs")
+        return len(rows)
+    
+    def start(self):
+        def loop():
+            while True:
+                time_module.sleep(self.poll_interval)
+                try:
+                    self._poll_once()
+                except Exception as e:
+                    logger.error(f"❌ Job poller error: {e}")
+        
+        if self._poller is None:
+            self.recover()
+            self._poller = threading.Thread(target=loop, daemon=True, name="job-poller")
+            self._poller.start()
+    
+    def get_stats(self):
+        with self.lock:
+            counts = dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            return {
+                "by_status": counts,
+                "awaiting_backend": len(self.polling),
+                "completed": self.completed,
+                "failed": self.failed
+            }
 
-ai_client = AdvancedAIAPIClient(AI_API_URL)
+generation_jobs = GenerationJobManager(
+    JOBS_DB_PATH,
+    workers=JOB_WORKERS,
+    poll_interval=JOB_POLL_INTERVAL,
+    callback_base=JOB_CALLBACK_URL
+) if JOBS_ENABLED else None
 
-# ============ ERROR HANDLER ============
-def error_handler(func):
-    @wraps(func)
-    def wrapper(message, *args, **kwargs):
+# ============ TRANSLATION BATCHING ============
+LANGUAGE_ALIASES = {
+    "hindi": "hindi", "हिंदी": "hindi", "हिन्दी": "hindi",
+    "english": "english", "angrezi": "english", "अंग्रेज़ी": "english", "अंग्रेजी": "english",
+    "urdu": "urdu", "उर्दू": "urdu",
+    "bengali": "bengali", "bangla": "bengali", "बंगाली": "bengali",
+    "tamil": "tamil", "telugu": "telugu", "marathi": "marathi", "मराठी": "marathi",
+    "gujarati": "gujarati", "punjabi": "punjabi", "spanish": "spanish",
+    "french": "french", "german": "german", "japanese": "japanese",
+    "chinese": "chinese", "arabic": "arabic", "russian": "russian"
+}
+_LANGUAGE_NAMES = "|".join(sorted(map(re.escape, LANGUAGE_ALIASES), key=len, reverse=True))
+_TARGET_LANGUAGE_RE = re.compile(
+    rf"(?:\b(?:to|into|in)\s+({_LANGUAGE_NAMES})\b)|(?:({_LANGUAGE_NAMES})\s*(?:mein|me|में))",
+    re.IGNORECASE
+)
+_DEVANAGARI_RE = re.compile(r"[ऀ-ॿ]")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?।])\s+")
+
+
+def parse_translation_request(text):
+    """Split "translate to X: <text>" style messages into (text to translate, target language).
+
+    Without an explicit language, Devanagari text goes to English and
+    everything else to Hindi.
+    """
+    instruction, sep, body = text.partition(":")
+    if not sep or not body.strip() or len(instruction) > 80:
+        instruction, body = text, text
+    body = body.strip()
+    
+    match = _TARGET_LANGUAGE_RE.search(instruction)
+    if match:
+        return body, LANGUAGE_ALIASES[(match.group(1) or match.group(2)).lower()]
+    devanagari = len(_DEVANAGARI_RE.findall(body))
+    return body, "english" if devanagari > len(body) // 3 else "hindi"
+
+
+def split_translation_segments(text, max_chars=1000):
+    """Split text into paragraphs, and over-long paragraphs into sentence groups.
+
+    Returns a list of paragraphs, each a list of segments; reassemble with
+    ``join_translation_segments``.
+    """
+    paragraphs = []
+    for paragraph in re.split(r"\n\s*\n", text.strip()):
+        if len(paragraph) <= max_chars:
+            paragraphs.append([paragraph])
+            continue
+        segments, current = [], ""
+        for sentence in _SENTENCE_END_RE.split(paragraph):
+            while len(sentence) > max_chars:  # No sentence break - hard split
+                if current:
+                    segments.append(current)
+                    current = ""
+                segments.append(sentence[:max_chars])
+                sentence = sentence[max_chars:]
+            if current and len(current) + 1 + len(sentence) > max_chars:
+                segments.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current else sentence
+        if current:
+            segments.append(current)
+        paragraphs.append(segments)
+    return paragraphs
+
+
+def join_translation_segments(paragraphs):
+    return "\n\n".join(" ".join(segments) for segments in paragraphs)
+
+
+class TranslationBatcher:
+    """Collects translate requests for ``window`` seconds and sends each
+    target language's segments as one batched upstream call.
+
+    Handler threads block in ``translate`` until their segments are back;
+    long texts are split into segments first and reassembled in order.
+    """
+    
+    def __init__(self, window=0.05, max_segments=32, segment_chars=1000, senders=4):
+        self.window = window
+        self.max_segments = max_segments
+        self.segment_chars = segment_chars
+        self.pending = OrderedDict()  # target language -> [(segment, Future)]
+        self.pending_count = 0
+        self.cond = threading.Condition()
+        self.sender_count = senders
+        self.thread = None
+        self.requests = 0
+        self.segments = 0
+        self.upstream_batches = 0
+    
+    @_lazy_attribute
+    def senders(self):
+        return ThreadPoolExecutor(max_workers=self.sender_count, thread_name_prefix="translate-batch")
+    
+    def translate(self, text, target_language="hindi"):
+        paragraphs = split_translation_segments(text, self.segment_chars)
+        futures = []
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._collect, daemon=True, name="translate-batcher")
+                self.thread.start()
+            queue_for_language = self.pending.setdefault(target_language, [])
+            for segments in paragraphs:
+                row = []
+                for segment in segments:
+                    future = Future()
+                    queue_for_language.append((segment, future))
+                    row.append(future)
+                futures.append(row)
+            self.pending_count += sum(len(row) for row in futures)
+            self.requests += 1
+            self.cond.notify()
+        
+        translated = []
+        for row in futures:
+            parts = []
+            for future in row:
+                result = future.result()
+                if "error" in result or "translated_text" not in result:
+                    return {"error": result.get("error", "Translation failed")}
+                parts.append(result["translated_text"])
+            translated.append(parts)
+        return {
+            "translated_text": join_translation_segments(translated),
+            "target_language": target_language,
+            "segments": sum(len(row) for row in translated)
+        }
+    
+    def _collect(self):
+        while True:
+            with self.cond:
+                while not self.pending_count:
+                    self.cond.wait()
+                deadline = time_module.monotonic() + self.window
+                while self.pending_count < self.max_segments:
+                    remaining = deadline - time_module.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                batches, self.pending, self.pending_count = self.pending, OrderedDict(), 0
+            
+            for target_language, items in batches.items():
+                for i in range(0, len(items), self.max_segments):
+                    self.senders.submit(self._send, target_language, items[i:i + self.max_segments])
+    
+    def _send(self, target_language, items):
+        self.upstream_batches += 1
+        self.segments += len(items)
         try:
-            return func(message, *args, **kwargs)
+            results = call_ai("translate_batch", [segment for segment, _ in items], target_language=target_language)
         except Exception as e:
-            logger.error(f"❌ Error in {func.__name__}: {str(e)}")
-            bot.send_message(
-                message.chat.id,
-                f"❌ कुछ गलत हुआ। कृपया दोबारा कोशिश करें।\n\nError: {str(e)[:50]}..."
-            )
-    return wrapper
+            results = [{"error": str(e)}] * len(items)
+        for (_, future), result in zip(items, results):
+            future.set_result(result)
+    
+    def get_stats(self):
+        return {
+            "requests": self.requests,
+            "segments": self.segments,
+            "upstream_batches": self.upstream_batches,
+            "segments_per_batch": round(self.segments / self.upstream_batches, 2) if self.upstream_batches else 0.0,
+            "batch_endpoint": ai_client.batch_translate_supported
+        }
+
+translation_batcher = TranslationBatcher(
+    window=TRANSLATE_BATCH_WINDOW,
+    max_segments=TRANSLATE_BATCH_MAX_SEGMENTS,
+    segment_chars=TRANSLATE_SEGMENT_CHARS,
+    senders=TRANSLATE_PARALLELISM
+) if TRANSLATE_BATCHING else None
 
 # ============ BOT COMMANDS ============
 @bot.message_handler(commands=['start'])
@@ -494,13 +4696,16 @@ def handle_help(message):
 
 बस normal language mein message bhejo, bot khud decide karega:
 
-- Agar tum likho: "गहराई से समझाओ", "why", "how" → 🧠 Deep Thinking AI
+- Agar tum kuch gehraai se samajhna chahte ho: "गहराई से समझाओ", "detail mein analyze karo" → 🧠 Deep Thinking AI
 - Agar tum likho: "image", "photo", "तस्वीर" → 🎨 Image Generation
 - Agar tum likho: "video", "वीडियो" → 🎥 Video Generation
 - Agar tum likho: "code", "python", "program" → 💻 Code Generation
 - Agar tum likho: "translate", "अनुवाद" → 🌐 Translation
 - Baaki sab normal chat → 💬 Smart Chat
 
+Image/Video background mein banti hai - /jobs se status dekho.
+Apna daily/monthly usage aur quota: /usage
+
 Example messages:
 - "गहराई से सोचो AI ka future kya hoga"
 - "Mountain par sunset ki realistic image banao"
@@ -509,25 +4714,341 @@ Example messages:
 """
     bot.send_message(message.chat.id, help_text, parse_mode='Markdown')
 
+API_STATE_LABELS = {
+    'healthy': '✅ HEALTHY',
+    'degraded': '⚠️ DEGRADED',
+    'offline': '❌ OFFLINE',
+    'unknown': '⏳ CHECKING'
+}
+
 @bot.message_handler(commands=['status'])
 @error_handler
 def handle_status(message):
-    api_health = ai_client.check_health()
+    api_health = health_monitor.get_stats()
     memory_stats = conversation_memory.get_stats()
     
     status_text = f"""📊 **BOT STATUS & STATS**
 
 Bot: ✅ ONLINE
-API: {'✅ HEALTHY' if api_health else '❌ OFFLINE'}
+API: {API_STATE_LABELS.get(api_health['state'], api_health['state'])} ({api_health['latency_ms']['last'] or '-'} ms)
 Memory: 🧠 ACTIVE
 
 Users with memory: {memory_stats['total_users']}
 Total messages stored: {memory_stats['total_messages']}
 Max messages per user: {memory_stats['max_size']}
+Memory used: {memory_stats['bytes_used'] / 1024:.0f} KB / {memory_stats['budget_bytes'] / 1024 / 1024:.0f} MB
+Evicted users: {memory_stats['evicted_users']}
+"""
+    if response_cache is not None:
+        cache_stats = response_cache.get_stats()
+        status_text += f"""
+Response cache ({cache_stats['backend']}): {cache_stats['entries']} entries
+Hits: {cache_stats['hits']} | Misses: {cache_stats['misses']} | Hit ratio: {cache_stats['hit_ratio']:.0%}
+Evictions: {cache_stats['evictions']} | Expired: {cache_stats['expirations']}
 """
     bot.send_message(message.chat.id, status_text, parse_mode='Markdown')
 
+# ============ REPLY CHUNKING ============
+TELEGRAM_MAX_MESSAGE = 4096
+REPLY_PREVIEW_CHARS = 1500  # Shown in chat when the full reply goes out as a document
+_FENCE_LINE = re.compile(r"^[ \t]*```([^`\n]{0,64})$", re.M)  # Longer "info strings" are just text
+
+
+def _open_fence(text):
+    """(offset, language) of a code fence left open at the end of text, or (None, None)"""
+    open_at = language = None
+    for match in _FENCE_LINE.finditer(text):
+        if open_at is None:
+            open_at, language = match.start(), match.group(1).strip()
+        else:
+            open_at = language = None
+    return open_at, language
+
+
+def _open_markers(text):
+    """Legacy-Markdown entity markers (* _ `) left open at the end of text, outside code blocks"""
+    markers = []
+    in_pre = False
+    i = 0
+    while i < len(text):
+        if text.startswith("```", i):
+            in_pre = not in_pre
+            i += 3
+            continue
+        char = text[i]
+        if in_pre:
+            pass
+        elif char == "\\":
+            i += 1  # Escaped character
+        elif markers and markers[-1] == "`":
+            if char == "`":
+                markers.pop()
+        elif char in "*_`":
+            if markers and markers[-1] == char:
+                markers.pop()
+            else:
+                markers.append(char)
+        i += 1
+    return markers
+
+
+def split_message_head(text, limit=TELEGRAM_MAX_MESSAGE, markdown=True):
+    """Split off the first chunk of text that fits in one message; returns (head, rest).
+
+    Cuts at a paragraph, then line, sentence or word boundary. A code block
+    that would be cut goes to the next message whole when it starts late in
+    the chunk; otherwise it is cut between lines and, for Markdown, closed in
+    head and re-opened (same language) in rest. Open bold/italic/code
+    entities are closed and re-opened the same way, so both halves stay
+    valid Markdown.
+    """
+    if len(text) <= limit:
+        return text, ""
+    window = text[:limit - 8]  # Room for a closing fence or entity markers
+    for separator in ("\n\n", "\n", ". ", " "):
+        at = window.rfind(separator)
+        if at > len(window) // 2:
+            cut = at + len(separator)
+            break
+    else:
+        cut = len(window)
+    
+    open_at, language = _open_fence(text[:cut])
+    if open_at is not None and open_at > len(window) // 4:
+        cut, open_at = open_at, None
+    elif open_at is not None:
+        code_start = text.find("\n", open_at) + 1
+        at = window.rfind("\n")
+        if at >= code_start:
+            cut = at + 1  # Between code lines
+        else:
+            cut = len(window)  # One code line longer than the window - split inside it
+    
+    head, rest = text[:cut], text[cut:]
+    if not markdown:
+        return head, rest
+    if open_at is not None:
+        reopen = f"```{language}\n"
+        # Every call must consume more than the fence it puts back, or callers loop forever
+        assert cut > len(reopen), "chunk would not advance past the re-opened fence"
+        return head.rstrip("\n") + "\n```", reopen + rest
+    markers = _open_markers(head)
+    if markers:
+        head = head.rstrip() + "".join(reversed(markers))
+        rest = "".join(markers) + rest.lstrip()
+    return head, rest
+
+
+def iter_message_chunks(text, limit=TELEGRAM_MAX_MESSAGE, markdown=True):
+    """Yield message-sized, Markdown-balanced chunks of text (lazily, so sending can start at once)"""
+    while text:
+        head, text = split_message_head(text, limit, markdown)
+        if head.strip():
+            yield head
+
+
+def send_markdown(chat_id, text, message_id=None, markdown=True):
+    """Send text (or edit message_id to it); falls back to plain text if Telegram can't parse the Markdown"""
+    parse_mode = 'Markdown' if markdown else None
+    try:
+        if message_id is not None:
+            return bot.edit_message_text(text, chat_id, message_id, parse_mode=parse_mode)
+        return bot.send_message(chat_id, text, parse_mode=parse_mode)
+    except telebot.apihelper.ApiTelegramException as e:
+        if not markdown or e.error_code != 400 or "parse" not in str(e.description):
+            raise
+        return send_markdown(chat_id, text, message_id, markdown=False)
+
+
+def send_reply_document(chat_id, text, file_name, caption=None):
+    document = io.BytesIO(text.encode("utf-8"))
+    return bot.send_document(chat_id, document, visible_file_name=file_name, caption=caption)
+
+
+def document_notice(text):
+    return f"\n\n📄 Jawab lamba hai ({len(text)} chars) - poora file mein bhej raha hoon."
+
+
+def send_long_reply(chat_id, text, message_id=None, markdown=True, file_name="reply.md", caption=None,
+                    document_text=None):
+    """Deliver a reply of any length.
+
+    The first chunk replaces ``message_id`` (the "thinking..." placeholder)
+    when given and the rest follow as new messages. Replies longer than
+    REPLY_DOCUMENT_CHARS are sent as a preview plus the full text as a
+    document (``document_text`` if given) instead of a long run of messages.
+    """
+    if len(text) > REPLY_DOCUMENT_CHARS:
+        notice = document_notice(text)
+        preview, _ = split_message_head(text, REPLY_PREVIEW_CHARS, markdown)
+        send_markdown(chat_id, preview.rstrip() + notice, message_id, markdown)
+        send_reply_document(chat_id, document_text or text, file_name, caption)
+        return
+    for chunk in iter_message_chunks(text, markdown=markdown):
+        send_markdown(chat_id, chunk, message_id, markdown)
+        message_id = None
+
+
+# ============ STREAMING REPLIES ============
+class StreamingReply:
+    """Progressively edit a placeholder message as streamed text arrives.
+
+    Edits happen once at least ``edit_chars`` new characters have arrived and
+    ``min_interval`` seconds have passed since the previous edit (Telegram
+    allows roughly one edit per second per chat). Text beyond 4096 chars rolls
+    over into a fresh message at a boundary picked by ``split_message_head``,
+    so finished chunks go out while the reply is still being generated.
+    Intermediate edits are plain text so a half streamed Markdown entity
+    can't fail; the final edit tries Markdown first. Past ``document_chars``
+    the chat stops growing and the full reply is sent as a document.
+    """
+    
+    def __init__(self, chat_id, message_id, header="", edit_chars=800, min_interval=1.5,
+                 document_chars=REPLY_DOCUMENT_CHARS):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.edit_chars = edit_chars
+        self.min_interval = min_interval
+        self.text = header
+        self.header_len = len(header)
+        self.shown = None
+        self.next_edit_at = 0.0
+        self.document_chars = document_chars
+        self.raw = ""  # Reply as streamed, without header or chunk repairs
+        self.overflow = False
+        self.parts = []  # Full text of messages already rolled over
+        self.edits = 0
+    
+    @property
+    def has_content(self):
+        return bool(self.raw)
+    
+    @property
+    def full_text(self):
+        return self.raw
+    
+    def _preview(self):
+        head, _ = split_message_head(self.text, TELEGRAM_MAX_MESSAGE - 100)
+        return head.rstrip() + document_notice(self.raw)
+    
+    def _edit(self, text, markdown=False, wait=False):
+        if text == self.shown:
+            return
+        delay = self.next_edit_at - time()
+        if delay > 0:
+            if not wait:
+                return
+            time_module.sleep(delay)
+        
+        try:
+            bot.edit_message_text(text, self.chat_id, self.message_id, parse_mode='Markdown' if markdown else None)
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code == 429:
+                retry_after = (e.result_json or {}).get("parameters", {}).get("retry_after", 5)
+                self.next_edit_at = time() + retry_after
+                if wait:
+                    return self._edit(text, markdown, wait)
+                return
+            if markdown:
+                return self._edit(text, markdown=False, wait=wait)
+            if "message is not modified" not in str(e.description):
+                raise
+        self.shown = text
+        self.edits += 1
+        self.next_edit_at = time() + self.min_interval
+    
+    def feed(self, chunk):
+        self.raw += chunk
+        if self.overflow:
+            return
+        if len(self.raw) > self.document_chars:
+            self.overflow = True
+            self._edit(self._preview(), wait=True)
+            return
+        
+        self.text += chunk
+        while len(self.text) > TELEGRAM_MAX_MESSAGE:
+            head, self.text = split_message_head(self.text)
+            self._edit(head, markdown=True, wait=True)
+            self.parts.append(head)
+            self.message_id = bot.send_message(self.chat_id, "✍️ ...").message_id
+            self.shown = None
+        
+        unseen = len(self.text) - len(self.shown or "")
+        if unseen >= self.edit_chars:
+            self._edit(self.text)
+    
+    def finish(self):
+        """Final edit; returns the streamed reply (without header)"""
+        if self.overflow:
+            self._edit(self._preview(), markdown=True, wait=True)
+            send_reply_document(self.chat_id, self.raw, "reply.md", caption="🧠 Deep Thinking Result")
+        else:
+            self._edit(self.text, markdown=True, wait=True)
+        return self.full_text
+
+@bot.message_handler(commands=['jobs'])
+@error_handler
+def handle_jobs(message):
+    if generation_jobs is None:
+        bot.send_message(message.chat.id, "Background jobs band hain.")
+        return
+    
+    jobs = generation_jobs.list_jobs(message.chat.id)
+    if not jobs:
+        bot.send_message(message.chat.id, "🧾 Koi generation job nahi mila.")
+        return
+    
+    icons = {"queued": "🕒", "running": "⏳", "done": "✅", "failed": "❌"}
+    lines = ["🧾 **Your generation jobs:**", ""]
+    for job in jobs:
+        line = f"{icons.get(job['status'], '•')} `{job['id']}` {job['kind']} - {job['status']}: {job['prompt'][:40]}"
+        if job["status"] == "failed" and job["error"]:
+            line += f" ({job['error'][:60]})"
+        lines.append(line)
+    bot.send_message(message.chat.id, "\n".join(lines), parse_mode='Markdown')
+
+@bot.message_handler(commands=['usage'])
+@error_handler
+def handle_usage(message):
+    chat_id = message.chat.id
+    if usage_ledger is None:
+        bot.send_message(chat_id, "Usage tracking band hai.")
+        return
+    
+    args = (message.text or "").split()[1:]
+    is_admin = bool(ADMIN_ID) and chat_id == ADMIN_ID
+    if is_admin and args and args[0] == "report":
+        report = usage_ledger.day_report(args[1] if len(args) > 1 else None)
+        send_markdown(chat_id, usage_ledger.format_day_report(report))
+        return
+    
+    user_id = int(args[0]) if is_admin and args and args[0].lstrip('-').isdigit() else chat_id
+    report = usage_ledger.user_report(user_id)
+    daily = f"{usage_ledger.daily_credits:g}" if usage_ledger.daily_credits else "∞"
+    monthly = f"{usage_ledger.monthly_credits:g}" if usage_ledger.monthly_credits else "∞"
+    lines = [
+        f"📈 **Usage {report['day']}**" + (f" - user `{user_id}`" if user_id != chat_id else ""), "",
+        f"Aaj: {report['day_credits']:.1f} / {daily} credits",
+        f"Is mahine: {report['month_credits']:.1f} / {monthly} credits", ""
+    ]
+    for intent, calls, tokens, seconds, credits in report["intents"]:
+        line = f"• `{intent}`: {calls} requests, ~{tokens} tokens"
+        if seconds >= 1:
+            line += f", {seconds:.0f}s generation"
+        lines.append(line + f" → {credits:.1f} credits")
+    if not report["intents"]:
+        lines.append("Aaj abhi tak kuch use nahi hua.")
+    if is_admin:
+        lines += ["", "Admin: /usage report [YYYY-MM-DD] | /usage <user_id>"]
+    send_markdown(chat_id, "\n".join(lines))
+
 # ============ FEATURE HANDLERS (NO BUTTON FLOWS) ============
+def record_usage(user_id, intent, *texts):
+    """Charge a finished text request by the tokens it sent and received"""
+    if usage_ledger is not None:
+        usage_ledger.record(user_id, intent, sum(estimate_tokens(text) for text in texts))
+
 
 def run_deep_thinking(user_id, user_text):
     if not rate_limiter.is_allowed(user_id, 'thinking'):
@@ -538,21 +5059,45 @@ def run_deep_thinking(user_id, user_text):
     thinking_msg = bot.send_message(user_id, "🧠 गहराई से सोच रहा हूँ... (30-60 sec लग सकते हैं)")
     context = conversation_memory.get_context_string(user_id, last_n=3)
     
-    response = ai_client.deep_thinking_chat(user_text, context)
+    if STREAMING_ENABLED:
+        stream_deep_thinking(user_id, user_text, context, thinking_msg)
+        return
+    
+    response = call_ai("deep_thinking_chat", user_text, context)
     if "error" not in response:
         ai_reply = response.get("response", "कोई reply नहीं मिला")
         conversation_memory.add_message(user_id, "bot", ai_reply)
+        record_usage(user_id, "deep_thinking", user_text, context, ai_reply)
         final_text = f"🧠 **Deep Thinking Result:**\n\n{ai_reply}"
-        if len(final_text) > 4096:
-            for i in range(0, len(final_text), 4096):
-                bot.send_message(user_id, final_text[i:i+4096], parse_mode='Markdown')
-            bot.delete_message(user_id, thinking_msg.message_id)
-        else:
-            bot.edit_message_text(final_text, user_id, thinking_msg.message_id, parse_mode='Markdown')
+        send_long_reply(user_id, final_text, thinking_msg.message_id, caption="🧠 Deep Thinking Result")
     else:
         bot.edit_message_text(f"❌ Error: {response['error']}", user_id, thinking_msg.message_id)
 
 
+def stream_deep_thinking(user_id, user_text, context, thinking_msg):
+    reply = StreamingReply(
+        user_id, thinking_msg.message_id,
+        header="🧠 **Deep Thinking Result:**\n\n",
+        edit_chars=STREAM_EDIT_CHARS,
+        min_interval=STREAM_EDIT_INTERVAL
+    )
+    try:
+        for chunk in ai_client.deep_thinking_chat_stream(user_text, context):
+            reply.feed(chunk)
+    except Exception as e:
+        logger.error(f"Deep thinking stream error: {e}")
+        if not reply.has_content:
+            bot.edit_message_text(f"❌ Error: {e}", user_id, reply.message_id)
+            return
+        reply.feed("\n\n⚠️ (reply adhoora reh gaya)")
+    
+    if not reply.has_content:
+        reply.feed("कोई reply नहीं मिला")
+    ai_reply = reply.finish()
+    conversation_memory.add_message(user_id, "bot", ai_reply)
+    record_usage(user_id, "deep_thinking", user_text, context, ai_reply)
+
+
 def run_image_generation(user_id, user_text):
     if not rate_limiter.is_allowed(user_id, 'generation'):
         bot.send_message(user_id, "⚠️ Image generation limit cross ho gaya, thoda wait karo.")
@@ -560,17 +5105,14 @@ def run_image_generation(user_id, user_text):
     
     conversation_memory.add_message(user_id, "user", f"Image: {user_text}")
     processing = bot.send_message(user_id, "🎨 Image ban rahi hai... 30-90 sec wait karo...")
-    response = ai_client.generate_image(user_text, style="realistic")
+    if generation_jobs is not None:
+        job_id = generation_jobs.submit(user_id, "image", user_text, processing.message_id)
+        bot.edit_message_text(f"🎨 Image ban rahi hai... (job {job_id})\nReady hote hi yahin bhej dunga. Status: /jobs", user_id, processing.message_id)
+        return
     
-    if "error" not in response and "image_url" in response:
-        try:
-            bot.send_photo(user_id, response["image_url"], caption=f"🖼️ {user_text[:80]}...", parse_mode='Markdown')
-            bot.delete_message(user_id, processing.message_id)
-            conversation_memory.add_message(user_id, "bot", f"Image generated")
-        except Exception as e:
-            bot.edit_message_text(f"❌ Send error: {str(e)[:80]}", user_id, processing.message_id)
-    else:
-        bot.edit_message_text(f"❌ Image generation failed: {response.get('error', 'Unknown error')}", user_id, processing.message_id)
+    started_at = time()
+    response = call_ai("generate_image", user_text, style="realistic")
+    deliver_generation(user_id, "image", user_text, response, processing.message_id, started_at)
 
 
 def run_video_generation(user_id, user_text):
@@ -580,17 +5122,14 @@ def run_video_generation(user_id, user_text):
     
     conversation_memory.add_message(user_id, "user", f"Video: {user_text}")
     processing = bot.send_message(user_id, "🎥 Video ban rahi hai... 2-5 minute wait karo...")
-    response = ai_client.generate_video(user_text, duration=10)
+    if generation_jobs is not None:
+        job_id = generation_jobs.submit(user_id, "video", user_text, processing.message_id)
+        bot.edit_message_text(f"🎥 Video ban rahi hai... (job {job_id})\nReady hote hi yahin bhej dunga. Status: /jobs", user_id, processing.message_id)
+        return
     
-    if "error" not in response and "video_url" in response:
-        try:
-            bot.send_video(user_id, response["video_url"], caption=f"🎬 {user_text[:80]}...", parse_mode='Markdown')
-            bot.delete_message(user_id, processing.message_id)
-            conversation_memory.add_message(user_id, "bot", f"Video generated")
-        except Exception as e:
-            bot.edit_message_text(f"❌ Send error: {str(e)[:80]}", user_id, processing.message_id)
-    else:
-        bot.edit_message_text(f"❌ Video generation failed: {response.get('error', 'Unknown error')}", user_id, processing.message_id)
+    started_at = time()
+    response = call_ai("generate_video", user_text, duration=10)
+    deliver_generation(user_id, "video", user_text, response, processing.message_id, started_at)
 
 
 def run_code_generation(user_id, user_text):
@@ -600,16 +5139,14 @@ def run_code_generation(user_id, user_text):
     
     conversation_memory.add_message(user_id, "user", f"Code: {user_text}")
     bot.send_message(user_id, "💻 Code likh raha hoon...")
-    response = ai_client.generate_code(user_text, language="python")
+    response = call_ai("generate_code", user_text, language="python")
     
     if "error" not in response and "code" in response:
         code = response["code"]
         conversation_memory.add_message(user_id, "bot", "Code generated")
-        if len(code) > 4096:
-            for i in range(0, len(code), 4096):
-                bot.send_message(user_id, f"```python\n{code[i:i+4096]}\n```", parse_mode='Markdown')
-        else:
-            bot.send_message(user_id, f"```python\n{code}\n```", parse_mode='Markdown')
+        record_usage(user_id, "code", user_text, code)
+        send_long_reply(user_id, f"```python\n{code}\n```", file_name="code.py", caption="💻 Code",
+                        document_text=code)
     else:
         bot.send_message(user_id, f"❌ Code generation failed: {response.get('error', 'Unknown')}")
 
@@ -620,13 +5157,18 @@ def run_translation(user_id, user_text):
         return
     
     conversation_memory.add_message(user_id, "user", f"Translate: {user_text}")
-    bot.send_message(user_id, "🌐 Translate ho raha hai...")
-    response = ai_client.translate(user_text, target_language="hindi")
+    source_text, target_language = parse_translation_request(user_text)
+    bot.send_message(user_id, f"🌐 {target_language.title()} mein translate ho raha hai...")
+    if translation_batcher is not None:
+        response = translation_batcher.translate(source_text, target_language)
+    else:
+        response = call_ai("translate", source_text, target_language=target_language)
     
     if "error" not in response and "translated_text" in response:
         translation = response["translated_text"]
         conversation_memory.add_message(user_id, "bot", translation)
-        bot.send_message(user_id, f"✅ **Translated:**\n\n{translation}", parse_mode='Markdown')
+        record_usage(user_id, "translate", source_text, translation)
+        send_long_reply(user_id, f"✅ **Translated:**\n\n{translation}", file_name="translation.txt")
     else:
         bot.send_message(user_id, f"❌ Translation failed: {response.get('error', 'Unknown')}")
 
@@ -638,55 +5180,69 @@ def run_smart_chat(user_id, user_text):
     
     conversation_memory.add_message(user_id, "user", user_text)
     thinking = bot.send_message(user_id, "💬 सोच रहा हूँ...")
-    context = conversation_memory.get_context_string(user_id, last_n=3)
-    response = ai_client.standard_chat(user_text, context)
+    context = ""
+    if len(conversation_memory.get_history(user_id, last_n=2)) > 1:
+        # A first turn's context is just the message itself - send it bare so it can hit the cache
+        context = conversation_memory.get_context_string(user_id, last_n=3)
+    response = call_ai("standard_chat", user_text, context)
     
     if "error" not in response:
         ai_reply = response.get("response", "कोई reply नहीं")
         conversation_memory.add_message(user_id, "bot", ai_reply)
-        if len(ai_reply) > 4096:
-            for i in range(0, len(ai_reply), 4096):
-                bot.send_message(user_id, ai_reply[i:i+4096])
-            bot.delete_message(user_id, thinking.message_id)
-        else:
-            bot.edit_message_text(ai_reply, user_id, thinking.message_id)
+        record_usage(user_id, "chat", user_text, context, ai_reply)
+        send_long_reply(user_id, ai_reply, thinking.message_id, markdown=False, file_name="reply.txt")
     else:
         bot.edit_message_text(f"❌ Error: {response['error']}", user_id, thinking.message_id)
 
 
+# Intent type -> (handler, scheduler lane). Lanes match AdvancedRateLimiter tiers.
+INTENT_ROUTES = {
+    "deep_thinking": (run_deep_thinking, 'thinking'),
+    "image": (run_image_generation, 'generation'),
+    "video": (run_video_generation, 'generation'),
+    "code": (run_code_generation, 'standard'),
+    "translate": (run_translation, 'standard'),
+    "chat": (run_smart_chat, 'standard')
+}
+
 # ============ DEFAULT HANDLER (PURE NLP + DETECTION) ============
+def run_timed_handler(intent_type, handler, user_id, text):
+    with handler_latency.time(intent_type):
+        handler(user_id, text)
+
 @bot.message_handler(func=lambda m: True)
 @error_handler
 def handle_any_message(message):
     user_id = message.chat.id
     text = message.text or ""
     
-    # Basic rate limit check
-    if not rate_limiter.is_allowed(user_id, 'standard'):
-        bot.send_message(user_id, "⚠️ Rate limit cross ho gaya, thoda wait karo.")
-        return
-    
-    # Detect intent
+    # Detect intent (the handler charges its own rate-limit tier)
     intent = intent_recognizer.recognize_intent(text)
     logger.info(f"User {user_id} intent: {intent}")
+    intent_counter.inc(intent["type"])
     
-    if intent["type"] == "deep_thinking":
-        run_deep_thinking(user_id, text)
-    elif intent["type"] == "image":
-        run_image_generation(user_id, text)
-    elif intent["type"] == "video":
-        run_video_generation(user_id, text)
-    elif intent["type"] == "code":
-        run_code_generation(user_id, text)
-    elif intent["type"] == "translate":
-        run_translation(user_id, text)
-    else:
-        run_smart_chat(user_id, text)
+    # Cost-aware quota check
+    if usage_ledger is not None:
+        refusal = usage_ledger.admit(user_id, intent["type"], text)
+        if refusal:
+            bot.send_message(user_id, refusal)
+            return
+    
+    handler, lane = INTENT_ROUTES.get(intent["type"], (run_smart_chat, 'standard'))
+    if chat_scheduler is None:
+        run_timed_handler(intent["type"], handler, user_id, text)
+    elif not chat_scheduler.submit(user_id, lane, run_timed_handler, intent["type"], handler, user_id, text):
+        bot.send_message(user_id, "⚠️ Pehle wale messages abhi process ho rahe hain, thoda wait karo.")
 
 
 # ============ FLASK SERVER ============
 def run_flask():
-    app.run(host='0.0.0.0', port=PORT, debug=False, use_reloader=False)
+    """Bind the port right away (Render waits for it) and serve on a daemon thread"""
+    server = make_server('0.0.0.0', PORT, app, threaded=True)
+    startup_timer.mark("port_bound")
+    thread = threading.Thread(target=server.serve_forever, daemon=True, name="flask")
+    thread.start()
+    return thread
 
 # ============ MAIN ============
 if __name__ == "__main__":
@@ -701,15 +5257,65 @@ if __name__ == "__main__":
     logger.info(f"🧠 Deep Thinking Model: {DEEP_THINKING_MODEL}")
     logger.info(f"💬 Standard Model: {STANDARD_MODEL}")
     logger.info(f"🌐 Flask Port: {PORT}")
-    logger.info(f"📊 API Health: {'✅ HEALTHY' if ai_client.check_health() else '❌ OFFLINE'}")
+    startup_timer.mark("module_loaded")
     
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
+    # A generated secret only works where this process registers the webhook itself;
+    # remote shard workers and routers must share one from the environment
+    if not WEBHOOK_SECRET_SET and (SHARD_WORKER_URLS or (webhook_ingestor is not None and not WEBHOOK_REGISTER)):
+        logger.error("❌ WEBHOOK_SECRET set karo - shard workers bina secret ke forwarded updates accept nahi karenge")
+        sys.exit(1)
+    
+    # Port first: the platform health check and webhook can reach us while the rest starts
+    flask_thread = run_flask()
     logger.info(f"✅ Flask server started on port {PORT}")
     
+    if shard_router is not None:
+        # Router only forwards updates; the workers run handlers, jobs and memory
+        if SHARED_STATE == 'unix':
+            SharedStateServer(SHARED_STATE_SOCKET).start()
+        if SHARD_PROCESSES:
+            shard_router.spawn_local_workers(SHARD_PROCESSES, SHARD_BASE_PORT)
+        shard_router.start()
+    else:
+        health_monitor.start()
+        rate_limiter.start_sweeper(RATE_LIMIT_SWEEP_INTERVAL)
+        if usage_ledger is not None:
+            usage_ledger.start()
+        if isinstance(intent_recognizer, ModelIntentRecognizer):
+            intent_recognizer.start()
+        conversation_memory.start_sweeper()
+        if generation_jobs is not None:
+            generation_jobs.start()
+        if conversation_store is not None:
+            conversation_store.start()
+            logger.info(f"💾 Conversation store: {conversation_store.name} (lazy per-user loading)")
+    
     try:
-        logger.info("🚀 Bot polling started...")
-        bot.infinity_polling()
+        if shard_router is not None:
+            logger.info(f"🔀 Shard router: {len(shard_router.worker_urls)} workers, shared state: {SHARED_STATE}")
+            webhook = f"{WEBHOOK_URL.rstrip('/')}/webhook" if WEBHOOK_URL and WEBHOOK_REGISTER else None
+            if webhook and bot.set_webhook(url=webhook, secret_token=WEBHOOK_SECRET):
+                logger.info(f"🚀 Router webhook: {webhook}")
+                flask_thread.join()
+            else:
+                shard_router.poll_forever()
+        elif dispatcher is not None:
+            logger.info(f"🚀 Async dispatch started (max {MAX_CONCURRENT_UPDATES} concurrent updates)...")
+            dispatcher.run_forever()
+        elif webhook_ingestor is not None:
+            webhook_ingestor.start()
+            if not WEBHOOK_REGISTER:
+                logger.info(f"🚀 Shard worker {SHARD_INDEX}: accepting forwarded updates on /webhook")
+                flask_thread.join()
+            elif WEBHOOK_URL and webhook_ingestor.register(f"{WEBHOOK_URL.rstrip('/')}/webhook", WEBHOOK_SECRET):
+                logger.info(f"🚀 Webhook mode: {WEBHOOK_URL}/webhook ({WEBHOOK_WORKERS} workers)")
+                flask_thread.join()
+            else:
+                logger.warning("⚠️ Webhook not registered - falling back to polling")
+                webhook_ingestor.poll_forever()
+        else:
+            logger.info("🚀 Bot polling started...")
+            bot.infinity_polling()
     except Exception as e:
         logger.error(f"❌ Bot error: {e}")
         raise
@@ -0,0 +1,40 @@
+"""Regression tests for split_message_head / iter_message_chunks."""
+
+import os
+import sys
+from itertools import islice
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import TELEGRAM_MAX_MESSAGE, iter_message_chunks, split_message_head  # noqa: E402
+
+
+def chunks(text):
+    # islice bounds the run, so a chunker that stops advancing fails instead of hanging
+    result = list(islice(iter_message_chunks(text), 50))
+    assert len(result) < 50, "chunker did not advance"
+    return result
+
+
+def test_long_single_line_fenced_block():
+    text = "```python\n" + "x" * 5000 + "\n```"
+    parts = chunks(text)
+    assert len(parts) == 2
+    assert all(len(part) <= TELEGRAM_MAX_MESSAGE for part in parts)
+    assert all(part.startswith("```python\n") and part.endswith("```") for part in parts)
+    assert "".join(part[len("```python\n"):-len("\n```")] for part in parts) == "x" * 5000
+
+
+def test_unterminated_fence():
+    text = "```python\n" + "y = 1\n" * 2000
+    parts = chunks(text)
+    assert all(len(part) <= TELEGRAM_MAX_MESSAGE for part in parts)
+    assert sum(part.count("y = 1") for part in parts) == 2000
+    assert all(part.startswith("```python\n") for part in parts)
+
+
+def test_head_always_consumes_more_than_reopened_fence():
+    text = "```python\n" + "x" * 5000 + "\n```"
+    head, rest = split_message_head(text)
+    assert head != "```python\n```"
+    assert len(rest) < len(text)